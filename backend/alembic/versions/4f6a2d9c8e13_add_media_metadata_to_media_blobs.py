@@ -0,0 +1,44 @@
+"""add_media_metadata_to_media_blobs
+
+Revision ID: 4f6a2d9c8e13
+Revises: 7b3e9f1c4a62
+Create Date: 2026-10-17 18:02:47.284619
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f6a2d9c8e13'
+down_revision: Union[str, None] = '7b3e9f1c4a62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('media_blobs', sa.Column('duration', sa.Float(), nullable=True))
+    op.add_column('media_blobs', sa.Column('width', sa.Integer(), nullable=True))
+    op.add_column('media_blobs', sa.Column('height', sa.Integer(), nullable=True))
+    op.add_column('media_blobs', sa.Column('fps', sa.Float(), nullable=True))
+    op.add_column('media_blobs', sa.Column('video_codec', sa.String(), nullable=True))
+    op.add_column('media_blobs', sa.Column('audio_codec', sa.String(), nullable=True))
+    op.add_column('media_blobs', sa.Column('bit_rate', sa.BigInteger(), nullable=True))
+    op.add_column('media_blobs', sa.Column('format_name', sa.String(), nullable=True))
+    op.add_column('media_blobs', sa.Column('probe', sa.Text(), nullable=True))
+    op.add_column('media_blobs', sa.Column('probed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('media_blobs', 'probed_at')
+    op.drop_column('media_blobs', 'probe')
+    op.drop_column('media_blobs', 'format_name')
+    op.drop_column('media_blobs', 'bit_rate')
+    op.drop_column('media_blobs', 'audio_codec')
+    op.drop_column('media_blobs', 'video_codec')
+    op.drop_column('media_blobs', 'fps')
+    op.drop_column('media_blobs', 'height')
+    op.drop_column('media_blobs', 'width')
+    op.drop_column('media_blobs', 'duration')
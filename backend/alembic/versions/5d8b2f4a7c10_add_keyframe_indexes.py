@@ -0,0 +1,44 @@
+"""add_keyframe_indexes
+
+Revision ID: 5d8b2f4a7c10
+Revises: c52f7a9e1d36
+Create Date: 2026-10-17 14:02:15.337920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d8b2f4a7c10'
+down_revision: Union[str, None] = 'c52f7a9e1d36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('keyframe_indexes',
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('manual_id', sa.String(), nullable=False),
+        sa.Column('source_key', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False, server_default='pending'),
+        sa.Column('step_times', sa.Text(), nullable=True),
+        sa.Column('keyframes', sa.Text(), nullable=True),
+        sa.Column('storage_key', sa.String(), nullable=True),
+        sa.Column('size', sa.BigInteger(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['manual_id'], ['manuals.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_keyframe_indexes_id'), 'keyframe_indexes', ['id'], unique=False)
+    op.create_index(op.f('ix_keyframe_indexes_manual_id'), 'keyframe_indexes', ['manual_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_keyframe_indexes_manual_id'), table_name='keyframe_indexes')
+    op.drop_index(op.f('ix_keyframe_indexes_id'), table_name='keyframe_indexes')
+    op.drop_table('keyframe_indexes')
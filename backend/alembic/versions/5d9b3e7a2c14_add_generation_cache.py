@@ -0,0 +1,51 @@
+"""add_generation_cache
+
+Revision ID: 5d9b3e7a2c14
+Revises: c47e2a9d1f86
+Create Date: 2026-10-17 21:48:31.207554
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d9b3e7a2c14'
+down_revision: Union[str, None] = 'c47e2a9d1f86'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('generation_cache_entries',
+        sa.Column('cache_key', sa.String(), nullable=False),
+        sa.Column('video_hash', sa.String(), nullable=False),
+        sa.Column('model', sa.String(), nullable=False),
+        sa.Column('language', sa.String(), nullable=False),
+        sa.Column('prompt_version', sa.Integer(), nullable=False),
+        sa.Column('raw_response', sa.Text(), nullable=False),
+        sa.Column('manual_content', sa.Text(), nullable=False),
+        sa.Column('size_bytes', sa.Integer(), nullable=False),
+        sa.Column('hit_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('last_used_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('cache_key')
+    )
+    op.create_index(op.f('ix_generation_cache_entries_video_hash'), 'generation_cache_entries', ['video_hash'], unique=False)
+    op.create_index(op.f('ix_generation_cache_entries_last_used_at'), 'generation_cache_entries', ['last_used_at'], unique=False)
+
+    counters = op.create_table('generation_cache_counters',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('value', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(counters, [{'name': name, 'value': 0} for name in ('hits', 'misses', 'evictions')])
+
+
+def downgrade() -> None:
+    op.drop_table('generation_cache_counters')
+    op.drop_index(op.f('ix_generation_cache_entries_last_used_at'), table_name='generation_cache_entries')
+    op.drop_index(op.f('ix_generation_cache_entries_video_hash'), table_name='generation_cache_entries')
+    op.drop_table('generation_cache_entries')
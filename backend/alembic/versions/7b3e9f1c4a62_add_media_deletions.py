@@ -0,0 +1,36 @@
+"""add_media_deletions
+
+Revision ID: 7b3e9f1c4a62
+Revises: e9a4c6d2b815
+Create Date: 2026-10-17 16:24:51.670193
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b3e9f1c4a62'
+down_revision: Union[str, None] = 'e9a4c6d2b815'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('media_deletions',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('storage_key', sa.String(), nullable=False),
+        sa.Column('not_before', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_media_deletions_storage_key'), 'media_deletions', ['storage_key'], unique=False)
+    op.create_index(op.f('ix_media_deletions_not_before'), 'media_deletions', ['not_before'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_media_deletions_not_before'), table_name='media_deletions')
+    op.drop_index(op.f('ix_media_deletions_storage_key'), table_name='media_deletions')
+    op.drop_table('media_deletions')
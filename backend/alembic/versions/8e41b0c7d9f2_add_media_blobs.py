@@ -0,0 +1,37 @@
+"""add_media_blobs
+
+Revision ID: 8e41b0c7d9f2
+Revises: 3a9c1e7b52d4
+Create Date: 2026-10-17 11:04:09.731822
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e41b0c7d9f2'
+down_revision: Union[str, None] = '3a9c1e7b52d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('media_blobs',
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('file_path', sa.String(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('sha256')
+    )
+    op.create_index(op.f('ix_media_blobs_file_path'), 'media_blobs', ['file_path'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_media_blobs_file_path'), table_name='media_blobs')
+    op.drop_table('media_blobs')
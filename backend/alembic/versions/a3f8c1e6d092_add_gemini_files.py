@@ -0,0 +1,38 @@
+"""add_gemini_files
+
+Revision ID: a3f8c1e6d092
+Revises: 5d9b3e7a2c14
+Create Date: 2026-10-17 22:20:14.593018
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f8c1e6d092'
+down_revision: Union[str, None] = '5d9b3e7a2c14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('gemini_files',
+        sa.Column('source_id', sa.String(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('uri', sa.String(), nullable=True),
+        sa.Column('mime_type', sa.String(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.Column('use_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('last_used_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('source_id')
+    )
+    op.create_index(op.f('ix_gemini_files_expires_at'), 'gemini_files', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_gemini_files_expires_at'), table_name='gemini_files')
+    op.drop_table('gemini_files')
@@ -0,0 +1,31 @@
+"""add_gemini_rate_buckets
+
+Revision ID: a7c3e91d5b26
+Revises: f6b2d8e4a170
+Create Date: 2026-10-18 01:42:37.205816
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c3e91d5b26'
+down_revision: Union[str, None] = 'f6b2d8e4a170'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('gemini_rate_buckets',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('level', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('gemini_rate_buckets')
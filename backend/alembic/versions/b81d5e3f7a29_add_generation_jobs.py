@@ -0,0 +1,54 @@
+"""add_generation_jobs
+
+Revision ID: b81d5e3f7a29
+Revises: 4f6a2d9c8e13
+Create Date: 2026-10-17 19:37:05.812340
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b81d5e3f7a29'
+down_revision: Union[str, None] = '4f6a2d9c8e13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('generation_jobs',
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('manual_id', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False, server_default='queued'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('max_attempts', sa.Integer(), nullable=False, server_default='3'),
+        sa.Column('available_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_by', sa.String(), nullable=True),
+        sa.Column('locked_until', sa.DateTime(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['manual_id'], ['manuals.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_generation_jobs_id'), 'generation_jobs', ['id'], unique=False)
+    op.create_index(op.f('ix_generation_jobs_manual_id'), 'generation_jobs', ['manual_id'], unique=False)
+    op.create_index('ix_generation_jobs_status_available_at', 'generation_jobs', ['status', 'available_at'], unique=False)
+    op.create_index(
+        'uq_generation_jobs_active_manual', 'generation_jobs', ['manual_id'], unique=True,
+        postgresql_where=sa.text("status IN ('queued', 'running')"),
+        sqlite_where=sa.text("status IN ('queued', 'running')")
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_generation_jobs_active_manual', table_name='generation_jobs')
+    op.drop_index('ix_generation_jobs_status_available_at', table_name='generation_jobs')
+    op.drop_index(op.f('ix_generation_jobs_manual_id'), table_name='generation_jobs')
+    op.drop_index(op.f('ix_generation_jobs_id'), table_name='generation_jobs')
+    op.drop_table('generation_jobs')
@@ -0,0 +1,40 @@
+"""add_scheduling_to_generation_jobs
+
+Revision ID: c47e2a9d1f86
+Revises: b81d5e3f7a29
+Create Date: 2026-10-17 21:12:48.460917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c47e2a9d1f86'
+down_revision: Union[str, None] = 'b81d5e3f7a29'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('generation_jobs', sa.Column('user_id', sa.String(), nullable=True))
+    op.add_column('generation_jobs', sa.Column('priority', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('generation_jobs', sa.Column('cost', sa.Float(), nullable=False, server_default='1'))
+    op.add_column('generation_jobs', sa.Column('virtual_start', sa.Float(), nullable=False, server_default='0'))
+    op.add_column('generation_jobs', sa.Column('virtual_finish', sa.Float(), nullable=False, server_default='0'))
+    op.create_foreign_key('fk_generation_jobs_user_id_users', 'generation_jobs', 'users', ['user_id'], ['id'], ondelete='SET NULL')
+    op.create_index(op.f('ix_generation_jobs_user_id'), 'generation_jobs', ['user_id'], unique=False)
+    op.create_index('ix_generation_jobs_status_priority_virtual_start', 'generation_jobs', ['status', 'priority', 'virtual_start'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_generation_jobs_status_priority_virtual_start', table_name='generation_jobs')
+    op.drop_index(op.f('ix_generation_jobs_user_id'), table_name='generation_jobs')
+    op.drop_constraint('fk_generation_jobs_user_id_users', 'generation_jobs', type_='foreignkey')
+    op.drop_column('generation_jobs', 'virtual_finish')
+    op.drop_column('generation_jobs', 'virtual_start')
+    op.drop_column('generation_jobs', 'cost')
+    op.drop_column('generation_jobs', 'priority')
+    op.drop_column('generation_jobs', 'user_id')
@@ -0,0 +1,46 @@
+"""add_media_renditions
+
+Revision ID: c52f7a9e1d36
+Revises: 8e41b0c7d9f2
+Create Date: 2026-10-17 13:21:47.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c52f7a9e1d36'
+down_revision: Union[str, None] = '8e41b0c7d9f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('media_renditions',
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('source_key', sa.String(), nullable=False),
+        sa.Column('source_hash', sa.String(length=64), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False, server_default='pending'),
+        sa.Column('storage_key', sa.String(), nullable=True),
+        sa.Column('size', sa.BigInteger(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('source_key', 'kind', 'version', name='uq_media_renditions_source_kind_version')
+    )
+    op.create_index(op.f('ix_media_renditions_id'), 'media_renditions', ['id'], unique=False)
+    op.create_index(op.f('ix_media_renditions_source_hash'), 'media_renditions', ['source_hash'], unique=False)
+    op.create_index(op.f('ix_media_renditions_source_key'), 'media_renditions', ['source_key'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_media_renditions_source_key'), table_name='media_renditions')
+    op.drop_index(op.f('ix_media_renditions_source_hash'), table_name='media_renditions')
+    op.drop_index(op.f('ix_media_renditions_id'), table_name='media_renditions')
+    op.drop_table('media_renditions')
@@ -0,0 +1,26 @@
+"""add_partial_steps_to_generation_jobs
+
+Revision ID: e2c7a4f9b351
+Revises: a3f8c1e6d092
+Create Date: 2026-10-17 22:51:37.128406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2c7a4f9b351'
+down_revision: Union[str, None] = 'a3f8c1e6d092'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('generation_jobs', sa.Column('partial_steps', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('generation_jobs', 'partial_steps')
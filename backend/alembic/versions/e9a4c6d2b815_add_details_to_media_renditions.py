@@ -0,0 +1,26 @@
+"""add_details_to_media_renditions
+
+Revision ID: e9a4c6d2b815
+Revises: 5d8b2f4a7c10
+Create Date: 2026-10-17 15:10:32.904615
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e9a4c6d2b815'
+down_revision: Union[str, None] = '5d8b2f4a7c10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('media_renditions', sa.Column('details', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('media_renditions', 'details')
@@ -0,0 +1,47 @@
+"""add_generation_runs
+
+Revision ID: f6b2d8e4a170
+Revises: e2c7a4f9b351
+Create Date: 2026-10-17 23:18:04.562931
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f6b2d8e4a170'
+down_revision: Union[str, None] = 'e2c7a4f9b351'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('generation_runs',
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('run_id', sa.String(), nullable=True),
+        sa.Column('manual_id', sa.String(), nullable=True),
+        sa.Column('model', sa.String(), nullable=False),
+        sa.Column('mode', sa.String(), nullable=True),
+        sa.Column('phase', sa.String(), nullable=False),
+        sa.Column('attempt', sa.Integer(), nullable=False, server_default='1'),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('duration_ms', sa.Float(), nullable=False),
+        sa.Column('request_bytes', sa.BigInteger(), nullable=True),
+        sa.Column('response_bytes', sa.BigInteger(), nullable=True),
+        sa.Column('prompt_tokens', sa.Integer(), nullable=True),
+        sa.Column('output_tokens', sa.Integer(), nullable=True),
+        sa.Column('total_tokens', sa.Integer(), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_generation_runs_run_id'), 'generation_runs', ['run_id'], unique=False)
+    op.create_index('ix_generation_runs_phase_model_started_at', 'generation_runs', ['phase', 'model', 'started_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_generation_runs_phase_model_started_at', table_name='generation_runs')
+    op.drop_index(op.f('ix_generation_runs_run_id'), table_name='generation_runs')
+    op.drop_table('generation_runs')
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+生成モード（動画 / キーフレーム）の比較ベンチマーク
+
+同じ画面録画から、動画をアップロードするモードと画面が変化したフレームだけを送るモードで
+マニュアルを生成し、送信サイズ・推定トークン数・所要時間・生成されたステップを比較します。
+
+ステップの品質は、正解のステップ（--reference、[{"title": ..., "time": "m:ss"}, ...] のJSON）
+に対する再現率・適合率で評価します。正解がない場合は動画モードの結果を基準にします。
+時刻が --tolerance 秒以内のステップを同じ操作とみなします。
+
+使い方（backendディレクトリで実行。--frames-only 以外は GEMINI_API_KEY が必要）:
+    python benchmarks/generation_modes.py recording.mp4 --runs 3
+    python benchmarks/generation_modes.py recording.mp4 --reference steps.json
+    python benchmarks/generation_modes.py recording.mp4 --frames-only
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def match_steps(reference: List[Dict[str, Any]], steps: List[Dict[str, Any]], tolerance: float) -> Dict[str, Any]:
+    """時刻の近いステップを1対1で対応付け、再現率・適合率・時刻の平均誤差を求める"""
+    from utils.timecode import parse_timecode
+
+    expected = [parse_timecode(step.get("time")) for step in reference]
+    actual = [parse_timecode(step.get("time")) for step in steps]
+    used = set()
+    errors = []
+    for seconds in expected:
+        if seconds is None:
+            continue
+        candidates = [
+            (abs(other - seconds), index) for index, other in enumerate(actual)
+            if other is not None and index not in used and abs(other - seconds) <= tolerance
+        ]
+        if candidates:
+            error, index = min(candidates)
+            used.add(index)
+            errors.append(error)
+    return {
+        "steps": len(steps),
+        "recall": len(errors) / len(reference) if reference else None,
+        "precision": len(errors) / len(steps) if steps else None,
+        "mean_time_error": statistics.mean(errors) if errors else None,
+    }
+
+
+async def measure_payloads(video_path: str) -> Dict[str, Any]:
+    """APIを呼ばずに、各モードで送るデータ量と推定トークン数を求める"""
+    from services.ffmpeg import run_ffprobe
+    from services.frame_sampling import estimate_frame_tokens, sample_frames
+    from services.gemini_service import gemini_service
+    from services.storage import storage, key_for_path
+
+    probe = await run_ffprobe(video_path)
+    duration = float(probe.get("format", {}).get("duration") or 0)
+
+    started = time.perf_counter()
+    upload_key = await gemini_service.prepare_upload_source(key_for_path(video_path))
+    proxy_seconds = time.perf_counter() - started
+    proxy_bytes = await storage.size(upload_key)
+
+    started = time.perf_counter()
+    frames = await sample_frames(video_path)
+    sampling_seconds = time.perf_counter() - started
+
+    return {
+        "duration": duration,
+        "video": {
+            "bytes": proxy_bytes,
+            "tokens": gemini_service.estimate_video_tokens(duration),
+            "prepare_seconds": proxy_seconds,
+        },
+        "keyframes": {
+            "frames": len(frames),
+            "bytes": sum(len(frame.data) for frame in frames),
+            "tokens": estimate_frame_tokens(frames),
+            "prepare_seconds": sampling_seconds,
+        },
+    }
+
+
+async def run_mode(mode: str, video_path: str, title: str, language: str, runs: int) -> Dict[str, Any]:
+    from services.gemini_service import gemini_service
+
+    generate = {
+        "video": gemini_service.generate_manual_from_video,
+        "keyframes": gemini_service.generate_manual_from_keyframes,
+    }[mode]
+    latencies = []
+    content = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        content = await generate(video_path=video_path, title=title, language=language)
+        latencies.append(time.perf_counter() - started)
+    return {"latencies": latencies, "steps": content["steps"] if content else []}
+
+
+def print_payloads(payloads: Dict[str, Any]) -> None:
+    video, keyframes = payloads["video"], payloads["keyframes"]
+    print(f"duration:          {payloads['duration']:.1f}s")
+    print(f"video payload:     {video['bytes'] / 1024:.0f}KB, ~{video['tokens']} tokens "
+          f"(proxy {video['prepare_seconds']:.1f}s)")
+    print(f"keyframes payload: {keyframes['frames']} frames, {keyframes['bytes'] / 1024:.0f}KB, "
+          f"~{keyframes['tokens']} tokens (sampling {keyframes['prepare_seconds']:.1f}s)")
+    if keyframes["bytes"] and keyframes["tokens"]:
+        print(f"reduction:         {video['bytes'] / keyframes['bytes']:.1f}x bytes, "
+              f"{video['tokens'] / keyframes['tokens']:.1f}x tokens")
+
+
+def print_quality(mode: str, result: Dict[str, Any], quality: Dict[str, Any]) -> None:
+    def fmt(value: Optional[float], pattern: str) -> str:
+        return "-" if value is None else pattern.format(value)
+
+    print(
+        f"{mode:<10} latency median {statistics.median(result['latencies']):6.1f}s"
+        f" (min {min(result['latencies']):.1f}s)"
+        f"  steps {quality['steps']:3d}"
+        f"  recall {fmt(quality['recall'], '{:.2f}')}"
+        f"  precision {fmt(quality['precision'], '{:.2f}')}"
+        f"  time error {fmt(quality['mean_time_error'], '{:.1f}s')}"
+    )
+
+
+async def run_benchmark(args: argparse.Namespace, video_path: str) -> None:
+    payloads = await measure_payloads(video_path)
+    print_payloads(payloads)
+    if args.frames_only:
+        return
+
+    results = {}
+    for mode in ("video", "keyframes"):
+        results[mode] = await run_mode(mode, video_path, args.title, args.language, args.runs)
+
+    if args.reference:
+        with open(args.reference, encoding="utf-8") as f:
+            reference = json.load(f)
+        print(f"reference:         {args.reference} ({len(reference)} steps)")
+    else:
+        reference = results["video"]["steps"]
+        print("reference:         video mode steps")
+    for mode, result in results.items():
+        print_quality(mode, result, match_steps(reference, result["steps"], args.tolerance))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"payloads": payloads, "results": results}, f, ensure_ascii=False, indent=2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video")
+    parser.add_argument("--title", default="操作マニュアル")
+    parser.add_argument("--language", default="ja")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--reference", help="正解のステップのJSONファイル")
+    parser.add_argument("--tolerance", type=float, default=3.0, help="同じ操作とみなす時刻の差（秒）")
+    parser.add_argument("--frames-only", action="store_true", help="APIを呼ばずに送信サイズだけを比較する")
+    parser.add_argument("--output", help="結果（ステップを含む）を保存するJSONファイル")
+    args = parser.parse_args()
+    if args.frames_only:
+        # APIを呼ばないのでキーは不要（GeminiService の初期化だけに使う）
+        os.environ.setdefault("GEMINI_API_KEY", "frames-only")
+
+    with tempfile.TemporaryDirectory() as upload_folder:
+        from config import settings
+        settings.upload_folder = upload_folder
+        settings.storage_backend = "local"
+        # 登録済みファイルの再利用（DBが必要）は使わず、毎回アップロードする
+        settings.gemini_file_reuse_enabled = False
+        # アップロード時の待ち時間も含めて比較するため、ストリーミングは使わない
+        settings.gemini_streaming_enabled = False
+
+        video_path = os.path.join(upload_folder, "bench" + os.path.splitext(args.video)[1].lower())
+        shutil.copy(args.video, video_path)
+        asyncio.run(run_benchmark(args, video_path))
+
+
+if __name__ == "__main__":
+    main()
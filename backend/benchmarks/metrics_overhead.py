@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+メトリクス記録のオーバーヘッド計測
+
+同じ最小構成の FastAPI アプリを MetricsMiddleware あり・なしで用意し、
+ネットワークを介さず ASGI を直接呼び出して1リクエストあたりの処理時間を比較します。
+差分がリクエストごとに増える処理時間（ルートの特定とヒストグラムへの記録）です。
+あわせて、記録済みのヒストグラムを Prometheus 形式に書き出す時間も計測します。
+
+使い方（backendディレクトリで実行）:
+    python benchmarks/metrics_overhead.py --requests 20000 --routes 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def create_app(with_metrics: bool, routes: int):
+    from fastapi import FastAPI
+    from utils.metrics import MetricsMiddleware, LabelledHistogram, REQUEST_BUCKETS
+
+    app = FastAPI()
+    for index in range(routes):
+        @app.get(f"/api/items{index}/{{item_id}}")
+        async def get_item(item_id: str):
+            return {"id": item_id}
+
+    histogram = LabelledHistogram("bench_request_duration_seconds", "bench", REQUEST_BUCKETS)
+    if with_metrics:
+        app.add_middleware(MetricsMiddleware, histogram=histogram)
+    return app, histogram
+
+
+async def call(app, path: str) -> None:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure(app, requests: int, routes: int) -> float:
+    """1リクエストあたりの平均処理時間（マイクロ秒）"""
+    for index in range(200):
+        await call(app, f"/api/items{index % routes}/warmup")
+    started = time.perf_counter()
+    for index in range(requests):
+        await call(app, f"/api/items{index % routes}/{index}")
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+async def run(args: argparse.Namespace) -> None:
+    plain, _ = create_app(False, args.routes)
+    instrumented, histogram = create_app(True, args.routes)
+
+    # 交互に計測して、実行順による偏りを抑える
+    without, with_metrics = [], []
+    for _ in range(args.rounds):
+        without.append(await measure(plain, args.requests, args.routes))
+        with_metrics.append(await measure(instrumented, args.requests, args.routes))
+
+    base, measured = statistics.median(without), statistics.median(with_metrics)
+    print(f"without metrics: {base:8.1f}us/request")
+    print(f"with metrics:    {measured:8.1f}us/request")
+    print(f"overhead:        {measured - base:8.1f}us/request ({(measured - base) / base * 100:.1f}%)")
+
+    started = time.perf_counter()
+    body = "\n".join(histogram.render())
+    print(f"render:          {(time.perf_counter() - started) * 1000:8.2f}ms "
+          f"({args.routes} series, {len(body) / 1024:.0f}KB)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--routes", type=int, default=50, help="ルート数（ラベルの組み合わせの数）")
+    parser.add_argument("--rounds", type=int, default=5)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+アップロード時のメモリ使用量ベンチマーク
+
+アップロード用ルーターだけを載せたAPIサーバーを別プロセスで起動し、
+N本の大きな動画を同時にアップロードしながらサーバープロセスのRSSを計測します。
+ストリーミング書き込みが効いていれば、同時アップロード数に関係なくRSSはほぼ一定になります。
+
+使い方（backendディレクトリで実行）:
+    python benchmarks/upload_memory.py --concurrency 20 --size-mb 99
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+HOST = "127.0.0.1"
+BOUNDARY = "----torisetsu-bench-boundary"
+
+
+def create_app(upload_folder: str):
+    """認証とDBを差し替えたアップロード専用アプリを作成"""
+    from fastapi import FastAPI
+    from config import settings
+    from database import get_db
+    from routers import upload
+    from routers.auth import get_current_user
+    from utils.upload_stream import RequestSizeLimitMiddleware, MULTIPART_OVERHEAD
+
+    settings.upload_folder = upload_folder
+
+    app = FastAPI()
+    app.add_middleware(
+        RequestSizeLimitMiddleware,
+        limits={"/api/upload/video": settings.max_file_size + MULTIPART_OVERHEAD},
+    )
+    app.include_router(upload.router, prefix="/api/upload")
+    app.dependency_overrides[get_current_user] = lambda: None
+    app.dependency_overrides[get_db] = lambda: None
+    return app
+
+
+def run_server(port: int, upload_folder: str) -> None:
+    import uvicorn
+    uvicorn.run(create_app(upload_folder), host=HOST, port=port, log_level="warning")
+
+
+def read_rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def upload_one(port: int, size: int, index: int) -> int:
+    """multipartボディを1MBずつ生成しながら送信し、HTTPステータスを返す"""
+    head = (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="bench_{index}.mp4"\r\n'
+        "Content-Type: video/mp4\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{BOUNDARY}--\r\n".encode()
+    content_length = len(head) + size + len(tail)
+
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(
+        (
+            "POST /api/upload/video HTTP/1.1\r\n"
+            f"Host: {HOST}:{port}\r\n"
+            f"Content-Type: multipart/form-data; boundary={BOUNDARY}\r\n"
+            f"Content-Length: {content_length}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode()
+        + head
+    )
+    chunk = b"\0" * (1024 * 1024)
+    remaining = size
+    try:
+        while remaining > 0:
+            part = chunk[: min(len(chunk), remaining)]
+            writer.write(part)
+            await writer.drain()
+            remaining -= len(part)
+        writer.write(tail)
+        await writer.drain()
+    except (ConnectionResetError, BrokenPipeError):
+        # サイズ超過などでサーバーが先に応答して接続を閉じた場合
+        pass
+
+    try:
+        status_line = await reader.readline()
+    except ConnectionResetError:
+        return -1
+    finally:
+        writer.close()
+    return int(status_line.split()[1]) if status_line else -1
+
+
+async def run_benchmark(port: int, pid: int, concurrency: int, size: int) -> None:
+    samples = []
+    done = asyncio.Event()
+
+    async def sample_rss():
+        while not done.is_set():
+            samples.append(read_rss_mb(pid))
+            await asyncio.sleep(0.1)
+
+    baseline = read_rss_mb(pid)
+    sampler = asyncio.create_task(sample_rss())
+    started = time.perf_counter()
+    statuses = await asyncio.gather(*(upload_one(port, size, i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await sampler
+
+    total_mb = concurrency * size / 1024 / 1024
+    print(f"uploads:        {concurrency} x {size / 1024 / 1024:.0f}MB ({total_mb:.0f}MB total)")
+    print(f"statuses:       {sorted(set(statuses))}")
+    print(f"elapsed:        {elapsed:.1f}s ({total_mb / elapsed:.0f}MB/s)")
+    print(f"baseline RSS:   {baseline:.1f}MB")
+    print(f"peak RSS:       {max(samples):.1f}MB")
+    print(f"RSS growth:     {max(samples) - baseline:.1f}MB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--size-mb", type=int, default=99)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as upload_folder:
+        server = multiprocessing.Process(target=run_server, args=(args.port, upload_folder), daemon=True)
+        server.start()
+        time.sleep(2)
+        try:
+            asyncio.run(run_benchmark(args.port, server.pid, args.concurrency, args.size_mb * 1024 * 1024))
+        finally:
+            server.terminate()
+            server.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -25,10 +25,142 @@ class Settings(BaseSettings):
     gemini_model: str = "gemini-2.0-flash"
     gemini_temperature: float = 0.7
     gemini_max_tokens: int = 8192
+    gemini_streaming_enabled: bool = True  # 生成結果をストリーミングで受け取り、完成したステップから保存する
+    
+    # Gemini video proxy settings（Geminiに送る前に低ビットレートの代理動画を作成）
+    gemini_use_video_proxy: bool = True
+    gemini_proxy_max_height: int = 720
+    gemini_proxy_fps: int = 2
+    gemini_proxy_crf: int = 32
+    gemini_proxy_keep_audio: bool = False  # ナレーションを解析に使う場合のみTrue
+    
+    # Idle trimming settings（画面が止まっていて無音の区間を除いてから Gemini に送る）
+    idle_trimming_enabled: bool = True
+    idle_min_seconds: float = 5.0  # これより短い停止は残す
+    idle_padding_seconds: float = 1.0  # 停止区間の前後に残す長さ（落ち着いた画面を見せるため）
+    idle_freeze_noise_db: float = -50.0  # freezedetect のノイズ許容値（圧縮ノイズを変化とみなさない）
+    idle_silence_noise_db: float = -35.0
+    idle_trimming_min_ratio: float = 0.1  # 除ける時間が動画の長さのこの割合未満なら元の動画を送る
+    
+    # Gemini generation mode settings（"video": 動画を送る / "keyframes": 画面が変化したフレームだけを画像として送る）
+    gemini_generation_mode: str = "video"
+    gemini_keyframe_scene_threshold: float = 0.01  # 画面の変化とみなす ffmpeg の scene スコア（画面録画の変化は小さい）
+    gemini_keyframe_min_interval_seconds: float = 1.0  # これより短い間隔の変化はまとめ、落ち着いた後のフレームを送る
+    gemini_keyframe_max_frames: int = 120  # 1回の生成で送るフレーム数の上限
+    gemini_keyframe_max_inline_bytes: int = 14 * 1024 * 1024  # 送る画像の合計の上限（REST では base64 で約4/3倍になり、リクエストの上限は約20MB）
+    
+    # Gemini file settings（アップロード済みの動画を有効期限の48時間まで使い回す）
+    gemini_file_reuse_enabled: bool = True
+    gemini_file_refresh_margin_seconds: int = 3600  # 残り時間がこれ未満のファイルは再アップロードする
+    gemini_file_idle_seconds: int = 6 * 3600  # この時間使われなかったファイルは Gemini から削除する
+    gemini_file_cleanup_interval_seconds: int = 600
+    
+    # Gemini rate limit settings（全プロセス共通のトークンバケット。プロジェクトのクォータより少し低めに設定する）
+    gemini_rate_limit_enabled: bool = True
+    gemini_requests_per_minute: int = 1000  # 0 で制限しない
+    gemini_tokens_per_minute: int = 1000000  # 0 で制限しない
+    gemini_rate_burst_seconds: float = 5.0  # 使われていないときに溜められる量（この秒数分の補充）
+    gemini_rate_output_tokens_estimate: int = 2000  # 生成前に予約する出力トークン数（応答後に実際の値で精算する）
     
     # File upload settings
     upload_folder: str = "./uploads"
     max_file_size: int = 100 * 1024 * 1024  # 100MB
+    max_audio_file_size: int = 10 * 1024 * 1024  # 10MB
+    upload_chunk_size: int = 1024 * 1024  # 1MB（ストリーミング書き込み時のバッファサイズ）
+    
+    # Storage settings（"local" または "s3"）
+    storage_backend: str = "local"
+    s3_endpoint_url: Optional[str] = None  # MinIOなどS3互換ストレージのURL
+    s3_bucket: str = "torisetsu-media"
+    s3_region: Optional[str] = None
+    s3_access_key_id: Optional[str] = None
+    s3_secret_access_key: Optional[str] = None
+    s3_multipart_chunk_size: int = 8 * 1024 * 1024  # 8MB（S3のパート最小サイズは5MB）
+    
+    # Media processing settings（ffmpeg）
+    media_max_concurrent_jobs: int = 2  # プロセスごとのffmpeg同時実行数
+    media_job_timeout_seconds: int = 1800
+    
+    # Playback rendition settings（ブラウザ再生用の faststart MP4 と HLS）
+    media_renditions_enabled: bool = True
+    hls_segment_seconds: int = 4
+    keyframe_alignment_enabled: bool = False  # ステップ時刻にキーフレームを揃えた動画を作成
+    
+    # Thumbnail settings（ステップのサムネイルとシーク用スプライト）
+    thumbnail_width: int = 320
+    sprite_interval_seconds: int = 5
+    sprite_tile_width: int = 160
+    sprite_columns: int = 10
+    sprite_rows: int = 10
+    
+    # Audio settings（ナレーション音声を Opus に変換し、ラウドネスを正規化）
+    audio_normalization_enabled: bool = True
+    audio_opus_bitrate: str = "32k"  # 音声（モノラル）向けのビットレート
+    audio_loudness_target: float = -16.0  # 統合ラウドネス（LUFS）
+    audio_true_peak: float = -1.5  # dBTP
+    audio_loudness_range: float = 11.0  # LU
+    
+    # Waveform settings（エディタの波形表示用のピーク）
+    waveform_sample_rate: int = 16000
+    waveform_samples_per_pixel: int = 256  # 最も詳細なズームレベル
+    waveform_zoom_levels: int = 6  # 2倍ずつ粗くしたレベル数
+    waveform_bits: int = 8  # 8 または 16
+    
+    # Generation job settings（生成ジョブのキューとワーカープロセス）
+    generation_worker_concurrency: int = 2  # ワーカープロセスごとの同時実行数
+    generation_worker_poll_interval_seconds: float = 2.0  # キューが空のときの確認間隔
+    generation_job_visibility_timeout_seconds: int = 300  # ハートビートが途絶えてから再実行するまでの時間
+    generation_job_max_attempts: int = 3
+    generation_job_retry_delay_seconds: int = 30  # 再試行までの待ち時間（試行ごとに倍）
+    generation_reaper_interval_seconds: int = 60  # 停止したジョブの回収間隔
+    generation_max_concurrent_jobs: int = 4  # 全ワーカー合計の同時実行数（Gemini のレート制限に合わせる）
+    generation_max_jobs_per_user: int = 2  # 1ユーザーが同時に使える実行枠
+    generation_bulk_threshold: int = 3  # 実行待ち・実行中がこの件数以上のユーザーの新規ジョブは bulk 扱い
+    generation_interactive_weight: float = 4.0  # interactive ジョブの重み（公平キューイングで消費する仮想時間が小さくなる）
+    
+    # Status event settings（エディタへのステータス配信。PostgreSQL の LISTEN/NOTIFY を使う）
+    status_events_keepalive_seconds: int = 15  # 接続維持のためのコメント送信間隔
+    status_events_reconnect_seconds: float = 2.0  # LISTEN 接続が切れたときの再接続までの待ち時間
+    status_events_fallback_poll_seconds: float = 3.0  # LISTEN/NOTIFY が使えないDB（SQLite）での確認間隔
+    
+    # Generation cache settings（同じ動画・プロンプト・モデルでの再生成は Gemini を呼ばない）
+    generation_cache_enabled: bool = True
+    generation_cache_max_bytes: int = 256 * 1024 * 1024  # 超えたら最終利用が古い順に削除
+    generation_cache_max_entries: int = 10000
+    
+    # Generation run settings（Gemini 呼び出しの段階ごとの所要時間・トークン数の記録）
+    generation_run_tracking_enabled: bool = True
+    generation_run_batch_size: int = 50  # この件数たまったらまとめて書き込む
+    generation_run_flush_seconds: float = 10.0  # 件数に達しなくても書き込む間隔
+    generation_run_retention_days: int = 30
+    
+    # Metrics settings（GET /metrics、Prometheus 形式）
+    metrics_enabled: bool = True  # リクエストの処理時間を記録する
+    
+    # Chunked generation settings（長い動画を区間に分けて並列に生成する）
+    chunked_generation_enabled: bool = True
+    generation_chunk_min_duration_seconds: int = 600  # これより長い動画を分割する
+    generation_segment_seconds: int = 300  # 1区間の目安の長さ
+    generation_segment_boundary_window_seconds: float = 30.0  # 区切りを場面転換・無音に寄せる範囲
+    generation_segment_concurrency: int = 4  # 1ジョブで同時に生成する区間数
+    generation_segment_dedup_seconds: float = 5.0  # 区切りの前後でこの時間内の似た手順は重複として除く
+    generation_scene_threshold: float = 0.3  # 場面転換とみなす ffmpeg の scene スコア
+    
+    # Media GC settings（参照されなくなったメディアの削除）
+    media_gc_enabled: bool = True
+    media_gc_interval_seconds: int = 300  # 削除キューの処理間隔
+    media_gc_sweep_interval_hours: int = 24  # ストレージ全体とDBの照合間隔
+    media_gc_grace_hours: int = 24  # マニュアルに紐付いていないアップロードを残す期間
+    media_gc_delete_delay_seconds: int = 300  # 参照が外れてから削除するまでの猶予
+    media_gc_batch_size: int = 500
+    
+    # Resumable upload settings
+    upload_session_folder: str = "./upload_sessions"
+    upload_session_ttl_hours: int = 24  # 最終更新からこの時間を過ぎたセッションは破棄
+    upload_session_gc_interval_seconds: int = 3600
+    # パートファイルは受け付けたレプリカのローカルディスクに書かれる。S3 で複数レプリカを動かす場合は
+    # セッションIDで同じレプリカへ振り分ける（または upload_session_folder を共有する）設定をしてから True にする
+    upload_session_sticky_routing: bool = False
     allowed_video_types: list = ["video/mp4", "video/avi", "video/mov", "video/wmv"]
     
     # Application settings
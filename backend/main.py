@@ -1,12 +1,18 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
+import asyncio
 import os
 from dotenv import load_dotenv
 from database import engine, Base
-from routers import auth, auth_firebase, projects, manuals, upload, torisetsu, wizard
+from routers import auth, auth_firebase, projects, manuals, upload, torisetsu, wizard, media
 from config import settings
+from services.upload_sessions import upload_session_gc_loop
+from services.status_events import status_broker
+from services.generation_runs import generation_run_flush_loop
+from services.metrics import CONTENT_TYPE, install_thread_pool, render_metrics
+from utils.upload_stream import RequestSizeLimitMiddleware, MULTIPART_OVERHEAD
+from utils.metrics import MetricsMiddleware, request_duration
 
 # .envファイルから環境変数を読み込む
 load_dotenv()
@@ -17,11 +23,26 @@ async def lifespan(app: FastAPI):
     # 起動時
     Base.metadata.create_all(bind=engine)
     
+    # asyncio.to_thread の実行中・待ち件数を /metrics で見られるようにする
+    thread_pool = install_thread_pool()
+    
     # アップロードディレクトリを作成
     os.makedirs(settings.upload_folder, exist_ok=True)
+    os.makedirs(settings.upload_session_folder, exist_ok=True)
+    
+    # 放棄された再開可能アップロードを定期的に削除
+    upload_session_gc_task = asyncio.create_task(upload_session_gc_loop())
+    
+    # Gemini 呼び出しの記録（ネットワーク確認など）をまとめて書き込む
+    generation_run_task = asyncio.create_task(generation_run_flush_loop())
     
     yield
     # 終了時
+    upload_session_gc_task.cancel()
+    await status_broker.stop()
+    generation_run_task.cancel()
+    await asyncio.gather(generation_run_task, return_exceptions=True)
+    thread_pool.shutdown(wait=False)
 
 app = FastAPI(
     title="TORISETSU API",
@@ -37,8 +58,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Upload-Offset", "Upload-Length", "ETag", "X-Waveform-Zoom-Levels", "X-Waveform-Samples-Per-Pixel", "X-Waveform-Sample-Rate"],
+)
+
+# アップロードのボディサイズ上限（ボディ受信中に超過した時点で413を返す）
+app.add_middleware(
+    RequestSizeLimitMiddleware,
+    limits={
+        "/api/upload/video": settings.max_file_size + MULTIPART_OVERHEAD,
+        "/api/upload/audio": settings.max_audio_file_size + MULTIPART_OVERHEAD,
+    },
 )
 
+# リクエストの処理時間（最後に追加して一番外側で計測する）
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware, histogram=request_duration)
+
 # ルーターを登録
 app.include_router(auth.router, prefix="/api/auth", tags=["認証"])
 app.include_router(auth_firebase.router, prefix="/api/auth", tags=["Firebase認証"])
@@ -48,8 +83,8 @@ app.include_router(torisetsu.router, prefix="/api/torisetsu", tags=["トリセ
 app.include_router(manuals.router, prefix="/api/manuals", tags=["マニュアル"])
 app.include_router(upload.router, prefix="/api/upload", tags=["アップロード"])
 
-# 静的ファイル配信（動画ファイル）
-app.mount("/uploads", StaticFiles(directory=settings.upload_folder), name="uploads")
+# メディア配信（ストレージバックエンド経由、Rangeリクエスト対応）
+app.include_router(media.router, prefix="/uploads", tags=["メディア"])
 
 @app.get("/")
 async def root():
@@ -57,4 +92,9 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus 形式のメトリクス"""
+    return Response(content=await render_metrics(), media_type=CONTENT_TYPE)
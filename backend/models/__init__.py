@@ -2,5 +2,15 @@ from .user import User
 from .project import Project
 from .torisetsu import Torisetsu
 from .manual import Manual
+from .upload_session import UploadSession
+from .media_blob import MediaBlob
+from .media_rendition import MediaRendition
+from .keyframe_index import KeyframeIndex
+from .media_deletion import MediaDeletion
+from .generation_job import GenerationJob
+from .generation_cache import GenerationCacheEntry, GenerationCacheCounter
+from .gemini_file import GeminiFile
+from .generation_run import GenerationRun
+from .gemini_rate_bucket import GeminiRateBucket
 
-__all__ = ["User", "Project", "Torisetsu", "Manual"]
\ No newline at end of file
+__all__ = ["User", "Project", "Torisetsu", "Manual", "UploadSession", "MediaBlob", "MediaRendition", "KeyframeIndex", "MediaDeletion", "GenerationJob", "GenerationCacheEntry", "GenerationCacheCounter", "GeminiFile", "GenerationRun", "GeminiRateBucket"]
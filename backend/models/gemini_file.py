@@ -0,0 +1,16 @@
+from sqlalchemy import Column, String, DateTime, Integer
+from datetime import datetime
+from database import Base
+
+class GeminiFile(Base):
+    """Gemini にアップロード済みの動画（有効期限内は再アップロードせずに使い回す）"""
+    __tablename__ = "gemini_files"
+    
+    source_id = Column(String, primary_key=True)  # アップロードした動画の識別子（内容アドレスのストレージキー、またはsha256）
+    name = Column(String, nullable=False)  # files/xxx
+    uri = Column(String, nullable=True)
+    mime_type = Column(String, nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)  # Gemini 側の有効期限（UTC）
+    use_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
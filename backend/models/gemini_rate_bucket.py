@@ -0,0 +1,10 @@
+from sqlalchemy import Column, String, DateTime, Float
+from database import Base
+
+class GeminiRateBucket(Base):
+    """Gemini のレート制限用トークンバケット（全ワーカー共通。pg_advisory_xact_lock の下で更新する）"""
+    __tablename__ = "gemini_rate_buckets"
+    
+    name = Column(String, primary_key=True)  # requests / tokens
+    level = Column(Float, nullable=False)  # 残量（待ち時間を予約した呼び出しの分だけ負になる）
+    updated_at = Column(DateTime, nullable=False)  # 最後に補充を計算した時刻
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, String, DateTime, Integer, BigInteger, Text
+from datetime import datetime
+from database import Base
+
+class GenerationCacheEntry(Base):
+    """Gemini の生成結果キャッシュ（動画ハッシュ・プロンプト・モデル・生成設定・言語をキーにする）"""
+    __tablename__ = "generation_cache_entries"
+    
+    cache_key = Column(String, primary_key=True)  # キー要素の sha256
+    video_hash = Column(String, nullable=False, index=True)
+    model = Column(String, nullable=False)
+    language = Column(String, nullable=False)
+    prompt_version = Column(Integer, nullable=False)
+    raw_response = Column(Text, nullable=False)
+    manual_content = Column(Text, nullable=False)  # JSON
+    size_bytes = Column(Integer, nullable=False)
+    hit_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)  # LRU の削除順
+
+
+class GenerationCacheCounter(Base):
+    """キャッシュのヒット・ミス・削除回数（全ワーカー共通）"""
+    __tablename__ = "generation_cache_counters"
+    
+    name = Column(String, primary_key=True)  # hits / misses / evictions
+    value = Column(BigInteger, nullable=False, default=0)
@@ -0,0 +1,38 @@
+from sqlalchemy import Column, String, DateTime, ForeignKey, Integer, Float, Text, Index, text
+from datetime import datetime
+import uuid
+from database import Base
+
+class GenerationJob(Base):
+    """マニュアル生成ジョブ（ワーカープロセスが SELECT ... FOR UPDATE SKIP LOCKED で取得する）"""
+    __tablename__ = "generation_jobs"
+    __table_args__ = (
+        Index("ix_generation_jobs_status_available_at", "status", "available_at"),
+        Index("ix_generation_jobs_status_priority_virtual_start", "status", "priority", "virtual_start"),
+        # 1つのマニュアルに実行待ち・実行中のジョブは1つだけ（同時の生成依頼で二重に Gemini を呼ばない）
+        Index(
+            "uq_generation_jobs_active_manual", "manual_id", unique=True,
+            postgresql_where=text("status IN ('queued', 'running')"),
+            sqlite_where=text("status IN ('queued', 'running')"),
+        ),
+    )
+    
+    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    manual_id = Column(String, ForeignKey("manuals.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(String, ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True)  # 生成を依頼したユーザー（公平性の単位）
+    priority = Column(Integer, nullable=False, default=0)  # 0: interactive / 1: bulk
+    cost = Column(Float, nullable=False, default=1.0)  # 動画の長さ（分）
+    virtual_start = Column(Float, nullable=False, default=0.0)  # 公平キューイングの開始タグ
+    virtual_finish = Column(Float, nullable=False, default=0.0)  # 公平キューイングの終了タグ
+    status = Column(String, nullable=False, default="queued")  # queued / running / completed / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # 再試行時はこの時刻まで取得しない
+    locked_by = Column(String, nullable=True)  # 実行中のワーカーID
+    locked_until = Column(DateTime, nullable=True)  # ハートビートで延長。過ぎたジョブは回収される
+    error = Column(Text, nullable=True)
+    partial_steps = Column(Text, nullable=True)  # ストリーミング生成中に完成したステップ（JSON）
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
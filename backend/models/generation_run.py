@@ -0,0 +1,27 @@
+from sqlalchemy import Column, String, DateTime, Integer, BigInteger, Float, Index
+from datetime import datetime
+import uuid
+from database import Base
+
+class GenerationRun(Base):
+    """Gemini 呼び出しの処理段階ごとの記録（DNS確認・アップロード・解析待ち・生成・解析・後片付け）"""
+    __tablename__ = "generation_runs"
+    __table_args__ = (
+        Index("ix_generation_runs_phase_model_started_at", "phase", "model", "started_at"),
+    )
+    
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    run_id = Column(String, nullable=True, index=True)  # 1回の生成（ジョブ）で記録した段階をまとめるID
+    manual_id = Column(String, nullable=True)  # マニュアル削除後も集計に使うため外部キーにしない
+    model = Column(String, nullable=False)
+    mode = Column(String, nullable=True)  # video / keyframes / chunked
+    phase = Column(String, nullable=False)  # dns_check / prepare / upload / processing_wait / generate / parse / cleanup / total
+    attempt = Column(Integer, nullable=False, default=1)  # 再試行の何回目か（1が初回）
+    started_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    duration_ms = Column(Float, nullable=False)
+    request_bytes = Column(BigInteger, nullable=True)  # 送信したデータ量（動画・画像）
+    response_bytes = Column(BigInteger, nullable=True)  # 受信した生成結果の大きさ
+    prompt_tokens = Column(Integer, nullable=True)  # Gemini の usage_metadata
+    output_tokens = Column(Integer, nullable=True)
+    total_tokens = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)  # 失敗した場合の例外クラス名
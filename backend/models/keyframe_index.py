@@ -0,0 +1,20 @@
+from sqlalchemy import Column, String, DateTime, ForeignKey, BigInteger, Text
+from datetime import datetime
+import uuid
+from database import Base
+
+class KeyframeIndex(Base):
+    """ステップの開始時刻にキーフレームを揃えて再エンコードした動画と、そのキーフレーム一覧"""
+    __tablename__ = "keyframe_indexes"
+    
+    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    manual_id = Column(String, ForeignKey("manuals.id", ondelete="CASCADE"), nullable=False, unique=True, index=True)
+    source_key = Column(String, nullable=False)  # 変換元のストレージキー
+    status = Column(String, nullable=False, default="pending")  # pending / processing / ready / failed
+    step_times = Column(Text, nullable=True)  # JSON: キーフレームを揃えたステップ時刻（秒）
+    keyframes = Column(Text, nullable=True)  # JSON: 出力動画のキーフレーム時刻（秒）
+    storage_key = Column(String, nullable=True)  # 出力MP4のキー
+    size = Column(BigInteger, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
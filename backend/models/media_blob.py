@@ -0,0 +1,26 @@
+from sqlalchemy import Column, String, DateTime, Integer, BigInteger, Float, Text
+from datetime import datetime
+from database import Base
+
+class MediaBlob(Base):
+    """コンテンツアドレス方式で保存されたメディアファイル（SHA-256で一意）"""
+    __tablename__ = "media_blobs"
+    
+    sha256 = Column(String(64), primary_key=True)
+    file_path = Column(String, unique=True, nullable=False, index=True)
+    kind = Column(String, nullable=False)  # "video" または "audio"
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)  # 参照しているマニュアル数
+    # ffprobe で取得したメタデータ（アップロード時に保存し、後続の処理は再解析しない）
+    duration = Column(Float, nullable=True)  # 秒
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    fps = Column(Float, nullable=True)
+    video_codec = Column(String, nullable=True)
+    audio_codec = Column(String, nullable=True)
+    bit_rate = Column(BigInteger, nullable=True)  # bps
+    format_name = Column(String, nullable=True)
+    probe = Column(Text, nullable=True)  # ffprobe の出力（JSON）
+    probed_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
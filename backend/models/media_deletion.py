@@ -0,0 +1,12 @@
+from sqlalchemy import Column, String, DateTime, Integer
+from datetime import datetime
+from database import Base
+
+class MediaDeletion(Base):
+    """参照が外れたメディアの削除キュー（期限後にGCが参照を再確認してから削除する）"""
+    __tablename__ = "media_deletions"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    storage_key = Column(String, nullable=False, index=True)
+    not_before = Column(DateTime, nullable=False, index=True)  # この時刻以降に処理
+    created_at = Column(DateTime, default=datetime.utcnow)
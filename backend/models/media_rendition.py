@@ -0,0 +1,24 @@
+from sqlalchemy import Column, String, DateTime, Integer, BigInteger, Text, UniqueConstraint
+from datetime import datetime
+import uuid
+from database import Base
+
+class MediaRendition(Base):
+    """再生用に変換した派生動画（faststart MP4 / HLS）。重複排除された動画は同じキーを共有する"""
+    __tablename__ = "media_renditions"
+    __table_args__ = (
+        UniqueConstraint("source_key", "kind", "version", name="uq_media_renditions_source_kind_version"),
+    )
+    
+    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    source_key = Column(String, nullable=False, index=True)  # 変換元のストレージキー
+    source_hash = Column(String(64), nullable=False, index=True)  # 出力キーに使う内容ハッシュ
+    kind = Column(String, nullable=False)  # "faststart" / "hls" / "sprite" / "audio" / "waveform"
+    version = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending / processing / ready / failed
+    storage_key = Column(String, nullable=True)  # MP4 / master playlist / スプライトVTT のキー
+    size = Column(BigInteger, nullable=True)  # 出力ファイルの合計バイト数
+    details = Column(Text, nullable=True)  # JSON: 種類ごとの付加情報（スプライトのタイル配置など）
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
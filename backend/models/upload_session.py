@@ -0,0 +1,19 @@
+from sqlalchemy import Column, String, DateTime, ForeignKey, BigInteger
+from datetime import datetime
+import uuid
+from database import Base
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+    
+    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    kind = Column(String, nullable=False)  # "video" または "audio"
+    original_filename = Column(String, nullable=False)
+    total_size = Column(BigInteger, nullable=False)
+    offset = Column(BigInteger, nullable=False, default=0)
+    status = Column(String, nullable=False, default="uploading")  # uploading / completed
+    file_path = Column(String, nullable=True)  # 完了後の保存先
+    expires_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,3 +1,3 @@
-from . import auth, projects, manuals, upload, torisetsu
+from . import auth, projects, manuals, upload, torisetsu, media
 
-__all__ = ["auth", "projects", "manuals", "upload", "torisetsu"]
\ No newline at end of file
+__all__ = ["auth", "projects", "manuals", "upload", "torisetsu", "media"]
\ No newline at end of file
@@ -1,17 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Annotated
+from typing import List, Annotated, Literal, Optional
 import json
+import asyncio
 import logging
-import os
 import secrets
 from datetime import datetime, timedelta
 
+from config import settings
 from database import get_db
 from models import User, Manual, Project, Torisetsu
 from schemas import ManualCreate, ManualUpdate, Manual as ManualSchema, ShareTokenRequest, ShareTokenResponse
 from routers.auth import get_current_user
 from services.gemini_service import gemini_service
+from services import media_store
+from services.renditions import generate_renditions, attach_renditions, sprite_for_key, media_url
+from services.thumbnails import generate_step_thumbnails, step_thumbnail_keys, video_content_hash
+from services.keyframes import align_keyframes, manual_step_times
+from services.generation_queue import enqueue_generation
+from services.generation_scheduler import PRIORITIES, PRIORITY_NAMES, queue_position
+from services.generation_cache import cache_stats
+from services.generation_runs import phase_stats
+from services.status_events import load_status, status_broker
+from services.audio import process_audio, compact_audio_path
+from services.media_probe import attach_media_metadata
+from services.waveform import generate_waveform, get_waveform, level_key, WAVEFORM_VERSION
+from services.storage import storage, key_for_path
+from utils.timecode import parse_timecode
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +48,7 @@ def check_torisetsu_access(torisetsu_id: str, user_id: str, db: Session) -> bool
 @router.post("/", response_model=ManualSchema)
 async def create_manual(
     manual: ManualCreate,
+    background_tasks: BackgroundTasks,
     current_user: Annotated[User, Depends(get_current_user)],
     db: Session = Depends(get_db)
 ):
@@ -42,18 +59,34 @@ async def create_manual(
     # contentをJSON文字列に変換
     content_str = json.dumps(manual.content) if manual.content else None
     
+    # メディアはコンテンツアドレスストア経由で参照する（音声は変換済みがあればそちらを使う）
+    video_file_path = media_store.resolve_path(db, manual.video_file_path)
+    audio_file_path = compact_audio_path(db, media_store.resolve_path(db, manual.audio_file_path))
+    
     db_manual = Manual(
         torisetsu_id=manual.torisetsu_id,
         title=manual.title,
         content=content_str,
         status=manual.status,
         version=manual.version,
-        video_file_path=manual.video_file_path
+        video_file_path=video_file_path,
+        audio_file_path=audio_file_path
     )
     db.add(db_manual)
+    media_store.acquire(db, video_file_path)
+    media_store.acquire(db, audio_file_path)
     db.commit()
     db.refresh(db_manual)
     
+    # ブラウザ再生用のレンディション（faststart MP4 / HLS）をバックグラウンドで作成
+    if video_file_path:
+        background_tasks.add_task(generate_renditions, video_file_path)
+    # ナレーション音声を Opus に変換・ラウドネス正規化し、完了後に参照を付け替えて波形を作成
+    if audio_file_path:
+        background_tasks.add_task(process_audio, audio_file_path)
+    attach_renditions(db, [db_manual])
+    attach_media_metadata(db, [db_manual])
+    
     # contentをJSONに戻す
     if db_manual.content:
         db_manual.content = json.loads(db_manual.content)
@@ -71,6 +104,8 @@ async def list_manuals_by_torisetsu(
         raise HTTPException(status_code=403, detail="Not authorized to access this torisetsu")
     
     manuals = db.query(Manual).filter(Manual.torisetsu_id == torisetsu_id).order_by(Manual.created_at.desc()).all()
+    attach_renditions(db, manuals)
+    attach_media_metadata(db, manuals)
     
     # contentをJSONに変換
     for manual in manuals:
@@ -82,6 +117,7 @@ async def list_manuals_by_torisetsu(
 @router.get("/detail/{manual_id}", response_model=ManualSchema)
 async def get_manual_detail(
     manual_id: str,
+    background_tasks: BackgroundTasks,
     current_user: Annotated[User, Depends(get_current_user)],
     db: Session = Depends(get_db)
 ):
@@ -93,6 +129,12 @@ async def get_manual_detail(
     if not check_torisetsu_access(manual.torisetsu_id, current_user.id, db):
         raise HTTPException(status_code=403, detail="Not authorized to access this manual")
     
+    # レンディション導入前の動画は初回表示時に作成する
+    attach_renditions(db, [manual])
+    attach_media_metadata(db, [manual])
+    if manual.video_file_path and (manual.renditions is None or manual.renditions["status"] == "pending"):
+        background_tasks.add_task(generate_renditions, manual.video_file_path)
+    
     # contentをJSONに変換
     if manual.content:
         manual.content = json.loads(manual.content)
@@ -104,6 +146,7 @@ async def get_manual_detail(
 async def update_manual(
     manual_id: str,
     manual_update: ManualUpdate,
+    background_tasks: BackgroundTasks,
     current_user: Annotated[User, Depends(get_current_user)],
     db: Session = Depends(get_db)
 ):
@@ -121,11 +164,28 @@ async def update_manual(
     if "content" in update_data and update_data["content"] is not None:
         update_data["content"] = json.dumps(update_data["content"])
     
+    # 音声の差し替え時は参照カウントを付け替える
+    if "audio_file_path" in update_data:
+        update_data["audio_file_path"] = compact_audio_path(db, media_store.resolve_path(db, update_data["audio_file_path"]))
+        if update_data["audio_file_path"] != manual.audio_file_path:
+            media_store.release(db, manual.audio_file_path)
+            media_store.acquire(db, update_data["audio_file_path"])
+            if update_data["audio_file_path"]:
+                background_tasks.add_task(process_audio, update_data["audio_file_path"])
+    
     for field, value in update_data.items():
         setattr(manual, field, value)
     
     db.commit()
     db.refresh(manual)
+    attach_renditions(db, [manual])
+    attach_media_metadata(db, [manual])
+    
+    # ステップが編集された場合はサムネイルとキーフレーム位置を追従させる（変更のない時刻は再処理しない）
+    if "content" in update_data and manual.video_file_path:
+        background_tasks.add_task(generate_step_thumbnails, manual_id)
+        if settings.keyframe_alignment_enabled:
+            background_tasks.add_task(align_keyframes, manual_id)
     
     # contentをJSONに戻す
     if manual.content:
@@ -147,66 +207,17 @@ async def delete_manual(
     if not check_torisetsu_access(manual.torisetsu_id, current_user.id, db):
         raise HTTPException(status_code=403, detail="Not authorized to delete this manual")
     
+    media_store.release_manual_media(db, [manual])
     db.delete(manual)
     db.commit()
     
     return {"message": "Manual deleted successfully"}
 
-async def generate_manual_background(manual_id: str, db: Session):
-    """Background task for manual generation"""
-    try:
-        manual = db.query(Manual).filter(Manual.id == manual_id).first()
-        if not manual:
-            logger.error(f"Manual {manual_id} not found for background generation")
-            return
-        
-        # Update status to processing
-        manual.status = "processing"
-        db.commit()
-        
-        # Check if video file exists
-        if not manual.video_file_path or not os.path.exists(manual.video_file_path):
-            manual.status = "failed"
-            db.commit()
-            logger.error(f"Video file not found for manual {manual_id}: {manual.video_file_path}")
-            return
-        
-        # Generate manual using Gemini
-        logger.info(f"Starting manual generation for manual {manual_id}")
-        generated_content = await gemini_service.generate_manual_from_video(
-            video_path=manual.video_file_path,
-            title=manual.title or "操作マニュアル",
-            language="ja"
-        )
-        
-        # Update manual with generated content
-        manual.content = json.dumps(generated_content)
-        manual.status = "completed"
-        db.commit()
-        
-        logger.info(f"Manual generation completed for manual {manual_id}")
-        
-    except Exception as e:
-        logger.error(f"Failed to generate manual {manual_id}: {str(e)}")
-        # Update status to failed with error details
-        manual = db.query(Manual).filter(Manual.id == manual_id).first()
-        if manual:
-            manual.status = "failed"
-            # Store error information for debugging
-            error_info = {
-                "error_type": type(e).__name__,
-                "error_message": str(e),
-                "is_network_error": "DNS resolution failed" in str(e) or "ServiceUnavailable" in str(e) or "503" in str(e)
-            }
-            # You could store this in a separate error log table if needed
-            logger.error(f"Manual {manual_id} generation failed: {error_info}")
-            db.commit()
-
 @router.post("/{manual_id}/generate")
 async def generate_manual_content(
     manual_id: str,
-    background_tasks: BackgroundTasks,
     current_user: Annotated[User, Depends(get_current_user)],
+    priority: Optional[Literal["interactive", "bulk"]] = Query(None),
     db: Session = Depends(get_db)
 ):
     """Start manual generation from video using Gemini API"""
@@ -222,7 +233,7 @@ async def generate_manual_content(
         raise HTTPException(status_code=400, detail="No video file associated with this manual")
     
     # Check if video file exists
-    if not os.path.exists(manual.video_file_path):
+    if not await storage.exists(key_for_path(manual.video_file_path)):
         raise HTTPException(status_code=400, detail="Video file not found on server")
     
     # Check if Gemini API key is configured
@@ -232,16 +243,20 @@ async def generate_manual_content(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gemini service error: {str(e)}")
     
-    # Start background task for manual generation
-    background_tasks.add_task(generate_manual_background, manual_id, db)
-    
-    # Update status to processing
-    manual.status = "processing"
-    db.commit()
+    # 生成ジョブをキューに登録（ワーカープロセスが実行する。実行中のジョブがあればそれを返す）
+    # 優先度の指定がなければ、再生成は interactive、大量の一括生成は bulk になる
+    job = enqueue_generation(
+        db, manual,
+        user_id=current_user.id,
+        priority=PRIORITIES[priority] if priority else None
+    )
     
     return {
         "message": "Manual generation started",
         "manual_id": manual_id,
+        "job_id": job.id,
+        "priority": PRIORITY_NAMES.get(job.priority),
+        "queue_position": queue_position(db, job),
         "status": "processing"
     }
 
@@ -306,13 +321,45 @@ async def enhance_manual_content(
         logger.error(f"Failed to enhance manual {manual_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to enhance manual: {str(e)}")
 
-@router.get("/{manual_id}/status")
-async def get_manual_status(
+@router.post("/{manual_id}/keyframes")
+async def request_keyframe_alignment(
     manual_id: str,
+    background_tasks: BackgroundTasks,
     current_user: Annotated[User, Depends(get_current_user)],
     db: Session = Depends(get_db)
 ):
-    """Get the current status of manual generation"""
+    """Re-encode the video with keyframes at each step start (builds the keyframe index)"""
+    manual = db.query(Manual).filter(Manual.id == manual_id).first()
+    if not manual:
+        raise HTTPException(status_code=404, detail="Manual not found")
+    
+    # トリセツへのアクセス権限チェック
+    if not check_torisetsu_access(manual.torisetsu_id, current_user.id, db):
+        raise HTTPException(status_code=403, detail="Not authorized to modify this manual")
+    
+    if not manual.video_file_path:
+        raise HTTPException(status_code=400, detail="No video file associated with this manual")
+    
+    step_times = manual_step_times(manual)
+    if not step_times:
+        raise HTTPException(status_code=400, detail="Manual has no steps with timestamps")
+    
+    background_tasks.add_task(align_keyframes, manual_id)
+    
+    return {
+        "message": "Keyframe alignment started",
+        "manual_id": manual_id,
+        "step_times": step_times
+    }
+
+@router.get("/{manual_id}/thumbnails")
+async def get_manual_thumbnails(
+    manual_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: Annotated[User, Depends(get_current_user)],
+    db: Session = Depends(get_db)
+):
+    """Get step thumbnails and the scrubbing sprite sheet of the manual's video"""
     manual = db.query(Manual).filter(Manual.id == manual_id).first()
     if not manual:
         raise HTTPException(status_code=404, detail="Manual not found")
@@ -321,14 +368,159 @@ async def get_manual_status(
     if not check_torisetsu_access(manual.torisetsu_id, current_user.id, db):
         raise HTTPException(status_code=403, detail="Not authorized to access this manual")
     
+    if not manual.video_file_path:
+        raise HTTPException(status_code=400, detail="No video file associated with this manual")
+    
+    content = json.loads(manual.content) if manual.content else {}
+    steps = content.get("steps", []) if isinstance(content, dict) else []
+    step_seconds = [parse_timecode(step.get("time")) for step in steps]
+    times = sorted({round(seconds, 3) for seconds in step_seconds if seconds is not None})
+    
+    content_hash = video_content_hash(db, manual.video_file_path)
+    thumbnail_keys = await step_thumbnail_keys(content_hash, times) if content_hash else {}
+    
+    # 未作成のサムネイルがあればバックグラウンドで作成（作成済みの時刻はスキップされる）
+    if times and (not content_hash or None in thumbnail_keys.values()):
+        background_tasks.add_task(generate_step_thumbnails, manual_id)
+    
+    step_thumbnails = []
+    for index, (step, seconds) in enumerate(zip(steps, step_seconds)):
+        thumbnail_key = thumbnail_keys.get(round(seconds, 3)) if seconds is not None else None
+        step_thumbnails.append({
+            "index": index,
+            "time": step.get("time"),
+            "seconds": seconds,
+            "thumbnail_url": media_url(thumbnail_key) if thumbnail_key else None
+        })
+    
     return {
         "manual_id": manual_id,
-        "status": manual.status,
-        "title": manual.title,
-        "has_content": bool(manual.content),
-        "video_file_path": manual.video_file_path
+        "steps": step_thumbnails,
+        "sprite": sprite_for_key(db, key_for_path(manual.video_file_path))
     }
 
+@router.get("/{manual_id}/waveform")
+async def get_manual_waveform(
+    manual_id: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    current_user: Annotated[User, Depends(get_current_user)],
+    db: Session = Depends(get_db),
+    zoom: int = Query(0, ge=0, description="0 = whole-audio overview; higher values are more detailed")
+):
+    """Get precomputed waveform peaks of the manual's audio (audiowaveform .dat format)"""
+    manual = db.query(Manual).filter(Manual.id == manual_id).first()
+    if not manual:
+        raise HTTPException(status_code=404, detail="Manual not found")
+    
+    # トリセツへのアクセス権限チェック
+    if not check_torisetsu_access(manual.torisetsu_id, current_user.id, db):
+        raise HTTPException(status_code=403, detail="Not authorized to access this manual")
+    
+    if not manual.audio_file_path:
+        raise HTTPException(status_code=400, detail="No audio file associated with this manual")
+    
+    waveform = get_waveform(db, manual.audio_file_path)
+    if waveform and waveform.status == "failed":
+        raise HTTPException(status_code=422, detail="Waveform could not be computed for this audio")
+    if not waveform or waveform.status != "ready":
+        # 未作成（波形導入前の音声など）や処理が止まった行はバックグラウンドで作成する
+        # （処理中の行は generate_waveform の claim で重複を防ぐ）
+        background_tasks.add_task(generate_waveform, manual.audio_file_path)
+        return JSONResponse(
+            status_code=202,
+            content={"status": waveform.status if waveform else "pending"},
+            headers={"Retry-After": "2"}
+        )
+    
+    details = json.loads(waveform.details)
+    # ズーム0が最も粗いレベル、範囲外は最も詳細なレベルに丸める
+    levels = details["samples_per_pixel"][::-1]
+    samples_per_pixel = levels[min(zoom, len(levels) - 1)]
+    key = level_key(waveform.storage_key, samples_per_pixel)
+    
+    # 音声が差し替えられるとURLはそのままで内容が変わるため、ETagで再検証させる
+    headers = {
+        "ETag": f'"{waveform.source_hash[:16]}-v{WAVEFORM_VERSION}-{samples_per_pixel}"',
+        "Cache-Control": "private, no-cache",
+        "X-Waveform-Zoom-Levels": str(len(levels)),
+        "X-Waveform-Samples-Per-Pixel": str(samples_per_pixel),
+        "X-Waveform-Sample-Rate": str(details["sample_rate"]),
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    
+    size = await storage.size(key)
+    if size is None:
+        raise HTTPException(status_code=404, detail="Waveform not found")
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(
+        storage.read_range(key, 0, size - 1),
+        headers=headers,
+        media_type="application/octet-stream"
+    )
+
+@router.get("/{manual_id}/status")
+async def get_manual_status(
+    manual_id: str,
+    current_user: Annotated[User, Depends(get_current_user)],
+    db: Session = Depends(get_db)
+):
+    """Get the current status of manual generation"""
+    manual = db.query(Manual).filter(Manual.id == manual_id).first()
+    if not manual:
+        raise HTTPException(status_code=404, detail="Manual not found")
+    
+    # トリセツへのアクセス権限チェック
+    if not check_torisetsu_access(manual.torisetsu_id, current_user.id, db):
+        raise HTTPException(status_code=403, detail="Not authorized to access this manual")
+    
+    return load_status(db, manual_id)
+
+@router.get("/{manual_id}/events")
+async def stream_manual_status(
+    manual_id: str,
+    request: Request,
+    current_user: Annotated[User, Depends(get_current_user)],
+    db: Session = Depends(get_db)
+):
+    """Stream status changes of a manual as server-sent events"""
+    manual = db.query(Manual).filter(Manual.id == manual_id).first()
+    if not manual:
+        raise HTTPException(status_code=404, detail="Manual not found")
+    
+    # トリセツへのアクセス権限チェック
+    if not check_torisetsu_access(manual.torisetsu_id, current_user.id, db):
+        raise HTTPException(status_code=403, detail="Not authorized to access this manual")
+    
+    snapshot = load_status(db, manual_id)
+    # 接続中はDB接続を保持しない（以降の変更は通知を受けた時だけ読み込む）
+    db.close()
+    queue = status_broker.subscribe(manual_id)
+    
+    async def events():
+        last = None
+        current = snapshot
+        try:
+            while True:
+                if current is not None and current != last:
+                    yield f"event: status\ndata: {json.dumps(current, ensure_ascii=False)}\n\n"
+                    last = current
+                try:
+                    current = await asyncio.wait_for(queue.get(), timeout=settings.status_events_keepalive_seconds)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+        finally:
+            status_broker.unsubscribe(manual_id, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/{manual_id}/share", response_model=ShareTokenResponse)
 async def create_share_token(
     manual_id: str,
@@ -411,6 +603,9 @@ async def get_shared_manual(
     if manual.share_expires_at and manual.share_expires_at < datetime.utcnow():
         raise HTTPException(status_code=410, detail="Share link has expired")
     
+    attach_renditions(db, [manual])
+    attach_media_metadata(db, [manual])
+    
     # contentをJSONに変換
     if manual.content:
         manual.content = json.loads(manual.content)
@@ -422,7 +617,7 @@ async def check_network_health():
     """Check network connectivity for Gemini API"""
     try:
         from services.gemini_service import gemini_service
-        await gemini_service._check_network_connectivity()
+        await gemini_service.check_network_connectivity()
         return {
             "status": "healthy",
             "message": "Network connectivity to Gemini API is working",
@@ -433,4 +628,22 @@ async def check_network_health():
             "status": "unhealthy",
             "message": f"Network connectivity issue: {str(e)}",
             "error_type": type(e).__name__
-        }
\ No newline at end of file
+        }
+
+@router.get("/health/generation-cache")
+async def generation_cache_health(
+    current_user: Annotated[User, Depends(get_current_user)],
+    db: Session = Depends(get_db)
+):
+    """Generation result cache size and hit/miss counters"""
+    return cache_stats(db)
+
+@router.get("/health/generation-runs")
+async def generation_runs_health(
+    hours: float = Query(24, gt=0, le=24 * 30),
+    model: Optional[str] = None,
+    current_user: Annotated[User, Depends(get_current_user)] = None,
+    db: Session = Depends(get_db)
+):
+    """p50/p95/p99 duration, errors, retries and token usage of each Gemini call phase per model"""
+    return phase_stats(db, hours=hours, model=model)
@@ -0,0 +1,78 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from typing import Optional, Tuple
+import mimetypes
+
+from services.storage import storage, is_public_key
+
+router = APIRouter()
+
+# HLSレンディション用（.ts はデフォルトだと TypeScript と判定される）
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/mp2t", ".ts")
+
+def parse_range_header(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Rangeヘッダー（単一範囲のみ）を (start, end) に変換。範囲外は416"""
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+
+    spec = range_header[len("bytes="):].split(",")[0].strip()
+    start_str, _, end_str = spec.partition("-")
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else size - 1
+        else:
+            # bytes=-500 は末尾500バイト
+            start = max(size - int(end_str), 0)
+            end = size - 1
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, min(end, size - 1)
+
+def _media_headers() -> dict:
+    # 保存済みのキーは上書きされない（ハッシュまたはUUIDのファイル名）ため長期キャッシュ可能
+    return {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=31536000, immutable"
+    }
+
+@router.api_route("/{key:path}", methods=["GET", "HEAD"])
+async def serve_media(key: str, request: Request):
+    """アップロード済みメディアを配信（どのレプリカからでもストレージ経由で配信、Range対応）"""
+    if not is_public_key(key):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    size = await storage.size(key)
+    if size is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+    headers = _media_headers()
+    byte_range = parse_range_header(request.headers.get("range"), size)
+
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    else:
+        start, end = 0, size - 1
+        status_code = 200
+    headers["Content-Length"] = str(end - start + 1)
+
+    if request.method == "HEAD" or size == 0:
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+
+    return StreamingResponse(
+        storage.read_range(key, start, end),
+        status_code=status_code,
+        headers=headers,
+        media_type=media_type
+    )
@@ -6,6 +6,7 @@ from database import get_db
 from models import User, Project, Manual, Torisetsu
 from schemas import ProjectCreate, ProjectUpdate, Project as ProjectSchema
 from routers.auth import get_current_user
+from services import media_store
 
 router = APIRouter()
 
@@ -96,6 +97,12 @@ async def delete_project(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
+    # 削除されるマニュアルが参照しているメディアの参照カウントを減らす
+    manual_media = db.query(Manual.video_file_path, Manual.audio_file_path).join(
+        Torisetsu, Manual.torisetsu_id == Torisetsu.id
+    ).filter(Torisetsu.project_id == project_id).all()
+    media_store.release_manual_media(db, manual_media)
+    
     # 関連するマニュアルとトリセツをRaw SQLで削除（enum変換エラーを回避）
     # 正しい削除順序: 1. マニュアル 2. トリセツ 3. プロジェクト
     db.execute(text("DELETE FROM manuals WHERE torisetsu_id IN (SELECT id FROM torisetsu WHERE project_id = :project_id)"), {"project_id": project_id})
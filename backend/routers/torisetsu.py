@@ -7,6 +7,7 @@ from models import Torisetsu, Manual, Project
 from schemas.torisetsu import TorisetsuCreate, TorisetsuUpdate, TorisetsuResponse, TorisetsuDetail
 from routers.auth import get_current_user
 from models.user import User
+from services import media_store
 
 router = APIRouter(tags=["torisetsu"])
 
@@ -197,6 +198,7 @@ def delete_torisetsu(
             detail="このトリセツを削除する権限がありません"
         )
     
+    media_store.release_manual_media(db, torisetsu.manuals)
     db.delete(torisetsu)
     db.commit()
     
@@ -1,14 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request, Header, Response
 from sqlalchemy.orm import Session
-from typing import Annotated
+from typing import Annotated, Optional
 import os
-import uuid
-import shutil
 
 from database import get_db
-from models import User
+from models import User, UploadSession
 from routers.auth import get_current_user
 from config import settings
+from schemas import UploadSessionCreate, UploadSessionResponse, UploadResult
+from services.media_store import store_upload, store_file, get_blob
+from services.media_probe import InvalidMediaError, metadata_for_blob
+from services.upload_sessions import session_part_path, session_expiry, current_part_size, sessions_available
+from utils.upload_stream import write_stream_to_file
 
 router = APIRouter()
 
@@ -29,47 +32,28 @@ async def upload_video(
     current_user: Annotated[User, Depends(get_current_user)] = None,
     db: Session = Depends(get_db)
 ):
-    # ファイルサイズチェック
-    file_size = 0
-    contents = await file.read()
-    file_size = len(contents)
-    await file.seek(0)  # ファイルポインタを先頭に戻す
-    
-    if file_size > settings.max_file_size:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File size exceeds maximum allowed size of {settings.max_file_size / 1024 / 1024}MB"
-        )
-    
-    # ファイル形式チェック
+    # ファイル形式チェック（ボディを書き込む前に行う）
     if not validate_video_file(file.filename):
+        await file.close()
         raise HTTPException(
             status_code=400,
             detail=f"Invalid file type. Allowed types: {', '.join(ALLOWED_VIDEO_EXTENSIONS)}"
         )
     
-    # ユニークなファイル名を生成
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(settings.upload_folder, unique_filename)
-    
-    # ファイルを保存
+    # ハッシュを計算しながらチャンク単位で保存（同一内容は1つのファイルに集約、上限超過で413）
+    # ffprobe で動画として読めないファイルはストアに入れずに400を返す
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to save file: {str(e)}"
-        )
-    finally:
-        await file.close()
+        blob = await store_upload(db, file, "video", settings.max_file_size)
+    except InvalidMediaError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid video file: {e}")
     
     return {
-        "filename": unique_filename,
-        "file_path": file_path,
+        "filename": os.path.basename(blob.file_path),
+        "file_path": blob.file_path,
         "original_filename": file.filename,
-        "file_size": file_size
+        "file_size": blob.size,
+        "content_hash": blob.sha256,
+        "metadata": metadata_for_blob(blob)
     }
 
 @router.post("/audio")
@@ -78,46 +62,237 @@ async def upload_audio(
     current_user: Annotated[User, Depends(get_current_user)] = None,
     db: Session = Depends(get_db)
 ):
-    # ファイルサイズチェック（音声は10MBまで）
-    file_size = 0
-    contents = await file.read()
-    file_size = len(contents)
-    await file.seek(0)  # ファイルポインタを先頭に戻す
-    
-    max_audio_size = 10 * 1024 * 1024  # 10MB
-    if file_size > max_audio_size:
+    # ファイル形式チェック（ボディを書き込む前に行う）
+    if not validate_audio_file(file.filename):
+        await file.close()
         raise HTTPException(
-            status_code=413,
-            detail=f"Audio file size exceeds maximum allowed size of 10MB"
+            status_code=400,
+            detail=f"Invalid audio file type. Allowed types: {', '.join(ALLOWED_AUDIO_EXTENSIONS)}"
+        )
+    
+    # ハッシュを計算しながらチャンク単位で保存（音声は10MBまで）
+    try:
+        blob = await store_upload(db, file, "audio", settings.max_audio_file_size)
+    except InvalidMediaError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid audio file: {e}")
+    
+    return {
+        "filename": os.path.basename(blob.file_path),
+        "file_path": blob.file_path,
+        "original_filename": file.filename,
+        "file_size": blob.size,
+        "content_hash": blob.sha256,
+        "metadata": metadata_for_blob(blob)
+    }
+
+# ---- 再開可能アップロード（tus形式） ----
+# 1. POST   /sessions                 セッション作成
+# 2. PATCH  /sessions/{id}            Upload-Offset ヘッダー付きでチャンクを追記
+# 3. HEAD   /sessions/{id}            現在のオフセットを確認（切断後の再開位置）
+# 4. POST   /sessions/{id}/complete   アップロード完了、通常のアップロードと同じ形式で返す
+
+def _max_size_for_kind(kind: str) -> int:
+    return settings.max_file_size if kind == "video" else settings.max_audio_file_size
+
+def _session_response(upload_session: UploadSession) -> UploadSessionResponse:
+    return UploadSessionResponse(
+        id=upload_session.id,
+        kind=upload_session.kind,
+        original_filename=upload_session.original_filename,
+        total_size=upload_session.total_size,
+        offset=upload_session.offset,
+        status=upload_session.status,
+        chunk_size=settings.upload_chunk_size,
+        expires_at=upload_session.expires_at
+    )
+
+def _get_user_session(session_id: str, current_user: User, db: Session) -> UploadSession:
+    upload_session = db.query(UploadSession).filter(
+        UploadSession.id == session_id,
+        UploadSession.user_id == current_user.id
+    ).first()
+    if not upload_session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return upload_session
+
+@router.post("/sessions", response_model=UploadSessionResponse, status_code=201)
+async def create_upload_session(
+    session_create: UploadSessionCreate,
+    current_user: Annotated[User, Depends(get_current_user)],
+    db: Session = Depends(get_db)
+):
+    # パートファイルはレプリカのローカルディスクにあるため、同じレプリカに届く保証がなければ受け付けない
+    if not sessions_available():
+        raise HTTPException(
+            status_code=501,
+            detail="Resumable uploads require sticky routing (UPLOAD_SESSION_STICKY_ROUTING); use /api/upload/video or /api/upload/audio"
         )
     
     # ファイル形式チェック
-    if not validate_audio_file(file.filename):
+    if session_create.kind == "video" and not validate_video_file(session_create.filename):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file type. Allowed types: {', '.join(ALLOWED_VIDEO_EXTENSIONS)}"
+        )
+    if session_create.kind == "audio" and not validate_audio_file(session_create.filename):
         raise HTTPException(
             status_code=400,
             detail=f"Invalid audio file type. Allowed types: {', '.join(ALLOWED_AUDIO_EXTENSIONS)}"
         )
     
-    # ユニークなファイル名を生成
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"audio_{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(settings.upload_folder, unique_filename)
+    # ファイルサイズチェック（宣言されたサイズで事前に判定）
+    max_size = _max_size_for_kind(session_create.kind)
+    if session_create.total_size > max_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File size exceeds maximum allowed size of {max_size / 1024 / 1024}MB"
+        )
     
-    # ファイルを保存
-    try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    except Exception as e:
+    upload_session = UploadSession(
+        user_id=current_user.id,
+        kind=session_create.kind,
+        original_filename=session_create.filename,
+        total_size=session_create.total_size,
+        offset=0,
+        expires_at=session_expiry()
+    )
+    db.add(upload_session)
+    db.commit()
+    db.refresh(upload_session)
+    
+    # 空のパートファイルを作成
+    os.makedirs(settings.upload_session_folder, exist_ok=True)
+    open(session_part_path(upload_session.id), "wb").close()
+    
+    return _session_response(upload_session)
+
+@router.head("/sessions/{session_id}")
+async def get_upload_session_offset(
+    session_id: str,
+    current_user: Annotated[User, Depends(get_current_user)],
+    db: Session = Depends(get_db)
+):
+    upload_session = _get_user_session(session_id, current_user, db)
+    return Response(
+        status_code=200,
+        headers={
+            "Upload-Offset": str(upload_session.offset),
+            "Upload-Length": str(upload_session.total_size),
+            "Cache-Control": "no-store"
+        }
+    )
+
+@router.get("/sessions/{session_id}", response_model=UploadSessionResponse)
+async def get_upload_session(
+    session_id: str,
+    current_user: Annotated[User, Depends(get_current_user)],
+    db: Session = Depends(get_db)
+):
+    return _session_response(_get_user_session(session_id, current_user, db))
+
+@router.patch("/sessions/{session_id}", response_model=UploadSessionResponse)
+async def append_upload_session_chunk(
+    session_id: str,
+    request: Request,
+    current_user: Annotated[User, Depends(get_current_user)],
+    db: Session = Depends(get_db),
+    upload_offset: int = Header(..., alias="Upload-Offset")
+):
+    upload_session = _get_user_session(session_id, current_user, db)
+    if upload_session.status != "uploading":
+        raise HTTPException(status_code=409, detail="Upload session is already completed")
+    
+    # ディスク上のサイズを正とし、クライアントのオフセットと一致しなければ拒否
+    stored_size = current_part_size(session_id)
+    if upload_offset != stored_size:
+        upload_session.offset = stored_size
+        db.commit()
         raise HTTPException(
-            status_code=500,
-            detail=f"Failed to save audio file: {str(e)}"
+            status_code=409,
+            detail=f"Upload-Offset mismatch: expected {stored_size}",
+            headers={"Upload-Offset": str(stored_size)}
+        )
+    
+    # 途中で切断されても、受信済みのチャンクはパートファイルに残る
+    try:
+        await write_stream_to_file(
+            request.stream(),
+            session_part_path(session_id),
+            upload_session.total_size,
+            append=True,
+            start_size=stored_size
         )
     finally:
-        await file.close()
+        upload_session.offset = current_part_size(session_id)
+        upload_session.expires_at = session_expiry()
+        db.commit()
     
-    return {
-        "filename": unique_filename,
-        "file_path": file_path,
-        "original_filename": file.filename,
-        "file_size": file_size
-    }
\ No newline at end of file
+    db.refresh(upload_session)
+    return _session_response(upload_session)
+
+@router.post("/sessions/{session_id}/complete", response_model=UploadResult)
+async def complete_upload_session(
+    session_id: str,
+    current_user: Annotated[User, Depends(get_current_user)],
+    db: Session = Depends(get_db)
+):
+    upload_session = _get_user_session(session_id, current_user, db)
+    if upload_session.status == "completed":
+        blob = get_blob(db, upload_session.file_path)
+        return UploadResult(
+            filename=os.path.basename(upload_session.file_path),
+            file_path=upload_session.file_path,
+            original_filename=upload_session.original_filename,
+            file_size=upload_session.total_size,
+            content_hash=blob.sha256 if blob else None,
+            metadata=metadata_for_blob(blob)
+        )
+    
+    stored_size = current_part_size(session_id)
+    if stored_size != upload_session.total_size:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Upload incomplete: {stored_size} of {upload_session.total_size} bytes received",
+            headers={"Upload-Offset": str(stored_size)}
+        )
+    
+    # 通常のアップロードと同じくコンテンツアドレスストアへ移動（メディアとして読めなければ400）
+    try:
+        blob = await store_file(
+            db,
+            session_part_path(session_id),
+            upload_session.kind,
+            extension=os.path.splitext(upload_session.original_filename)[1]
+        )
+    except InvalidMediaError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid {upload_session.kind} file: {e}")
+    
+    upload_session.status = "completed"
+    upload_session.offset = stored_size
+    upload_session.file_path = blob.file_path
+    upload_session.expires_at = session_expiry()
+    db.commit()
+    
+    return UploadResult(
+        filename=os.path.basename(blob.file_path),
+        file_path=blob.file_path,
+        original_filename=upload_session.original_filename,
+        file_size=stored_size,
+        content_hash=blob.sha256,
+        metadata=metadata_for_blob(blob)
+    )
+
+@router.delete("/sessions/{session_id}")
+async def delete_upload_session(
+    session_id: str,
+    current_user: Annotated[User, Depends(get_current_user)],
+    db: Session = Depends(get_db)
+):
+    upload_session = _get_user_session(session_id, current_user, db)
+    part_path = session_part_path(session_id)
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    db.delete(upload_session)
+    db.commit()
+    
+    return {"message": "Upload session deleted successfully"}
@@ -1,13 +1,15 @@
 from .user import UserCreate, UserUpdate, UserInDB, User
 from .project import ProjectCreate, ProjectUpdate, Project
 from .torisetsu import TorisetsuCreate, TorisetsuUpdate, TorisetsuResponse, TorisetsuDetail
-from .manual import ManualCreate, ManualUpdate, Manual, ManualStatusType, ShareTokenRequest, ShareTokenResponse
+from .manual import ManualCreate, ManualUpdate, Manual, ManualStatusType, ShareTokenRequest, ShareTokenResponse, ManualRenditions
 from .auth import Token, TokenData
+from .upload import UploadSessionCreate, UploadSessionResponse, UploadResult, MediaMetadata
 
 __all__ = [
     "UserCreate", "UserUpdate", "UserInDB", "User",
     "ProjectCreate", "ProjectUpdate", "Project",
     "TorisetsuCreate", "TorisetsuUpdate", "TorisetsuResponse", "TorisetsuDetail",
-    "ManualCreate", "ManualUpdate", "Manual", "ManualStatusType", "ShareTokenRequest", "ShareTokenResponse",
-    "Token", "TokenData"
+    "ManualCreate", "ManualUpdate", "Manual", "ManualStatusType", "ShareTokenRequest", "ShareTokenResponse", "ManualRenditions",
+    "Token", "TokenData",
+    "UploadSessionCreate", "UploadSessionResponse", "UploadResult", "MediaMetadata"
 ]
\ No newline at end of file
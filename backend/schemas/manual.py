@@ -1,6 +1,7 @@
 from pydantic import BaseModel
-from typing import Optional, Dict, Any, Literal
+from typing import Optional, Dict, Any, List, Literal
 from datetime import datetime
+from .upload import MediaMetadata
 
 # Valid status values that match the database enum
 ManualStatusType = Literal["draft", "processing", "completed", "failed", "review", "published"]
@@ -23,6 +24,13 @@ class ManualUpdate(BaseModel):
     version: Optional[str] = None
     audio_file_path: Optional[str] = None
 
+class ManualRenditions(BaseModel):
+    status: Literal["pending", "processing", "ready", "failed"]
+    faststart_url: Optional[str] = None
+    hls_url: Optional[str] = None
+    step_aligned_url: Optional[str] = None  # ステップ時刻にキーフレームを揃えたMP4
+    keyframes: Optional[List[float]] = None  # step_aligned_url のキーフレーム時刻（秒）
+
 class Manual(ManualBase):
     id: str
     torisetsu_id: str
@@ -31,6 +39,9 @@ class Manual(ManualBase):
     share_token: Optional[str] = None
     share_enabled: bool = False
     share_expires_at: Optional[datetime] = None
+    renditions: Optional[ManualRenditions] = None
+    video_metadata: Optional[MediaMetadata] = None  # ffprobe で取得した動画の情報（長さ・解像度など）
+    audio_metadata: Optional[MediaMetadata] = None
     created_at: datetime
     updated_at: datetime
     
@@ -0,0 +1,38 @@
+from pydantic import BaseModel, Field
+from typing import Optional, Literal
+from datetime import datetime
+
+UploadKind = Literal["video", "audio"]
+
+class UploadSessionCreate(BaseModel):
+    kind: UploadKind = "video"
+    filename: str
+    total_size: int = Field(..., gt=0)
+
+class UploadSessionResponse(BaseModel):
+    id: str
+    kind: UploadKind
+    original_filename: str
+    total_size: int
+    offset: int
+    status: str
+    chunk_size: int
+    expires_at: datetime
+
+class MediaMetadata(BaseModel):
+    duration: Optional[float] = None  # 秒
+    width: Optional[int] = None
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    video_codec: Optional[str] = None
+    audio_codec: Optional[str] = None
+    bit_rate: Optional[int] = None  # bps
+    format_name: Optional[str] = None
+
+class UploadResult(BaseModel):
+    filename: str
+    file_path: str
+    original_filename: str
+    file_size: int
+    content_hash: Optional[str] = None
+    metadata: Optional[MediaMetadata] = None
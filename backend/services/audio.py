@@ -0,0 +1,245 @@
+"""
+Narration audio normalization
+
+Narration is uploaded as-is (often multi-megabyte WAVs) and its loudness
+varies a lot between manuals. After a manual references an audio file, a
+background job transcodes it to mono Opus at a speech bitrate with two-pass
+EBU R128 loudness normalization (ffmpeg `loudnorm`: measure, then apply
+linearly), stores the result in the content-addressed store and repoints
+every manual that still references the original to the compact file.
+
+The compact file is tracked as an "audio" rendition of the original's
+storage key, so the same upload is only transcoded once. The repoint is a
+conditional update of `audio_file_path` in a single transaction with the
+reference count changes; the released original is collected by the media GC.
+Waveform peaks (services.waveform) are computed for the file manuals end up
+using.
+ffmpeg runs through the bounded runner in services.ffmpeg.
+"""
+import os
+import json
+import asyncio
+import logging
+import tempfile
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import Manual, MediaRendition
+from services import media_store
+from services.ffmpeg import FFmpegError, run_ffmpeg
+from services.renditions import claim_rendition_id, complete_rendition, fail_rendition
+from services.storage import storage, key_for_path, path_for_key
+from services.video_proxy import source_hash
+from services.waveform import generate_waveform
+
+logger = logging.getLogger(__name__)
+
+# Bump when the encoding parameters change so compact audio is rebuilt
+AUDIO_VERSION = 1
+
+AUDIO = "audio"
+COMPACT_AUDIO_EXTENSION = ".webm"
+
+
+def _loudnorm_filter(measured: Optional[Dict[str, Any]] = None) -> str:
+    options = [
+        f"I={settings.audio_loudness_target}",
+        f"TP={settings.audio_true_peak}",
+        f"LRA={settings.audio_loudness_range}",
+    ]
+    if measured is None:
+        options.append("print_format=json")
+    else:
+        options += [
+            f"measured_I={measured['input_i']}",
+            f"measured_TP={measured['input_tp']}",
+            f"measured_LRA={measured['input_lra']}",
+            f"measured_thresh={measured['input_thresh']}",
+            f"offset={measured['target_offset']}",
+            "linear=true",
+        ]
+    return "loudnorm=" + ":".join(options)
+
+
+def parse_loudnorm_output(log: str) -> Dict[str, Any]:
+    """Measurement JSON that loudnorm prints at the end of ffmpeg's log"""
+    start = log.rfind("{")
+    end = log.rfind("}")
+    if start == -1 or end < start:
+        raise FFmpegError("loudnorm did not report measurements")
+    return json.loads(log[start:end + 1])
+
+
+async def _measure(source_path: str) -> Dict[str, Any]:
+    log = await run_ffmpeg([
+        "-i", source_path,
+        "-vn",
+        "-af", _loudnorm_filter(),
+        "-f", "null", "-",
+    ])
+    return parse_loudnorm_output(log)
+
+
+async def _encode(source_path: str, output_path: str, measured: Dict[str, Any]) -> None:
+    af = _loudnorm_filter(measured)
+    # 無音や極端に短い音声は測定値が -inf になるため正規化せずに変換する
+    if any(str(measured.get(name)) in ("-inf", "inf") for name in ("input_i", "input_tp", "input_lra")):
+        af = "anull"
+    await run_ffmpeg([
+        "-i", source_path,
+        "-vn",
+        "-af", af,
+        "-ac", "1",
+        "-ar", "48000",
+        "-c:a", "libopus", "-b:a", settings.audio_opus_bitrate,
+        "-application", "voip",
+        output_path,
+    ])
+
+
+def is_compact_audio(db: Session, key: str) -> bool:
+    """True if the stored audio is itself the output of this pipeline"""
+    return db.query(MediaRendition.id).filter(
+        MediaRendition.kind == AUDIO,
+        MediaRendition.storage_key == key
+    ).first() is not None
+
+
+def compact_audio_path(db: Session, audio_path: Optional[str]) -> Optional[str]:
+    """Path of the ready compact version of an audio file (the path itself if there is none)"""
+    if not audio_path:
+        return audio_path
+    rendition = db.query(MediaRendition).filter(
+        MediaRendition.source_key == key_for_path(audio_path),
+        MediaRendition.kind == AUDIO,
+        MediaRendition.version == AUDIO_VERSION,
+        MediaRendition.status == "ready"
+    ).first()
+    if rendition and media_store.get_blob(db, path_for_key(rendition.storage_key)):
+        return path_for_key(rendition.storage_key)
+    return audio_path
+
+
+def _repoint(audio_path: str, compact_path: str) -> int:
+    """Atomically switch every manual from the original to the compact audio"""
+    db = SessionLocal()
+    try:
+        manual_ids = [row.id for row in db.query(Manual.id).filter(Manual.audio_file_path == audio_path).all()]
+        repointed = 0
+        for manual_id in manual_ids:
+            # ジョブ実行中に音声が差し替えられたマニュアルは更新しない
+            updated = db.query(Manual).filter(
+                Manual.id == manual_id,
+                Manual.audio_file_path == audio_path
+            ).update({Manual.audio_file_path: compact_path}, synchronize_session=False)
+            if updated:
+                media_store.release(db, audio_path)
+                media_store.acquire(db, compact_path)
+                repointed += 1
+        db.commit()
+        return repointed
+    finally:
+        db.close()
+
+
+def _audio_state(audio_path: str) -> Tuple[bool, str, Optional[str]]:
+    """(already compact, path of the compact version, known content hash) of an audio file"""
+    db = SessionLocal()
+    try:
+        key = key_for_path(audio_path)
+        if is_compact_audio(db, key):
+            return True, audio_path, None
+        return False, compact_audio_path(db, audio_path), media_store.content_hash_for_path(db, audio_path)
+    finally:
+        db.close()
+
+
+def _ready_compact_path(audio_path: str) -> str:
+    db = SessionLocal()
+    try:
+        return compact_audio_path(db, audio_path)
+    finally:
+        db.close()
+
+
+async def _build(rendition_id: str, local_source_path: str) -> str:
+    measured = await _measure(local_source_path)
+    fd, temp_path = tempfile.mkstemp(suffix=COMPACT_AUDIO_EXTENSION)
+    os.close(fd)
+    try:
+        await _encode(local_source_path, temp_path, measured)
+        # エンコード後に短いセッションで保存する
+        db = SessionLocal()
+        try:
+            blob = await media_store.store_file(db, temp_path, "audio", COMPACT_AUDIO_EXTENSION)
+            file_path, size = blob.file_path, blob.size
+        finally:
+            db.close()
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    await asyncio.to_thread(complete_rendition, rendition_id, key_for_path(file_path), size, {
+        "input_i": measured.get("input_i"),
+        "input_tp": measured.get("input_tp"),
+        "input_lra": measured.get("input_lra"),
+        "bitrate": settings.audio_opus_bitrate,
+    })
+    return file_path
+
+
+async def normalize_audio(audio_path: Optional[str]) -> Optional[str]:
+    """Build the compact, loudness-normalized audio and repoint manuals to it
+
+    Returns the path manuals use afterwards, or None if another job is handling it.
+    """
+    if not settings.audio_normalization_enabled or not audio_path:
+        return audio_path
+
+    key = key_for_path(audio_path)
+    try:
+        compact, compact_path, content_hash = await asyncio.to_thread(_audio_state, audio_path)
+        if compact:
+            return audio_path
+
+        if compact_path == audio_path:
+            async with storage.local_path(key) as local_source_path:
+                content_hash = content_hash or await source_hash(key, local_source_path)
+                rendition_id = await asyncio.to_thread(claim_rendition_id, key, content_hash, AUDIO, AUDIO_VERSION)
+                if rendition_id is None:
+                    # 他のジョブが作成済み、または処理中
+                    compact_path = await asyncio.to_thread(_ready_compact_path, audio_path)
+                    if compact_path == audio_path:
+                        return None
+                else:
+                    try:
+                        compact_path = await _build(rendition_id, local_source_path)
+                    except Exception as e:
+                        logger.error(f"Failed to normalize audio {key}: {e}")
+                        await asyncio.to_thread(fail_rendition, rendition_id, str(e))
+                        return audio_path
+
+        repointed = await asyncio.to_thread(_repoint, audio_path, compact_path)
+        original_size = await storage.size(key)
+        compact_size = await storage.size(key_for_path(compact_path))
+        logger.info(
+            f"Normalized audio {key} ({original_size or 0} -> {compact_size or 0} bytes), "
+            f"repointed {repointed} manuals"
+        )
+        return compact_path
+    except FileNotFoundError:
+        logger.warning(f"Audio not found in storage, skipping normalization: {audio_path}")
+        return None
+    except Exception as e:
+        logger.error(f"Audio normalization failed for {audio_path}: {e}")
+        return audio_path
+
+
+async def process_audio(audio_path: Optional[str]) -> None:
+    """Background job: normalize a manual's audio, then compute the peaks of the file it ends up using"""
+    final_path = await normalize_audio(audio_path)
+    if final_path:
+        await generate_waveform(final_path)
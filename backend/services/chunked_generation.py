@@ -0,0 +1,251 @@
+"""
+Chunked generation for long videos
+
+A long recording is split into segments of about `generation_segment_seconds`
+and each segment is sent to Gemini concurrently, so end-to-end latency is
+close to that of one segment. The split also keeps each upload far below
+the 100MB limit and Gemini's context limit.
+
+- Boundaries: each cut is moved to the nearest scene change (ffmpeg's
+  `scene` score on the Gemini proxy) or silence (`silencedetect` on the
+  original audio) within `generation_segment_boundary_window_seconds`, so a
+  cut rarely lands in the middle of an operation.
+- Segments are cut from the proxy with accurate seeking and re-encoded, so
+  each segment starts at 0:00 and Gemini's timestamps only need the
+  segment's start added.
+- Merge: step times are offset into the full video, a step that repeats
+  the previous segment's last step across a boundary is dropped, and the
+  steps are renumbered.
+- Progress: as segments finish, the steps of the completed prefix of
+  segments are reported through `on_steps`.
+- Idle segments are trimmed first (services.idle_trimming) and the merged
+  step times are mapped back to the original video.
+"""
+import os
+import re
+import asyncio
+import logging
+import tempfile
+from contextlib import AsyncExitStack
+from difflib import SequenceMatcher
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import settings
+from services import idle_trimming
+from services.ffmpeg import FFmpegError, run_ffmpeg
+from services.gemini_service import gemini_service
+from services.generation_runs import span
+from services.storage import storage, key_for_path
+from utils.timecode import format_timecode, parse_timecode
+
+logger = logging.getLogger(__name__)
+
+Segment = Tuple[float, float]
+
+_STEP_NUMBER = re.compile(r"^(ステップ|Step\s*)\d+")
+
+
+def chunking_identity() -> Dict[str, Any]:
+    """Settings that change a chunked result (part of the generation cache key)"""
+    return {
+        "segment_seconds": settings.generation_segment_seconds,
+        "boundary_window": settings.generation_segment_boundary_window_seconds,
+        "scene_threshold": settings.generation_scene_threshold,
+        "dedup_seconds": settings.generation_segment_dedup_seconds,
+    }
+
+
+def should_chunk(duration: Optional[float]) -> bool:
+    return bool(
+        settings.chunked_generation_enabled
+        and duration
+        and duration > settings.generation_chunk_min_duration_seconds
+    )
+
+
+async def _scene_changes(path: str) -> List[float]:
+    log = await run_ffmpeg([
+        "-i", path,
+        "-map", "0:v:0",
+        "-vf", f"select='gt(scene,{settings.generation_scene_threshold})',showinfo",
+        "-f", "null", "-"
+    ])
+    return [float(t) for t in re.findall(r"pts_time:([0-9.]+)", log)]
+
+
+async def _silences(path: str) -> List[float]:
+    # 無音区間の中央を区切り候補にする
+    log = await run_ffmpeg([
+        "-i", path,
+        "-map", "0:a:0?",
+        "-af", "silencedetect=noise=-35dB:d=0.5",
+        "-f", "null", "-"
+    ])
+    starts = [float(t) for t in re.findall(r"silence_start: (-?[0-9.]+)", log)]
+    ends = [float(t) for t in re.findall(r"silence_end: ([0-9.]+)", log)]
+    return [(start + end) / 2 for start, end in zip(starts, ends)]
+
+
+def plan_segments(duration: float, candidates: List[float]) -> List[Segment]:
+    """Split [0, duration] into evenly sized segments, snapping cuts to nearby candidates"""
+    count = max(1, round(duration / settings.generation_segment_seconds))
+    window = settings.generation_segment_boundary_window_seconds
+    cuts: List[float] = []
+    for index in range(1, count):
+        target = duration * index / count
+        previous = cuts[-1] if cuts else 0.0
+        nearby = [c for c in candidates if abs(c - target) <= window and c > previous + window]
+        cuts.append(min(nearby, key=lambda c: abs(c - target)) if nearby else target)
+    bounds = [0.0, *cuts, duration]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _similar(a: Dict[str, str], b: Dict[str, str]) -> bool:
+    def text(step):
+        title = _STEP_NUMBER.sub('', step.get('title', '')).lstrip(':： ')
+        return f"{title} {step.get('action', '')}".strip()
+    return SequenceMatcher(None, text(a), text(b)).ratio() >= 0.6
+
+
+def merge_segment_steps(results: List[Tuple[Segment, List[Dict[str, str]]]]) -> List[Dict[str, str]]:
+    """Offset each segment's step times, drop duplicates across boundaries and renumber"""
+    window = settings.generation_segment_dedup_seconds
+    merged: List[Dict[str, str]] = []
+    for index, ((start, end), steps) in enumerate(results):
+        for position, step in enumerate(steps):
+            step = dict(step)
+            seconds = parse_timecode(step.get("time"))
+            if seconds is not None:
+                seconds = min(start + seconds, end)
+                step["time"] = format_timecode(seconds)
+
+            # 区切りをまたぐ操作は前後の区間の両方で手順になることがある
+            if index > 0 and position == 0 and merged and seconds is not None:
+                previous = parse_timecode(merged[-1].get("time"))
+                if (previous is not None and seconds - previous <= window
+                        and seconds - start <= window and _similar(merged[-1], step)):
+                    continue
+            merged.append(step)
+
+    for number, step in enumerate(merged, start=1):
+        step["title"] = _STEP_NUMBER.sub(lambda m: f"{m.group(1)}{number}", step.get("title", ""), count=1)
+    return merged
+
+
+async def _cut(source: str, start: float, end: float, output: str) -> None:
+    args = [
+        "-ss", f"{start:.3f}",
+        "-i", source,
+        "-t", f"{end - start:.3f}",
+        "-map", "0:v:0",
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-crf", str(settings.gemini_proxy_crf),
+        "-pix_fmt", "yuv420p",
+        "-map_metadata", "-1",
+    ]
+    if settings.gemini_proxy_keep_audio:
+        args += ["-map", "0:a:0?", "-c:a", "aac", "-ac", "1", "-b:a", "32k"]
+    else:
+        args += ["-an"]
+    await run_ffmpeg(args + ["-movflags", "+faststart", output])
+
+
+async def _boundary_candidates(upload_path: str, source_path: Optional[str]) -> List[float]:
+    candidates: List[float] = []
+    try:
+        candidates += await _scene_changes(upload_path)
+    except FFmpegError as e:
+        logger.warning(f"Scene detection failed, cutting at fixed intervals: {e}")
+    if source_path is None:
+        return sorted(candidates)
+    try:
+        candidates += await _silences(source_path)
+    except FFmpegError as e:
+        logger.warning(f"Silence detection failed: {e}")
+    return sorted(candidates)
+
+
+async def generate_chunked(
+    video_path: str,
+    title: str,
+    language: str,
+    duration: float,
+    on_steps: Optional[Callable[[List[Dict[str, str]]], Awaitable[None]]] = None
+) -> Dict[str, Any]:
+    """Generate a manual from a long video segment by segment; returns the same shape as a single call"""
+    await gemini_service.check_network_connectivity()
+    source_key = key_for_path(video_path)
+    with span("prepare"):
+        upload_key = await gemini_service.prepare_upload_source(source_key)
+        upload_key, kept = await gemini_service.trim_idle(upload_key, source_key)
+    if kept:
+        # 停止区間を除いた動画を分割し、手順の時刻は最後に元の動画の時刻へ戻す
+        duration = idle_trimming.trimmed_duration(kept)
+        if on_steps is not None:
+            report_steps = on_steps
+
+            async def on_steps(steps: List[Dict[str, str]]) -> None:
+                await report_steps(idle_trimming.remap_steps(steps, kept))
+
+    async with AsyncExitStack() as stack:
+        upload_path = await stack.enter_async_context(storage.local_path(upload_key))
+        # 元の音声は時刻がずれるので、停止区間を除いた場合は場面転換だけで区切る（元の動画は開かない）
+        source_path = None
+        if not kept:
+            source_path = upload_path if upload_key == source_key else await stack.enter_async_context(storage.local_path(source_key))
+        with span("prepare"):
+            segments = plan_segments(duration, await _boundary_candidates(upload_path, source_path))
+        logger.info(
+            f"Generating {video_path} in {len(segments)} segments: "
+            + ", ".join(f"{format_timecode(s)}-{format_timecode(e)}" for s, e in segments)
+        )
+
+        results: List[Optional[Tuple[str, List[Dict[str, str]]]]] = [None] * len(segments)
+        semaphore = asyncio.Semaphore(settings.generation_segment_concurrency)
+        reported = 0
+        report_lock = asyncio.Lock()
+
+        async def run_segment(index: int, start: float, end: float) -> None:
+            nonlocal reported
+            async with semaphore:
+                fd, segment_path = tempfile.mkstemp(suffix=".mp4")
+                os.close(fd)
+                try:
+                    with span("prepare"):
+                        await _cut(upload_path, start, end, segment_path)
+                    raw = await gemini_service.generate_segment_response(
+                        segment_path, f"{upload_key}#{start:.3f}-{end:.3f}", title, language
+                    )
+                finally:
+                    if os.path.exists(segment_path):
+                        os.remove(segment_path)
+            results[index] = (raw, gemini_service.extract_steps(raw))
+            logger.info(f"Segment {index + 1}/{len(segments)} done: {len(results[index][1])} steps")
+
+            # 先頭から連続して完了した区間の手順を途中経過として渡す
+            if on_steps is None:
+                return
+            async with report_lock:
+                done = reported
+                while done < len(results) and results[done] is not None:
+                    done += 1
+                if done > reported:
+                    reported = done
+                    await on_steps(merge_segment_steps([(segments[i], results[i][1]) for i in range(done)]))
+
+        # 1区間でも失敗したら残りの区間を取り消してから抜ける（一時ファイルを読んでいる ffmpeg や Gemini の呼び出しを残さない）
+        try:
+            async with asyncio.TaskGroup() as group:
+                for i, (start, end) in enumerate(segments):
+                    group.create_task(run_segment(i, start, end))
+        except ExceptionGroup as e:
+            # ジョブの再試行の判定には最初に失敗した区間の例外を渡す
+            raise e.exceptions[0] from None
+
+    with span("parse"):
+        raw_response = "\n\n".join(raw for raw, _ in results)
+        content = gemini_service.parse_manual_response(raw_response, title)
+        steps = merge_segment_steps([(segment, steps) for segment, (_, steps) in zip(segments, results)])
+        content["steps"] = idle_trimming.remap_steps(steps, kept) if kept else steps
+    return content
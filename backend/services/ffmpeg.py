@@ -0,0 +1,96 @@
+"""
+Bounded ffmpeg/ffprobe runner
+
+ffmpeg already runs out of process, so the "pool" is a semaphore around
+subprocess creation: at most `settings.media_max_concurrent_jobs` ffmpeg
+processes run at once per API/worker process, and each one is killed if it
+exceeds its timeout.
+"""
+import json
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+class FFmpegError(RuntimeError):
+    """Raised when ffmpeg/ffprobe exits with an error or times out"""
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(settings.media_max_concurrent_jobs)
+    return _semaphore
+
+
+async def _run(cmd: List[str], timeout: float) -> Tuple[bytes, bytes]:
+    async with _get_semaphore():
+        logger.debug(f"Running: {' '.join(cmd)}")
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except FileNotFoundError as e:
+            raise FFmpegError(f"{cmd[0]} is not installed: {e}")
+
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise FFmpegError(f"{cmd[0]} timed out after {timeout} seconds")
+        except asyncio.CancelledError:
+            # 取り消されたら子プロセスも止める（入力ファイルが削除される前に読み終えさせない）
+            process.kill()
+            await process.wait()
+            raise
+
+    if process.returncode != 0:
+        message = stderr.decode(errors="replace").strip().splitlines()[-5:]
+        raise FFmpegError(f"{cmd[0]} failed with exit code {process.returncode}: {' / '.join(message)}")
+    return stdout, stderr
+
+
+async def run_ffmpeg(args: List[str], timeout: Optional[float] = None) -> str:
+    """Run ffmpeg with the given arguments and return its log output"""
+    cmd = ["ffmpeg", "-hide_banner", "-nostdin", "-y", *args]
+    _, stderr = await _run(cmd, timeout or settings.media_job_timeout_seconds)
+    return stderr.decode(errors="replace")
+
+
+async def run_ffprobe(path: str, timeout: float = 60) -> Dict[str, Any]:
+    """Return ffprobe's JSON description (format and streams) of a media file"""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-print_format", "json",
+        "-show_format", "-show_streams",
+        path,
+    ]
+    stdout, _ = await _run(cmd, timeout)
+    return json.loads(stdout.decode(errors="replace") or "{}")
+
+
+async def probe_keyframes(path: str, timeout: float = 300) -> List[float]:
+    """Presentation timestamps (seconds) of the video keyframes, read from packet flags without decoding"""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=print_section=0",
+        path,
+    ]
+    stdout, _ = await _run(cmd, timeout)
+    keyframes = []
+    for line in stdout.decode(errors="replace").splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(round(float(pts_time), 3))
+    return sorted(keyframes)
@@ -0,0 +1,128 @@
+"""
+Frame sampling for keyframe generation mode
+
+Screen recordings are mostly a static UI with a few visible changes, so
+instead of the full video (about 258 tokens per second at Gemini's 1 fps
+sampling) the keyframe mode sends only the frames where the screen changes:
+
+- ffmpeg's `scene` score selects the first frame plus every frame that
+  differs from the previous one by more than `gemini_keyframe_scene_threshold`
+  (screen changes score far lower than camera cuts, hence the low default);
+- bursts closer than `gemini_keyframe_min_interval_seconds` (animations,
+  typing) are collapsed into their last, settled frame, labelled with the
+  time the burst started so step times point at the start of the operation;
+- at most `gemini_keyframe_max_frames` frames are kept, evenly spread over
+  the selected ones, and fewer if their JPEGs together exceed
+  `gemini_keyframe_max_inline_bytes` (they are sent inline in one request,
+  which Gemini limits to about 20MB after base64 encoding);
+- each frame carries its source timestamp, which is written next to the
+  image in the request so Gemini can fill `time` fields correctly.
+"""
+import os
+import re
+import math
+import logging
+import tempfile
+from dataclasses import dataclass
+from typing import List
+
+from config import settings
+from services.ffmpeg import run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+# Gemini の画像トークン数（384px 以下は 258、それより大きい画像は 768px のタイルごとに 258）
+IMAGE_TOKENS = 258
+IMAGE_TILE_SIZE = 768
+
+_SHOWINFO = re.compile(r"\bn:\s*\d+.*?pts_time:([0-9.]+).*?\bs:(\d+)x(\d+)")
+
+
+@dataclass
+class SampledFrame:
+    seconds: float
+    data: bytes
+    width: int
+    height: int
+
+    @property
+    def tokens(self) -> int:
+        if self.width <= 384 and self.height <= 384:
+            return IMAGE_TOKENS
+        return IMAGE_TOKENS * math.ceil(self.width / IMAGE_TILE_SIZE) * math.ceil(self.height / IMAGE_TILE_SIZE)
+
+
+def estimate_frame_tokens(frames: List[SampledFrame]) -> int:
+    return sum(frame.tokens for frame in frames)
+
+
+def _collapse_bursts(times: List[float]) -> List[tuple]:
+    """(label time, index of the frame to send) for each burst of nearby changes"""
+    bursts: List[tuple] = []
+    for index, seconds in enumerate(times):
+        if bursts and seconds - times[bursts[-1][1]] < settings.gemini_keyframe_min_interval_seconds:
+            bursts[-1] = (bursts[-1][0], index)
+        else:
+            bursts.append((seconds, index))
+    return bursts
+
+
+def _fit_bytes(frames: List[SampledFrame], max_bytes: int) -> List[SampledFrame]:
+    """Evenly spread subset of `frames` whose images fit in `max_bytes`"""
+    selected = frames
+    while len(selected) > 1:
+        total = sum(len(frame.data) for frame in selected)
+        if total <= max_bytes:
+            break
+        # 平均サイズから見積もった枚数まで一度に減らし、まだ超える場合は1枚ずつ減らす
+        selected = _spread(frames, min(len(selected) - 1, max(int(len(selected) * max_bytes / total), 1)))
+    return selected
+
+
+def _spread(items: list, limit: int) -> list:
+    if len(items) <= limit:
+        return items
+    return [items[round(i * (len(items) - 1) / (limit - 1))] for i in range(limit)] if limit > 1 else items[:1]
+
+
+async def sample_frames(video_path: str) -> List[SampledFrame]:
+    """Extract the distinct frames of a local video file with their timestamps"""
+    height = settings.gemini_proxy_max_height
+    with tempfile.TemporaryDirectory() as output_dir:
+        log = await run_ffmpeg([
+            "-i", video_path,
+            "-map", "0:v:0",
+            "-an",
+            "-vf", (
+                f"select='eq(n\\,0)+gt(scene\\,{settings.gemini_keyframe_scene_threshold})',"
+                f"scale=-2:'min({height}\\,ih)',showinfo"
+            ),
+            "-fps_mode", "vfr",
+            "-q:v", "4",
+            os.path.join(output_dir, "frame_%06d.jpg")
+        ])
+        # showinfo の出力順は書き出した画像の番号順と一致する
+        info = [(float(t), int(w), int(h)) for t, w, h in _SHOWINFO.findall(log)]
+        names = sorted(os.listdir(output_dir))
+        if len(info) != len(names):
+            logger.warning(f"Frame count mismatch ({len(info)} timestamps, {len(names)} images), using the shorter")
+        info = info[:len(names)]
+
+        bursts = _spread(_collapse_bursts([seconds for seconds, _, _ in info]), settings.gemini_keyframe_max_frames)
+        frames = []
+        for label, index in bursts:
+            with open(os.path.join(output_dir, names[index]), "rb") as f:
+                data = f.read()
+            _, width, frame_height = info[index]
+            frames.append(SampledFrame(seconds=label, data=data, width=width, height=frame_height))
+
+    selected = len(frames)
+    frames = _fit_bytes(frames, settings.gemini_keyframe_max_inline_bytes)
+    if len(frames) < selected:
+        logger.info(f"Dropped {selected - len(frames)} frames to stay within {settings.gemini_keyframe_max_inline_bytes} bytes")
+
+    logger.info(
+        f"Sampled {len(frames)} frames from {len(info)} scene changes "
+        f"({sum(len(frame.data) for frame in frames) / 1024:.0f}KB, ~{estimate_frame_tokens(frames)} tokens)"
+    )
+    return frames
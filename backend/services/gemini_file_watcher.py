@@ -0,0 +1,205 @@
+"""
+Gemini file state watcher
+
+After an upload Gemini processes the video before it can be used (state
+PROCESSING -> ACTIVE). Instead of every upload polling `get_file` on its
+own thread at a fixed interval, waiting jobs register the file with a
+single watcher task per process, which:
+
+- checks the files that are due together on one worker thread: up to
+  `GET_FILE_LIMIT` files with one `get_file` each, more with a `list_files`
+  scan bounded to `LIST_SCAN_PAGES` pages (newest first), falling back to
+  `get_file` for any file the scan did not reach. Every call is taken from
+  the shared Gemini rate limiter;
+- schedules checks from the file size and the processing speed observed
+  so far: the first check comes after a quarter of the expected processing
+  time, then the interval grows geometrically up to half of it, so small
+  files are picked up within a fraction of a second and large ones are not
+  polled needlessly. Checks due within `COALESCE_WINDOW` of each other are
+  merged into one call;
+- resolves the waiting jobs' futures as soon as a file turns ACTIVE (or
+  FAILED, or exceeds the wait timeout).
+
+The processing time of each file is logged with its seconds per MB, and
+the caller records the wait as a `processing_wait` span (with the file
+size as `request_bytes`) in generation_runs.
+"""
+import time
+import asyncio
+import itertools
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import google.generativeai as genai
+
+from services.gemini_rate_limit import gemini_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+MIN_INTERVAL = 0.5
+MAX_INTERVAL = 10.0
+BACKOFF = 1.5
+COALESCE_WINDOW = 0.5
+# 実績がないときの処理速度の見込み（秒/MB）
+DEFAULT_SECONDS_PER_MB = 1.0
+# 実績の指数移動平均の重み
+RATE_SMOOTHING = 0.2
+# これ以下の件数は get_file で1件ずつ確認する
+GET_FILE_LIMIT = 3
+# list_files で確認するページ数の上限（1ページ100件）
+LIST_SCAN_PAGES = 2
+LIST_PAGE_SIZE = 100
+
+
+@dataclass
+class _Pending:
+    future: asyncio.Future
+    size_mb: float
+    started: float
+    deadline: float
+    interval: float
+    max_interval: float
+    next_check: float
+    checks: int = 0
+
+
+class FileStateWatcher:
+    def __init__(self):
+        self._pending: Dict[str, _Pending] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.seconds_per_mb = DEFAULT_SECONDS_PER_MB
+
+    def _intervals(self, size_mb: float):
+        # 見込み処理時間の1/4で最初に確認し、間隔は見込みの1/2まで伸ばす
+        estimate = size_mb * self.seconds_per_mb
+        first = min(max(estimate / 4, MIN_INTERVAL), MAX_INTERVAL)
+        return first, min(max(estimate / 2, first), MAX_INTERVAL)
+
+    async def wait_active(self, video_file: Any, size_bytes: int, timeout: float = 300) -> Any:
+        """Wait until an uploaded file leaves PROCESSING; returns the ACTIVE file"""
+        if video_file.state.name != "PROCESSING":
+            return self._check_state(video_file)
+
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        size_mb = max(size_bytes / (1024 * 1024), 0.01)
+        interval, max_interval = self._intervals(size_mb)
+        pending = _Pending(
+            future=loop.create_future(),
+            size_mb=size_mb,
+            started=now,
+            deadline=now + timeout,
+            interval=interval,
+            max_interval=max_interval,
+            next_check=min(now + interval, now + timeout)
+        )
+        self._pending[video_file.name] = pending
+        self._ensure_running()
+        self._wakeup.set()
+        try:
+            return await pending.future
+        finally:
+            if self._pending.get(video_file.name) is pending:
+                del self._pending[video_file.name]
+
+    def _ensure_running(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+
+    def _check_state(self, video_file: Any) -> Any:
+        if video_file.state.name == "FAILED":
+            raise ValueError(f"Video processing failed: {video_file.state}")
+        return video_file
+
+    async def _run(self) -> None:
+        while self._pending:
+            now = time.monotonic()
+            waiting = {name: p for name, p in self._pending.items() if not p.future.done()}
+            if not waiting:
+                # 結果を受け取ったジョブが登録を外すまで待つ
+                await asyncio.sleep(0)
+                continue
+            next_check = min(p.next_check for p in waiting.values())
+            if next_check > now:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(next_check - now, 0))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due = [name for name, p in waiting.items() if p.next_check <= now + COALESCE_WINDOW]
+            try:
+                states = await self._fetch_states(due)
+            except Exception as e:
+                logger.warning(f"Gemini file status check failed: {e}")
+                states = {}
+            self._apply(due, states)
+
+    async def _fetch_states(self, names: List[str]) -> Dict[str, Any]:
+        states = {}
+        if len(names) > GET_FILE_LIMIT:
+            async with gemini_rate_limiter.limit(requests=LIST_SCAN_PAGES):
+                states = await asyncio.to_thread(self._list_states, names)
+        missing = [name for name in names if name not in states]
+        if missing:
+            async with gemini_rate_limiter.limit(requests=len(missing)):
+                states.update(await asyncio.to_thread(self._get_states, missing))
+        return states
+
+    def _list_states(self, names: List[str]) -> Dict[str, Any]:
+        # 一覧は新しい順なので、アップロード直後のファイルは先頭のページで見つかる
+        wanted = set(names)
+        states = {}
+        files = genai.list_files(page_size=LIST_PAGE_SIZE)
+        for video_file in itertools.islice(files, LIST_SCAN_PAGES * LIST_PAGE_SIZE):
+            if video_file.name in wanted:
+                states[video_file.name] = video_file
+                if len(states) == len(wanted):
+                    break
+        return states
+
+    def _get_states(self, names: List[str]) -> Dict[str, Any]:
+        return {name: genai.get_file(name) for name in names}
+
+    def _apply(self, names: List[str], states: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        for name in names:
+            pending = self._pending.get(name)
+            if pending is None or pending.future.done():
+                continue
+            pending.checks += 1
+            video_file = states.get(name)
+            state = video_file.state.name if video_file is not None else None
+
+            if state == "ACTIVE":
+                elapsed = now - pending.started
+                per_mb = self._record(elapsed, pending.size_mb)
+                logger.info(
+                    f"Gemini file {name} is active after {elapsed:.1f}s "
+                    f"({pending.size_mb:.1f}MB, {per_mb:.2f}s/MB, {pending.checks} checks)"
+                )
+                pending.future.set_result(video_file)
+            elif state == "FAILED":
+                pending.future.set_exception(ValueError(f"Video processing failed: {video_file.state}"))
+            elif now >= pending.deadline:
+                pending.future.set_exception(
+                    TimeoutError(f"Video processing timeout after {now - pending.started:.0f} seconds")
+                )
+            else:
+                pending.interval = min(pending.interval * BACKOFF, pending.max_interval)
+                pending.next_check = min(now + pending.interval, pending.deadline)
+
+    def _record(self, elapsed: float, size_mb: float) -> float:
+        """Update the expected processing speed; returns this file's seconds per MB"""
+        per_mb = elapsed / size_mb
+        self.seconds_per_mb += RATE_SMOOTHING * (per_mb - self.seconds_per_mb)
+        return per_mb
+
+
+# Create global instance
+file_watcher = FileStateWatcher()
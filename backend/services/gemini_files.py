@@ -0,0 +1,198 @@
+"""
+Gemini file registry
+
+Videos uploaded to the Gemini Files API stay usable for 48 hours, and the
+upload plus the PROCESSING wait often takes minutes. The registry maps the
+uploaded video (its content-addressed storage key, or its sha256 for legacy
+files) to the live Gemini file name and expiry in `gemini_files`, so every
+worker can reuse a handle instead of uploading the same video again.
+
+- Handles are reused only while more than `gemini_file_refresh_margin_seconds`
+  of their lifetime is left; after that the next request uploads a fresh
+  copy and replaces the entry.
+- A reused handle is checked with a cheap `get_file` call first, and callers
+  invalidate it if Gemini rejects it (e.g. deleted out of band).
+- A background loop in the workers deletes handles that have not been used
+  for `gemini_file_idle_seconds` from Gemini (freeing Files API quota) and
+  drops expired entries from the registry.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, List, Optional, Tuple
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from sqlalchemy.exc import IntegrityError
+
+from config import settings
+from database import SessionLocal
+from models import GeminiFile
+from services.gemini_rate_limit import gemini_rate_limiter
+from services.video_proxy import content_hash_from_key
+
+logger = logging.getLogger(__name__)
+
+# Files API の保存期間
+FILE_LIFETIME = timedelta(hours=48)
+
+
+def source_id_for_key(upload_key: str) -> Optional[str]:
+    """Registry id of a content-addressed storage key (None when the file must be hashed)"""
+    if upload_key.startswith("derived/") or content_hash_from_key(upload_key):
+        return upload_key
+    return None
+
+
+def _expires_at(video_file: Any) -> datetime:
+    expiration = getattr(video_file, "expiration_time", None)
+    if isinstance(expiration, datetime):
+        if expiration.tzinfo is not None:
+            expiration = expiration.astimezone(timezone.utc).replace(tzinfo=None)
+        return expiration
+    return datetime.utcnow() + FILE_LIFETIME
+
+
+def _refresh_deadline() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=settings.gemini_file_refresh_margin_seconds)
+
+
+async def _delete_remote(name: str) -> None:
+    try:
+        async with gemini_rate_limiter.limit():
+            await asyncio.to_thread(genai.delete_file, name)
+        logger.info(f"Deleted Gemini file {name}")
+    except google_exceptions.NotFound:
+        pass
+    except Exception as e:
+        logger.warning(f"Failed to delete Gemini file {name}: {e}")
+
+
+def invalidate(source_id: str, name: str) -> None:
+    """Forget a handle (only if it still points at `name`)"""
+    db = SessionLocal()
+    try:
+        db.query(GeminiFile).filter(
+            GeminiFile.source_id == source_id, GeminiFile.name == name
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _registered_name(source_id: str) -> Optional[str]:
+    db = SessionLocal()
+    try:
+        entry = db.query(GeminiFile).filter(
+            GeminiFile.source_id == source_id,
+            GeminiFile.expires_at > _refresh_deadline()
+        ).first()
+        return entry.name if entry else None
+    finally:
+        db.close()
+
+
+def _mark_used(source_id: str, name: str) -> None:
+    db = SessionLocal()
+    try:
+        db.query(GeminiFile).filter(GeminiFile.source_id == source_id, GeminiFile.name == name).update({
+            GeminiFile.use_count: GeminiFile.use_count + 1,
+            GeminiFile.last_used_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def reuse(source_id: str) -> Optional[Any]:
+    """Live Gemini file for an uploaded video, or None if it has to be uploaded"""
+    name = await asyncio.to_thread(_registered_name, source_id)
+    if name is None:
+        return None
+
+    try:
+        async with gemini_rate_limiter.limit():
+            video_file = await asyncio.to_thread(genai.get_file, name)
+    except google_exceptions.NotFound:
+        video_file = None
+    except Exception as e:
+        # 確認できないだけなら再アップロードで進める（登録は残す）
+        logger.warning(f"Could not check Gemini file {name}: {e}")
+        return None
+    if video_file is None or video_file.state.name != "ACTIVE":
+        logger.info(f"Gemini file {name} is no longer usable, uploading again")
+        await asyncio.to_thread(invalidate, source_id, name)
+        return None
+
+    await asyncio.to_thread(_mark_used, source_id, name)
+    logger.info(f"Reusing Gemini file {name} for {source_id}")
+    return video_file
+
+
+def register(source_id: str, video_file: Any) -> bool:
+    """
+    Record a freshly uploaded file; False if another worker registered a
+    live handle for the same video first (the caller then deletes its copy)
+    """
+    db = SessionLocal()
+    try:
+        entry = db.get(GeminiFile, source_id, with_for_update=True)
+        if entry is not None:
+            if entry.expires_at > _refresh_deadline():
+                return False
+            # 置き換える期限間近のファイルは使用中の生成があり得るので消さず、Gemini 側の期限切れに任せる
+        else:
+            entry = GeminiFile(source_id=source_id)
+            db.add(entry)
+        entry.name = video_file.name
+        entry.uri = getattr(video_file, "uri", None)
+        entry.mime_type = getattr(video_file, "mime_type", None)
+        entry.expires_at = _expires_at(video_file)
+        entry.use_count = 1
+        entry.created_at = datetime.utcnow()
+        entry.last_used_at = datetime.utcnow()
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return False
+    finally:
+        db.close()
+    return True
+
+
+def _drop_stale_entries() -> Tuple[int, List[str]]:
+    """Delete idle and expired handles; returns (removed, names still live on Gemini)"""
+    now = datetime.utcnow()
+    idle_before = now - timedelta(seconds=settings.gemini_file_idle_seconds)
+    db = SessionLocal()
+    try:
+        entries = db.query(GeminiFile).filter(
+            (GeminiFile.expires_at <= now) | (GeminiFile.last_used_at < idle_before)
+        ).with_for_update(skip_locked=True).all()
+        live = [entry.name for entry in entries if entry.expires_at > now]
+        for entry in entries:
+            db.delete(entry)
+        db.commit()
+        return len(entries), live
+    finally:
+        db.close()
+
+
+async def cleanup_files() -> int:
+    """Delete idle handles from Gemini and drop expired ones; returns how many were removed"""
+    removed, live = await asyncio.to_thread(_drop_stale_entries)
+    for name in live:
+        await _delete_remote(name)
+    return removed
+
+
+async def gemini_file_cleanup_loop() -> None:
+    """Periodically remove idle and expired Gemini files"""
+    while True:
+        try:
+            removed = await cleanup_files()
+            if removed:
+                logger.info(f"Removed {removed} idle or expired Gemini files")
+        except Exception as e:
+            logger.error(f"Gemini file cleanup failed: {e}")
+        await asyncio.sleep(settings.gemini_file_cleanup_interval_seconds)
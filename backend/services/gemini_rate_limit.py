@@ -0,0 +1,157 @@
+"""
+Shared Gemini rate limiter
+
+Every process used to call Gemini on its own and only learn about the quota
+from `TooManyRequests`, after which tenacity slept for a fixed 4-10s, so
+adding workers made throttling worse. All Gemini calls made for
+GeminiService (including the file registry's reuse checks and cleanup and
+the file state watcher's status polls) now draw from two token buckets
+shared by every API and worker process:
+
+- `requests`: one per call, refilled at `gemini_requests_per_minute`;
+- `tokens`: the estimated prompt + output tokens of a generate call,
+  refilled at `gemini_tokens_per_minute`. The estimate is settled with
+  Gemini's reported usage after the call (refunding or charging the
+  difference), and refunded if the call fails.
+
+The buckets live in the database and are updated in one short transaction
+per call under a transaction-scoped advisory lock on PostgreSQL (the same
+approach as the generation scheduler). A call that finds a bucket short
+still takes its share, leaving the level negative, and sleeps exactly
+until the refill covers it; later callers see the deeper deficit and wait
+behind it, so waiting calls are released in order at the configured rate
+without polling. Each bucket holds at most `gemini_rate_burst_seconds` of
+refill.
+
+If Gemini still answers 429 (another client sharing the quota, or limits
+set too high), both buckets are emptied so every process waits for the
+refill instead of retrying blindly.
+"""
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, Dict, Optional
+
+from google.api_core import exceptions as google_exceptions
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from config import settings
+from database import SessionLocal
+from models import GeminiRateBucket
+from services.generation_runs import span
+
+logger = logging.getLogger(__name__)
+
+REQUESTS = "requests"
+TOKENS = "tokens"
+
+# pg_advisory_xact_lock のキー（バケットの更新を直列化する）
+_RATE_LIMIT_LOCK_KEY = 0x67656D69
+
+
+class Reservation:
+    """Tokens taken for one call; set `used_tokens` to settle with the actual usage"""
+
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+        self.used_tokens: Optional[int] = None
+
+
+class GeminiRateLimiter:
+    def __init__(self):
+        # 同じプロセス内の更新は先に直列化する（SQLite では読み取りと更新の間に割り込まれるため）
+        self._lock = threading.Lock()
+
+    def _rates(self) -> Dict[str, float]:
+        """Refill per second of each enabled bucket"""
+        rates = {}
+        if settings.gemini_requests_per_minute > 0:
+            rates[REQUESTS] = settings.gemini_requests_per_minute / 60
+        if settings.gemini_tokens_per_minute > 0:
+            rates[TOKENS] = settings.gemini_tokens_per_minute / 60
+        return rates
+
+    def _update(self, costs: Dict[str, float], drain: bool = False) -> float:
+        """Take `costs` from the buckets (negative costs refund); returns seconds until they are covered"""
+        with self._lock:
+            try:
+                return self._update_buckets(costs, drain)
+            except IntegrityError:
+                # 別のプロセスが同時に最初のバケットを作成した
+                return self._update_buckets(costs, drain)
+
+    def _update_buckets(self, costs: Dict[str, float], drain: bool) -> float:
+        rates = self._rates()
+        db = SessionLocal()
+        try:
+            if db.get_bind().dialect.name == "postgresql":
+                db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _RATE_LIMIT_LOCK_KEY})
+            now = datetime.utcnow()
+            wait = 0.0
+            for name, cost in costs.items():
+                rate = rates.get(name)
+                if not rate:
+                    continue
+                capacity = rate * settings.gemini_rate_burst_seconds
+                bucket = db.get(GeminiRateBucket, name)
+                if bucket is None:
+                    bucket = GeminiRateBucket(name=name, level=capacity, updated_at=now)
+                    db.add(bucket)
+                elapsed = max((now - bucket.updated_at).total_seconds(), 0.0)
+                level = min(capacity, bucket.level + elapsed * rate)
+                if drain:
+                    level = min(level, 0.0)
+                level = min(capacity, level - cost)
+                if level < 0:
+                    wait = max(wait, -level / rate)
+                bucket.level = level
+                bucket.updated_at = now
+            db.commit()
+            return wait
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _apply(self, costs: Dict[str, float], drain: bool = False) -> float:
+        try:
+            return await asyncio.to_thread(self._update, costs, drain)
+        except Exception as e:
+            # DBに届かないときは制限せずに呼び出す（429 になれば tenacity が再試行する）
+            logger.warning(f"Gemini rate limiter unavailable, calling without it: {e}")
+            return 0.0
+
+    @asynccontextmanager
+    async def limit(self, tokens: int = 0, requests: int = 1) -> AsyncIterator[Reservation]:
+        """Wait until `requests` requests (and `tokens` tokens) fit in the shared quota, then run the call"""
+        reservation = Reservation(tokens)
+        if not settings.gemini_rate_limit_enabled or not self._rates():
+            yield reservation
+            return
+
+        wait = await self._apply({REQUESTS: requests, TOKENS: tokens})
+        if wait > 0:
+            logger.info(f"Waiting {wait:.1f}s for the Gemini rate limit")
+            with span("rate_limit_wait"):
+                await asyncio.sleep(wait)
+
+        try:
+            yield reservation
+        except google_exceptions.TooManyRequests:
+            logger.warning("Gemini returned 429 under the rate limiter, emptying the shared buckets")
+            await self._apply({REQUESTS: 0, TOKENS: 0}, drain=True)
+            raise
+        except Exception:
+            if tokens:
+                await self._apply({TOKENS: -tokens})
+            raise
+        if reservation.used_tokens is not None and reservation.used_tokens != tokens:
+            await self._apply({TOKENS: reservation.used_tokens - tokens})
+
+
+# Create global instance
+gemini_rate_limiter = GeminiRateLimiter()
@@ -2,9 +2,11 @@
 Gemini API service for generating manuals from video content
 """
 import os
+import time
 import logging
 import asyncio
-from typing import Optional, Dict, Any, List
+import threading
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 import base64
@@ -14,9 +16,98 @@ import urllib3
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 from google.api_core import exceptions as google_exceptions
 from config import settings
+from services.storage import storage, key_for_path
+from services.ffmpeg import FFmpegError
+from services.video_proxy import ensure_gemini_proxy
+from services.media_store import hash_file
+from services import gemini_files, idle_trimming
+from services.generation_runs import current_attempt, note_attempt, span
+from services.gemini_rate_limit import gemini_rate_limiter
+from services.gemini_file_watcher import file_watcher
+from services.frame_sampling import estimate_frame_tokens, sample_frames
+from utils.timecode import format_timecode
 
 logger = logging.getLogger(__name__)
 
+# Gemini samples uploaded video at 1 frame per second
+VIDEO_TOKENS_PER_SECOND = 258
+AUDIO_TOKENS_PER_SECOND = 32
+# Rough text tokenization for rate limiter estimates (Japanese runs denser than English)
+CHARS_PER_TEXT_TOKEN = 3
+
+# Bump when _create_manual_prompt or parse_manual_response changes (invalidates cached results)
+PROMPT_VERSION = 1
+
+class StepStreamParser:
+    """
+    Incremental parser for the "### ステップ" / "### Step" blocks of a manual
+
+    Text can be fed in arbitrary chunks (as streamed by Gemini); a step is
+    complete once the next step header arrives or the stream finishes.
+    """
+    
+    def __init__(self):
+        self.steps: List[Dict[str, str]] = []
+        self._current: Optional[Dict[str, str]] = None
+        self._buffer = ""
+    
+    def feed(self, text: str) -> List[Dict[str, str]]:
+        """Consume a chunk; returns the steps completed by it"""
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split('\n')
+        completed = []
+        for line in lines:
+            step = self._consume_line(line)
+            if step:
+                completed.append(step)
+        return completed
+    
+    def finish(self) -> List[Dict[str, str]]:
+        """Flush the last line and step at the end of the stream"""
+        completed = []
+        if self._buffer:
+            step = self._consume_line(self._buffer)
+            self._buffer = ""
+            if step:
+                completed.append(step)
+        if self._current:
+            self.steps.append(self._current)
+            completed.append(self._current)
+            self._current = None
+        return completed
+    
+    def _consume_line(self, line: str) -> Optional[Dict[str, str]]:
+        line = line.strip()
+        completed = None
+        
+        # Check if line is a step header
+        if line.startswith('### ステップ') or line.startswith('### Step'):
+            if self._current:
+                self.steps.append(self._current)
+                completed = self._current
+            self._current = {
+                "title": line[4:].strip(),
+                "action": "",
+                "screen": "",
+                "notes": "",
+                "verification": "",
+                "time": ""
+            }
+        elif self._current and line:
+            # Extract specific fields
+            if line.startswith('- **操作手順**:') or line.startswith('- **操作内容**:') or line.startswith('- **Action**:'):
+                self._current["action"] = line.split(':', 1)[1].strip()
+            elif line.startswith('- **時間**:') or line.startswith('- **Time**:'):
+                self._current["time"] = line.split(':', 1)[1].strip()
+            elif line.startswith('- **画面**:') or line.startswith('- **Screen**:'):
+                self._current["screen"] = line.split(':', 1)[1].strip()
+            elif line.startswith('- **注意点**:') or line.startswith('- **Notes**:'):
+                self._current["notes"] = line.split(':', 1)[1].strip()
+            elif line.startswith('- **確認事項**:') or line.startswith('- **Verification**:'):
+                self._current["verification"] = line.split(':', 1)[1].strip()
+        return completed
+
+
 class GeminiService:
     def __init__(self):
         """Initialize Gemini service with API key from settings"""
@@ -35,14 +126,15 @@ class GeminiService:
         
         # Initialize the model
         self.model_name = settings.gemini_model
+        self.generation_config = {
+            "temperature": 0.7,
+            "top_p": 0.8,
+            "top_k": 40,
+            "max_output_tokens": 8192,
+        }
         self.model = genai.GenerativeModel(
             model_name=self.model_name,
-            generation_config={
-                "temperature": 0.7,
-                "top_p": 0.8,
-                "top_k": 40,
-                "max_output_tokens": 8192,
-            },
+            generation_config=self.generation_config,
             safety_settings={
                 HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
                 HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
@@ -53,37 +145,42 @@ class GeminiService:
         
         logger.info(f"Gemini service initialized with model: {self.model_name}")
 
-    async def _check_network_connectivity(self) -> None:
+    async def check_network_connectivity(self) -> None:
         """Check network connectivity to Google's services"""
-        try:
-            # Test DNS resolution
-            socket.getaddrinfo('generativelanguage.googleapis.com', 443, socket.AF_UNSPEC, socket.SOCK_STREAM)
-            logger.info("Network connectivity check passed")
-        except socket.gaierror as e:
-            logger.error(f"DNS resolution failed: {e}")
-            raise ConnectionError(f"DNS resolution failed for Gemini API. Please check your internet connection and DNS settings: {e}")
-        except Exception as e:
-            logger.error(f"Network connectivity check failed: {e}")
-            raise ConnectionError(f"Network connectivity issue: {e}")
+        with span("dns_check"):
+            try:
+                # Test DNS resolution
+                socket.getaddrinfo('generativelanguage.googleapis.com', 443, socket.AF_UNSPEC, socket.SOCK_STREAM)
+                logger.info("Network connectivity check passed")
+            except socket.gaierror as e:
+                logger.error(f"DNS resolution failed: {e}")
+                raise ConnectionError(f"DNS resolution failed for Gemini API. Please check your internet connection and DNS settings: {e}")
+            except Exception as e:
+                logger.error(f"Network connectivity check failed: {e}")
+                raise ConnectionError(f"Network connectivity issue: {e}")
 
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=4, max=10),
-        retry=retry_if_exception_type((google_exceptions.ServiceUnavailable, google_exceptions.TooManyRequests, ConnectionError))
+        retry=retry_if_exception_type((google_exceptions.ServiceUnavailable, google_exceptions.TooManyRequests, ConnectionError)),
+        before=note_attempt
     )
     async def generate_manual_from_video(
         self, 
         video_path: str, 
         title: str = "操作マニュアル",
-        language: str = "ja"
+        language: str = "ja",
+        on_steps: Optional[Callable[[List[Dict[str, str]]], Awaitable[None]]] = None
     ) -> Dict[str, Any]:
         """
         Generate a step-by-step manual from a video file with retry logic
         
         Args:
-            video_path: Path to the video file
+            video_path: Media path of the video (resolved through the storage backend)
             title: Title for the manual
             language: Language for the manual (default: ja for Japanese)
+            on_steps: Called with the steps completed so far while the response
+                streams in (only when streaming is enabled)
             
         Returns:
             Dictionary containing the generated manual content
@@ -92,36 +189,49 @@ class GeminiService:
             logger.info(f"Generating manual from video: {video_path}")
             
             # Check network connectivity first
-            await self._check_network_connectivity()
-            
-            # Validate video file
-            if not os.path.exists(video_path):
-                raise FileNotFoundError(f"Video file not found: {video_path}")
+            await self.check_network_connectivity()
             
-            # Check file size (Gemini has limits)
-            file_size = os.path.getsize(video_path)
-            max_size = 100 * 1024 * 1024  # 100MB
-            if file_size > max_size:
-                raise ValueError(f"Video file too large: {file_size} bytes (max: {max_size} bytes)")
+            # Send a low-bitrate proxy instead of the original when possible
+            source_key = key_for_path(video_path)
+            with span("prepare", attempt=current_attempt()):
+                upload_key = await self.prepare_upload_source(source_key)
+                
+                # Cut out idle segments; step times are mapped back to the original timeline below
+                upload_key, kept = await self.trim_idle(upload_key, source_key)
+            if kept and on_steps is not None:
+                report_steps = on_steps
+                
+                async def on_steps(steps: List[Dict[str, str]]) -> None:
+                    await report_steps(idle_trimming.remap_steps(steps, kept))
             
-            # Upload video to Gemini
-            video_file = await self._upload_video_with_retry(video_path)
+            # Reuse the file already uploaded for this video, or upload it
+            video_file, source_id, registered = await self._acquire_video_file(upload_key)
             
             # Generate manual content
             prompt = self._create_manual_prompt(title, language)
             
-            # Generate content using the video
-            response = await self._generate_content_with_video_retry(video_file, prompt)
+            try:
+                # Generate content using the video
+                try:
+                    response = await self._generate_content(video_file, prompt, on_steps)
+                except (google_exceptions.NotFound, google_exceptions.PermissionDenied) as e:
+                    if not registered:
+                        raise
+                    # The registered file disappeared on the Gemini side: forget it and upload again
+                    logger.warning(f"Gemini rejected file {video_file.name}, uploading again: {e}")
+                    await asyncio.to_thread(gemini_files.invalidate, source_id, video_file.name)
+                    video_file, source_id, registered = await self._acquire_video_file(upload_key)
+                    response = await self._generate_content(video_file, prompt, on_steps)
+            finally:
+                # Files kept in the registry are reused by later calls and cleaned up in the background
+                if not registered:
+                    await self._delete_video_file(video_file)
             
             # Parse and structure the response
-            manual_content = self._parse_manual_response(response, title)
-            
-            # Clean up uploaded file
-            try:
-                genai.delete_file(video_file.name)
-                logger.info(f"Cleaned up uploaded video file: {video_file.name}")
-            except Exception as cleanup_error:
-                logger.warning(f"Failed to cleanup uploaded file: {cleanup_error}")
+            with span("parse"):
+                manual_content = self.parse_manual_response(response, title)
+                if kept:
+                    manual_content["steps"] = idle_trimming.remap_steps(manual_content["steps"], kept)
             
             logger.info("Manual generation completed successfully")
             return manual_content
@@ -136,10 +246,184 @@ class GeminiService:
             else:
                 raise
 
+    async def generate_manual_from_keyframes(
+        self,
+        video_path: str,
+        title: str = "操作マニュアル",
+        language: str = "ja",
+        on_steps: Optional[Callable[[List[Dict[str, str]]], Awaitable[None]]] = None
+    ) -> Dict[str, Any]:
+        """
+        Generate a manual from the distinct frames of a video instead of the video itself
+        
+        The frames are sent inline in one request, each preceded by its
+        timestamp, so nothing is uploaded to the Files API and there is no
+        PROCESSING wait.
+        
+        Args:
+            video_path: Media path of the video (resolved through the storage backend)
+            title: Title for the manual
+            language: Language for the manual (default: ja for Japanese)
+            on_steps: Called with the steps completed so far while the response
+                streams in (only when streaming is enabled)
+        """
+        logger.info(f"Generating manual from keyframes of video: {video_path}")
+        await self.check_network_connectivity()
+        
+        with span("prepare"):
+            async with storage.local_path(key_for_path(video_path)) as local_video_path:
+                frames = await sample_frames(local_video_path)
+        if not frames:
+            raise ValueError("No frames could be extracted from the video")
+        logger.info(
+            f"Sending {len(frames)} frames ({sum(len(frame.data) for frame in frames) / 1024:.0f}KB, "
+            f"~{estimate_frame_tokens(frames)} tokens) instead of the video"
+        )
+        
+        parts: List[Any] = []
+        for frame in frames:
+            parts.append(f"[{format_timecode(frame.seconds)}]")
+            parts.append({"mime_type": "image/jpeg", "data": frame.data})
+        
+        response = await self._generate_content(
+            parts, self._create_keyframe_prompt(title, language), on_steps, image_tokens=estimate_frame_tokens(frames)
+        )
+        with span("parse"):
+            manual_content = self.parse_manual_response(response, title)
+        logger.info("Manual generation from keyframes completed successfully")
+        return manual_content
+
+    def cache_identity(self, title: str, language: str) -> Dict[str, Any]:
+        """Everything besides the video that determines a generation result"""
+        identity = {
+            "model": self.model_name,
+            "generation_config": self.generation_config,
+            "prompt_version": PROMPT_VERSION,
+            "prompt": self._create_manual_prompt(title, language),
+            "language": language,
+            "proxy": [settings.gemini_use_video_proxy, settings.gemini_proxy_max_height,
+                      settings.gemini_proxy_fps, settings.gemini_proxy_crf, settings.gemini_proxy_keep_audio],
+        }
+        if settings.idle_trimming_enabled:
+            identity["idle_trimming"] = idle_trimming.identity()
+        if settings.gemini_generation_mode == "keyframes":
+            identity["prompt"] = self._create_keyframe_prompt(title, language)
+            identity["keyframes"] = [settings.gemini_keyframe_scene_threshold,
+                                     settings.gemini_keyframe_min_interval_seconds, settings.gemini_keyframe_max_frames]
+        return identity
+
+    def estimate_video_tokens(self, duration: float) -> int:
+        """Rough prompt token count of a video of `duration` seconds (before the text prompt)"""
+        per_second = VIDEO_TOKENS_PER_SECOND
+        if settings.gemini_proxy_keep_audio or not settings.gemini_use_video_proxy:
+            per_second += AUDIO_TOKENS_PER_SECOND
+        return int(duration * per_second)
+
+    async def prepare_upload_source(self, video_key: str) -> str:
+        """Return the storage key of the video to upload (the Gemini proxy if enabled)"""
+        if not settings.gemini_use_video_proxy:
+            return video_key
+        try:
+            async with storage.local_path(video_key) as local_video_path:
+                return await ensure_gemini_proxy(video_key, local_video_path)
+        except FFmpegError as e:
+            logger.warning(f"Proxy transcoding failed, uploading original video: {e}")
+            return video_key
+
+    async def trim_idle(self, upload_key: str, source_key: str) -> Tuple[str, Optional[List[Tuple[float, float]]]]:
+        """Return the storage key to upload and the kept segments if idle segments were cut out"""
+        if not settings.idle_trimming_enabled:
+            return upload_key, None
+        try:
+            return await idle_trimming.ensure_trimmed(upload_key, source_key)
+        except FFmpegError as e:
+            logger.warning(f"Idle trimming failed, uploading untrimmed video: {e}")
+            return upload_key, None
+
+    async def _acquire_video_file(self, upload_key: str) -> Tuple[Any, Optional[str], bool]:
+        """
+        Return (Gemini file, registry id, registered) for a stored video, reusing
+        a live upload of the same video when the registry has one
+        """
+        source_id = gemini_files.source_id_for_key(upload_key)
+        if settings.gemini_file_reuse_enabled and source_id:
+            video_file = await gemini_files.reuse(source_id)
+            if video_file is not None:
+                return video_file, source_id, True
+        
+        # Fetch the video through the storage backend (local disk or S3)
+        async with storage.local_path(upload_key) as local_video_path:
+            # Check file size (Gemini has limits)
+            file_size = os.path.getsize(local_video_path)
+            max_size = 100 * 1024 * 1024  # 100MB
+            if file_size > max_size:
+                raise ValueError(f"Video file too large: {file_size} bytes (max: {max_size} bytes)")
+            
+            if not settings.gemini_file_reuse_enabled:
+                return await self._upload_video_with_retry(local_video_path), None, False
+            
+            if source_id is None:
+                # Legacy paths are not content-addressed, so identify the video by its hash
+                source_id = await asyncio.to_thread(hash_file, local_video_path)
+                video_file = await gemini_files.reuse(source_id)
+                if video_file is not None:
+                    return video_file, source_id, True
+            
+            # Upload video to Gemini
+            video_file = await self._upload_video_with_retry(local_video_path)
+        
+        registered = await asyncio.to_thread(gemini_files.register, source_id, video_file)
+        return video_file, source_id, registered
+
+    async def generate_segment_response(self, local_path: str, source_id: str, title: str, language: str) -> str:
+        """
+        Generate the raw manual response for one segment of a long video
+        
+        Args:
+            local_path: Local file of the segment
+            source_id: Stable id of the segment for the Gemini file registry
+            title: Title for the manual
+            language: Language for the manual
+        """
+        video_file = await gemini_files.reuse(source_id) if settings.gemini_file_reuse_enabled else None
+        registered = video_file is not None
+        if video_file is None:
+            video_file = await self._upload_video_with_retry(local_path)
+            registered = (
+                settings.gemini_file_reuse_enabled
+                and await asyncio.to_thread(gemini_files.register, source_id, video_file)
+            )
+        
+        prompt = self._create_manual_prompt(title, language)
+        try:
+            try:
+                return await self._generate_content_with_video_retry(video_file, prompt)
+            except (google_exceptions.NotFound, google_exceptions.PermissionDenied) as e:
+                if not registered:
+                    raise
+                logger.warning(f"Gemini rejected file {video_file.name}, uploading again: {e}")
+                await asyncio.to_thread(gemini_files.invalidate, source_id, video_file.name)
+                video_file = await self._upload_video_with_retry(local_path)
+                registered = await asyncio.to_thread(gemini_files.register, source_id, video_file)
+                return await self._generate_content_with_video_retry(video_file, prompt)
+        finally:
+            if not registered:
+                await self._delete_video_file(video_file)
+
+    async def _delete_video_file(self, video_file: Any) -> None:
+        with span("cleanup"):
+            try:
+                async with gemini_rate_limiter.limit():
+                    await asyncio.to_thread(genai.delete_file, video_file.name)
+                logger.info(f"Cleaned up uploaded video file: {video_file.name}")
+            except Exception as cleanup_error:
+                logger.warning(f"Failed to cleanup uploaded file: {cleanup_error}")
+
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=2, max=8),
-        retry=retry_if_exception_type((google_exceptions.ServiceUnavailable, google_exceptions.TooManyRequests, ConnectionError))
+        retry=retry_if_exception_type((google_exceptions.ServiceUnavailable, google_exceptions.TooManyRequests, ConnectionError)),
+        before=note_attempt
     )
     async def _upload_video_with_retry(self, video_path: str) -> Any:
         """Upload video file to Gemini with retry logic"""
@@ -156,27 +440,18 @@ class GeminiService:
             logger.info(f"Uploading video with MIME type: {mime_type}")
             
             # Upload the video file
-            video_file = await asyncio.to_thread(
-                genai.upload_file,
-                path=video_path,
-                mime_type=mime_type
-            )
-            
-            # Wait for the file to be processed with timeout
-            max_wait_time = 300  # 5 minutes
-            wait_time = 0
-            
-            while video_file.state.name == "PROCESSING" and wait_time < max_wait_time:
-                await asyncio.sleep(5)
-                wait_time += 5
-                video_file = await asyncio.to_thread(genai.get_file, video_file.name)
-                logger.info(f"Video processing status: {video_file.state.name} (waited {wait_time}s)")
-                
-            if video_file.state.name == "FAILED":
-                raise ValueError(f"Video processing failed: {video_file.state}")
-                
-            if video_file.state.name == "PROCESSING":
-                raise TimeoutError(f"Video processing timeout after {max_wait_time} seconds")
+            async with gemini_rate_limiter.limit():
+                with span("upload", attempt=current_attempt(), request_bytes=os.path.getsize(video_path)):
+                    video_file = await asyncio.to_thread(
+                        genai.upload_file,
+                        path=video_path,
+                        mime_type=mime_type
+                    )
+            
+            # Wait for Gemini to process the file (status checks are batched across uploads)
+            size_bytes = os.path.getsize(video_path)
+            with span("processing_wait", attempt=current_attempt(), request_bytes=size_bytes):
+                video_file = await file_watcher.wait_active(video_file, size_bytes, timeout=300)
                 
             logger.info(f"Video uploaded and processed successfully: {video_file.name}")
             return video_file
@@ -259,23 +534,51 @@ Important instructions:
 - Provide clear instructions for actual operations, not just descriptions
 - Record all operations shown in the video in the correct sequence
 - Do not include overview, prerequisites, troubleshooting, or additional information
+"""
+
+    def _create_keyframe_prompt(self, title: str, language: str) -> str:
+        """Create prompt for manual generation from timestamped frames"""
+        manual_prompt = self._create_manual_prompt(title, language)
+        if language == "ja":
+            return f"""
+上の画像は、画面操作の録画から画面が変化した時点だけを抜き出したものです。
+各画像の直前の [m:ss] は、その画像が録画のどの時点かを表します。
+画像を順番に比較し、画面の変化からユーザーが行った操作を読み取ってください。
+{manual_prompt}
+- 「動画」は上の画像の並びのことです。時間には、その操作の結果が最初に現れた画像の直前の [m:ss] をそのまま記入してください
+- 画像にない時刻を推測して記入しないでください
+"""
+        else:
+            return f"""
+The images above are the frames of a screen recording at which the screen changed.
+The [m:ss] label before each image is its position in the recording.
+Compare the images in order and infer the operations from how the screen changes.
+{manual_prompt}
+- "This video" means the sequence of images above. When a step has a time, copy the [m:ss] label of the first image that shows the result of the operation
+- Do not invent times that are not among the labels
 """
 
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=4, max=10),
-        retry=retry_if_exception_type((google_exceptions.ServiceUnavailable, google_exceptions.TooManyRequests, ConnectionError))
+        retry=retry_if_exception_type((google_exceptions.ServiceUnavailable, google_exceptions.TooManyRequests, ConnectionError)),
+        before=note_attempt
     )
-    async def _generate_content_with_video_retry(self, video_file: Any, prompt: str) -> str:
+    async def _generate_content_with_video_retry(self, video_file: Any, prompt: str, image_tokens: int = 0) -> str:
         """Generate content using video and prompt with retry logic"""
         try:
             logger.info("Generating content with Gemini API")
             
             # Generate content with video
-            response = await asyncio.to_thread(
-                self.model.generate_content,
-                [video_file, prompt]
-            )
+            async with gemini_rate_limiter.limit(tokens=self._estimate_tokens(video_file, prompt, image_tokens)) as reservation:
+                with span("generate", attempt=current_attempt(), request_bytes=self._inline_bytes(video_file)) as current:
+                    response = await asyncio.to_thread(
+                        self.model.generate_content,
+                        self._contents(video_file, prompt)
+                    )
+                    current.record_usage(response)
+                    current.response_bytes = len((response.text or "").encode())
+                reservation.used_tokens = current.total_tokens
             
             if not response.text:
                 raise ValueError("No response text generated from Gemini")
@@ -298,11 +601,135 @@ Important instructions:
             else:
                 raise
 
+    def _contents(self, media: Any, prompt: str) -> List[Any]:
+        # The keyframe mode sends a list of timestamp labels and images instead of one video file
+        if isinstance(media, list):
+            return [*media, prompt]
+        return [media, prompt]
+
+    def _inline_bytes(self, media: Any) -> Optional[int]:
+        # Uploaded videos are counted by the upload span
+        if not isinstance(media, list):
+            return None
+        return sum(len(part["data"]) for part in media if isinstance(part, dict))
+
+    def _estimate_tokens(self, media: Any, prompt: str, image_tokens: int = 0) -> int:
+        """
+        Tokens to reserve with the rate limiter for one generate call (settled with the actual usage)
+        
+        `image_tokens` is the token count of the inline images in `media`,
+        computed from the sampled frame sizes by the caller.
+        """
+        tokens = len(prompt) // CHARS_PER_TEXT_TOKEN + settings.gemini_rate_output_tokens_estimate
+        if isinstance(media, list):
+            text_parts = [part for part in media if isinstance(part, str)]
+            return tokens + image_tokens + sum(len(part) for part in text_parts) // CHARS_PER_TEXT_TOKEN
+        try:
+            duration = media.video_metadata.video_duration.total_seconds()
+        except AttributeError:
+            duration = 0  # 長さが分からない動画は応答後の精算に任せる
+        return tokens + self.estimate_video_tokens(duration)
+
+    async def _generate_content(
+        self,
+        video_file: Any,
+        prompt: str,
+        on_steps: Optional[Callable[[List[Dict[str, str]]], Awaitable[None]]],
+        image_tokens: int = 0
+    ) -> str:
+        if on_steps is not None and settings.gemini_streaming_enabled:
+            return await self._stream_content_with_video_retry(video_file, prompt, on_steps, image_tokens)
+        return await self._generate_content_with_video_retry(video_file, prompt, image_tokens)
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception_type((google_exceptions.ServiceUnavailable, google_exceptions.TooManyRequests, ConnectionError)),
+        before=note_attempt
+    )
+    async def _stream_content_with_video_retry(
+        self,
+        video_file: Any,
+        prompt: str,
+        on_steps: Callable[[List[Dict[str, str]]], Awaitable[None]],
+        image_tokens: int = 0
+    ) -> str:
+        """Generate content as a stream, reporting each step as soon as it is complete"""
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        # Set when the consumer gives up (cancelled or failed); the producer stops at the next chunk
+        stopped = threading.Event()
+        
+        def produce() -> None:
+            # The SDK iterator blocks, so it runs on a thread and hands chunks to the event loop
+            try:
+                response = self.model.generate_content(self._contents(video_file, prompt), stream=True)
+                for chunk in response:
+                    if stopped.is_set():
+                        return
+                    current.record_usage(chunk)
+                    if chunk.prompt_feedback and chunk.prompt_feedback.block_reason:
+                        raise ValueError(f"Content blocked by safety filters: {chunk.prompt_feedback.block_reason}")
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        continue  # chunk without text parts (e.g. only finish metadata)
+                    loop.call_soon_threadsafe(chunks.put_nowait, text)
+                loop.call_soon_threadsafe(chunks.put_nowait, None)
+            except Exception as e:
+                if not stopped.is_set():
+                    loop.call_soon_threadsafe(chunks.put_nowait, e)
+        
+        logger.info("Streaming content with Gemini API")
+        async with gemini_rate_limiter.limit(tokens=self._estimate_tokens(video_file, prompt, image_tokens)) as reservation:
+            with span("generate", attempt=current_attempt(), request_bytes=self._inline_bytes(video_file)) as current:
+                started = time.monotonic()
+                producer = asyncio.create_task(asyncio.to_thread(produce))
+                parser = StepStreamParser()
+                parts: List[str] = []
+                first_step_at = None
+                finished = False
+                try:
+                    while True:
+                        chunk = await chunks.get()
+                        if chunk is None:
+                            finished = True
+                            break
+                        if isinstance(chunk, Exception):
+                            finished = True
+                            if "DNS resolution failed" in str(chunk) or "ServiceUnavailable" in str(chunk):
+                                raise google_exceptions.ServiceUnavailable(f"Gemini API temporarily unavailable: {chunk}")
+                            raise chunk
+                        parts.append(chunk)
+                        if parser.feed(chunk):
+                            first_step_at = first_step_at or time.monotonic() - started
+                            await on_steps(list(parser.steps))
+                finally:
+                    # Only wait for a producer that has already finished; on cancellation the
+                    # thread is abandoned and returns when the SDK yields its next chunk
+                    stopped.set()
+                    if finished:
+                        await asyncio.gather(producer, return_exceptions=True)
+            
+                response = "".join(parts)
+                current.response_bytes = len(response.encode())
+                if not response:
+                    raise ValueError("No response text generated from Gemini")
+                if parser.finish():
+                    first_step_at = first_step_at or time.monotonic() - started
+                    await on_steps(list(parser.steps))
+            
+                total = time.monotonic() - started
+                if first_step_at is not None:
+                    logger.info(f"Streamed {len(parser.steps)} steps: first after {first_step_at:.1f}s of {total:.1f}s")
+            reservation.used_tokens = current.total_tokens
+            return response
+
     async def _generate_content_with_video(self, video_file: Any, prompt: str) -> str:
         """Legacy method - use _generate_content_with_video_retry instead"""
         return await self._generate_content_with_video_retry(video_file, prompt)
 
-    def _parse_manual_response(self, response: str, title: str) -> Dict[str, Any]:
+    def parse_manual_response(self, response: str, title: str) -> Dict[str, Any]:
         """Parse the manual response into structured format"""
         try:
             # Extract sections from the response
@@ -313,7 +740,7 @@ Important instructions:
                 "title": title,
                 "overview": sections.get("概要") or sections.get("Overview", ""),
                 "prerequisites": sections.get("前提条件") or sections.get("Prerequisites", ""),
-                "steps": self._extract_steps(response),
+                "steps": self.extract_steps(response),
                 "troubleshooting": sections.get("トラブルシューティング") or sections.get("Troubleshooting", ""),
                 "additional_info": sections.get("補足情報") or sections.get("Additional Information", ""),
                 "raw_content": response
@@ -360,48 +787,12 @@ Important instructions:
             
         return sections
 
-    def _extract_steps(self, content: str) -> List[Dict[str, str]]:
+    def extract_steps(self, content: str) -> List[Dict[str, str]]:
         """Extract step-by-step instructions from the content"""
-        steps = []
-        current_step = None
-        current_content = {}
-        
-        lines = content.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            
-            # Check if line is a step header
-            if line.startswith('### ステップ') or line.startswith('### Step'):
-                if current_step:
-                    steps.append(current_content)
-                current_step = line[4:].strip()
-                current_content = {
-                    "title": current_step,
-                    "action": "",
-                    "screen": "",
-                    "notes": "",
-                    "verification": "",
-                    "time": ""
-                }
-            elif current_step and line:
-                # Extract specific fields
-                if line.startswith('- **操作手順**:') or line.startswith('- **操作内容**:') or line.startswith('- **Action**:'):
-                    current_content["action"] = line.split(':', 1)[1].strip()
-                elif line.startswith('- **時間**:') or line.startswith('- **Time**:'):
-                    current_content["time"] = line.split(':', 1)[1].strip()
-                elif line.startswith('- **画面**:') or line.startswith('- **Screen**:'):
-                    current_content["screen"] = line.split(':', 1)[1].strip()
-                elif line.startswith('- **注意点**:') or line.startswith('- **Notes**:'):
-                    current_content["notes"] = line.split(':', 1)[1].strip()
-                elif line.startswith('- **確認事項**:') or line.startswith('- **Verification**:'):
-                    current_content["verification"] = line.split(':', 1)[1].strip()
-        
-        # Add the last step
-        if current_step:
-            steps.append(current_content)
-            
-        return steps
+        parser = StepStreamParser()
+        parser.feed(content)
+        parser.finish()
+        return parser.steps
 
     async def enhance_manual_content(self, manual_content: str, enhancement_type: str = "improve") -> str:
         """
@@ -442,10 +833,13 @@ Important instructions:
             else:
                 raise ValueError(f"Unknown enhancement type: {enhancement_type}")
             
-            response = await asyncio.to_thread(
-                self.model.generate_content,
-                prompt
-            )
+            async with gemini_rate_limiter.limit(tokens=self._estimate_tokens([], prompt)) as reservation:
+                response = await asyncio.to_thread(
+                    self.model.generate_content,
+                    prompt
+                )
+                usage = getattr(response, "usage_metadata", None)
+                reservation.used_tokens = getattr(usage, "total_token_count", None) or None
             
             return response.text
             
@@ -0,0 +1,174 @@
+"""
+Manual generation
+
+Generates a manual's content from its video with Gemini. Runs inside the
+generation workers (see services.generation_queue and worker.py), never in
+the API process. Database access is split into short transactions around
+the Gemini call so no pooled connection is held while it runs.
+
+Step thumbnails and keyframe alignment are post-processing: the worker
+finishes the job as soon as the content is saved and runs them afterwards
+(`postprocess_manual`), so they neither hold the job's scheduler slots nor
+make a failure there retry the Gemini generation.
+"""
+import json
+import asyncio
+import logging
+
+from config import settings
+from database import SessionLocal
+from models import GenerationJob, Manual
+from services import media_store, generation_cache
+from services.chunked_generation import chunking_identity, generate_chunked, should_chunk
+from services.gemini_service import gemini_service
+from services.generation_runs import start_run
+from services.keyframes import align_keyframes
+from services.media_probe import InvalidMediaError, stored_probe, validate_probe
+from services.status_events import notify_manual
+from services.storage import storage, key_for_path
+from services.thumbnails import generate_step_thumbnails, video_content_hash
+
+logger = logging.getLogger(__name__)
+
+
+class PermanentGenerationError(Exception):
+    """Generation cannot succeed by retrying (missing or invalid video)"""
+
+
+def _load_source(manual_id: str):
+    db = SessionLocal()
+    try:
+        manual = db.query(Manual).filter(Manual.id == manual_id).first()
+        if not manual:
+            return None
+        if not manual.video_file_path:
+            raise PermanentGenerationError("No video file associated with this manual")
+
+        # アップロード時に保存した解析結果で検証し、使えない動画はGeminiへ送る前に失敗させる
+        blob = media_store.get_blob(db, manual.video_file_path)
+        duration = blob.duration if blob is not None else None
+        probe = stored_probe(blob)
+        if probe is not None:
+            try:
+                validate_probe(probe, "video")
+            except InvalidMediaError as e:
+                raise PermanentGenerationError(f"Invalid video: {e}")
+            logger.info(
+                f"Manual {manual_id}: {blob.duration:.1f}s video, "
+                f"estimated {gemini_service.estimate_video_tokens(blob.duration)} prompt tokens"
+            )
+        return (manual.video_file_path, manual.title or "操作マニュアル",
+                video_content_hash(db, manual.video_file_path), duration)
+    finally:
+        db.close()
+
+
+def _save_partial_steps(manual_id: str, steps: list) -> None:
+    # 完成済みのマニュアルは上書きせず、実行中のジョブに途中経過として保存する
+    db = SessionLocal()
+    try:
+        db.query(GenerationJob).filter(
+            GenerationJob.manual_id == manual_id,
+            GenerationJob.status == "running"
+        ).update({GenerationJob.partial_steps: json.dumps(steps, ensure_ascii=False)}, synchronize_session=False)
+        notify_manual(db, manual_id)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _save_content(manual_id: str, content: dict) -> bool:
+    db = SessionLocal()
+    try:
+        manual = db.query(Manual).filter(Manual.id == manual_id).first()
+        if not manual:
+            return False
+        manual.content = json.dumps(content)
+        manual.status = "completed"
+        notify_manual(db, manual_id)
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+async def generate_manual(manual_id: str) -> bool:
+    """
+    Generate and store a manual's content; raises on failure so the job can be retried
+
+    Returns False if the manual no longer exists.
+    """
+    source = await asyncio.to_thread(_load_source, manual_id)
+    if source is None:
+        logger.warning(f"Manual {manual_id} no longer exists, skipping generation")
+        return False
+    video_path, title, video_hash, duration = source
+    language = "ja"
+    chunked = settings.gemini_generation_mode != "keyframes" and should_chunk(duration)
+
+    if not await storage.exists(key_for_path(video_path)):
+        raise PermanentGenerationError(f"Video file not found: {video_path}")
+
+    # 同じ動画・プロンプト・モデルで生成済みなら Gemini を呼ばない
+    key = None
+    generated_content = None
+    if settings.generation_cache_enabled and video_hash:
+        identity = gemini_service.cache_identity(title, language)
+        if chunked:
+            identity["chunking"] = chunking_identity()
+        key = generation_cache.cache_key(video_hash, identity)
+        generated_content = await asyncio.to_thread(generation_cache.lookup, key)
+        if generated_content is not None:
+            logger.info(f"Manual {manual_id}: generation cache hit")
+
+    if generated_content is None:
+        # Gemini の呼び出し中はDB接続を保持しない
+        logger.info(f"Starting manual generation for manual {manual_id}")
+        async def on_steps(steps: list) -> None:
+            await asyncio.to_thread(_save_partial_steps, manual_id, steps)
+
+        if settings.gemini_generation_mode == "keyframes":
+            mode = "keyframes"
+        else:
+            mode = "chunked" if chunked else "video"
+
+        # Gemini 呼び出しの段階ごとの所要時間を generation_runs に記録する
+        with start_run(manual_id=manual_id, mode=mode):
+            if mode == "keyframes":
+                # 画面が変化したフレームだけを送る（動画のアップロードがないので分割もしない）
+                generated_content = await gemini_service.generate_manual_from_keyframes(
+                    video_path=video_path,
+                    title=title,
+                    language=language,
+                    on_steps=on_steps
+                )
+            elif mode == "chunked":
+                # 長い動画は区間ごとに並列で生成して手順をつなぐ
+                generated_content = await generate_chunked(video_path, title, language, duration, on_steps=on_steps)
+            else:
+                generated_content = await gemini_service.generate_manual_from_video(
+                    video_path=video_path,
+                    title=title,
+                    language=language,
+                    on_steps=on_steps
+                )
+        if key:
+            await asyncio.to_thread(generation_cache.store, key, video_hash, identity, generated_content)
+
+    if not await asyncio.to_thread(_save_content, manual_id, generated_content):
+        return False
+    logger.info(f"Manual generation completed for manual {manual_id}")
+    return True
+
+
+async def postprocess_manual(manual_id: str) -> None:
+    """Build step thumbnails and the keyframe-aligned video of a generated manual (failures are only logged)"""
+    try:
+        await generate_step_thumbnails(manual_id)
+    except Exception as e:
+        logger.error(f"Step thumbnails failed for manual {manual_id}: {e}")
+    if settings.keyframe_alignment_enabled:
+        try:
+            await align_keyframes(manual_id)
+        except Exception as e:
+            logger.error(f"Keyframe alignment failed for manual {manual_id}: {e}")
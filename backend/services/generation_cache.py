@@ -0,0 +1,144 @@
+"""
+Generation result cache
+
+Regenerating a manual from the same video with an unchanged prompt, model,
+generation config and language returns the stored result instead of
+uploading the video to Gemini again. Entries live in the database so every
+worker shares them; the key is a sha256 over the video's content hash and
+`gemini_service.cache_identity()` (model, generation config, prompt
+template version and the rendered prompt, language, proxy settings).
+
+Each entry keeps the raw Gemini response and the parsed manual content. The
+cache is bounded by `generation_cache_max_bytes` / `generation_cache_max_entries`
+and evicts least recently used entries first. Hit, miss and eviction
+counts are kept in `generation_cache_counters`.
+"""
+import json
+import hashlib
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import GenerationCacheEntry, GenerationCacheCounter
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ("hits", "misses", "evictions")
+
+
+def cache_key(video_hash: str, identity: Dict[str, Any]) -> str:
+    payload = json.dumps({"video": video_hash, **identity}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _count(db: Session, name: str, amount: int = 1) -> None:
+    updated = db.query(GenerationCacheCounter).filter(GenerationCacheCounter.name == name).update(
+        {GenerationCacheCounter.value: GenerationCacheCounter.value + amount}, synchronize_session=False
+    )
+    if updated:
+        return
+    # マイグレーションを通さずに作成したDBではカウンター行がない
+    try:
+        with db.begin_nested():
+            db.add(GenerationCacheCounter(name=name, value=amount))
+    except IntegrityError:
+        _count(db, name, amount)
+
+
+def lookup(key: str) -> Optional[Dict[str, Any]]:
+    """Cached manual content for a key (recording the hit or miss), or None"""
+    db = SessionLocal()
+    try:
+        entry = db.query(GenerationCacheEntry).filter(GenerationCacheEntry.cache_key == key).first()
+        if entry is None:
+            _count(db, "misses")
+            db.commit()
+            return None
+        entry.hit_count += 1
+        entry.last_used_at = datetime.utcnow()
+        _count(db, "hits")
+        db.commit()
+        return json.loads(entry.manual_content)
+    finally:
+        db.close()
+
+
+def _evict(db: Session) -> int:
+    entries, size = db.query(
+        func.count(GenerationCacheEntry.cache_key), func.coalesce(func.sum(GenerationCacheEntry.size_bytes), 0)
+    ).one()
+    excess_entries = entries - settings.generation_cache_max_entries
+    excess_bytes = size - settings.generation_cache_max_bytes
+    if excess_entries <= 0 and excess_bytes <= 0:
+        return 0
+
+    victims = []
+    oldest = db.query(GenerationCacheEntry.cache_key, GenerationCacheEntry.size_bytes).order_by(
+        GenerationCacheEntry.last_used_at
+    ).all()
+    for key, entry_size in oldest:
+        if excess_entries <= 0 and excess_bytes <= 0:
+            break
+        victims.append(key)
+        excess_entries -= 1
+        excess_bytes -= entry_size
+    db.query(GenerationCacheEntry).filter(GenerationCacheEntry.cache_key.in_(victims)).delete(synchronize_session=False)
+    _count(db, "evictions", len(victims))
+    return len(victims)
+
+
+def store(key: str, video_hash: str, identity: Dict[str, Any], manual_content: Dict[str, Any]) -> None:
+    """Cache a generation result, then evict least recently used entries over the bounds"""
+    raw_response = manual_content.get("raw_content") or ""
+    content = json.dumps(manual_content, ensure_ascii=False)
+    size = len(raw_response.encode("utf-8")) + len(content.encode("utf-8"))
+    if size > settings.generation_cache_max_bytes:
+        return
+
+    db = SessionLocal()
+    try:
+        entry = db.get(GenerationCacheEntry, key) or GenerationCacheEntry(cache_key=key)
+        entry.video_hash = video_hash
+        entry.model = identity["model"]
+        entry.language = identity["language"]
+        entry.prompt_version = identity["prompt_version"]
+        entry.raw_response = raw_response
+        entry.manual_content = content
+        entry.size_bytes = size
+        entry.hit_count = entry.hit_count or 0
+        entry.last_used_at = datetime.utcnow()
+        db.add(entry)
+        db.flush()
+        evicted = _evict(db)
+        db.commit()
+        if evicted:
+            logger.info(f"Evicted {evicted} generation cache entries")
+    except IntegrityError:
+        # 別のワーカーが同じ結果を同時に保存した
+        db.rollback()
+    finally:
+        db.close()
+
+
+def cache_stats(db: Session) -> Dict[str, Any]:
+    entries, size = db.query(
+        func.count(GenerationCacheEntry.cache_key), func.coalesce(func.sum(GenerationCacheEntry.size_bytes), 0)
+    ).one()
+    counters = {name: 0 for name in COUNTERS}
+    counters.update({c.name: c.value for c in db.query(GenerationCacheCounter).all()})
+    lookups = counters["hits"] + counters["misses"]
+    return {
+        "enabled": settings.generation_cache_enabled,
+        "entries": entries,
+        "size_bytes": int(size),
+        "max_bytes": settings.generation_cache_max_bytes,
+        "max_entries": settings.generation_cache_max_entries,
+        **counters,
+        "hit_ratio": round(counters["hits"] / lookups, 4) if lookups else None,
+    }
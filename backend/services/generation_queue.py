@@ -0,0 +1,322 @@
+"""
+Durable generation job queue
+
+`POST /api/manuals/{id}/generate` only inserts a row into `generation_jobs`;
+standalone worker processes (worker.py) run the jobs, so throughput scales
+by starting more workers and an API restart loses nothing.
+
+- Claiming: the scheduler (services.generation_scheduler) picks the next
+  job allowed to start under the global and per-user caps, in priority and
+  fair-queuing order, with `SELECT ... FOR UPDATE SKIP LOCKED`; it is
+  marked running with a lease (`locked_until`) in the same short
+  transaction.
+- Heartbeat: while a job runs the worker extends its lease every third of
+  the visibility timeout. No database connection is held in between.
+- Reaper: running jobs whose lease expired (crashed or killed worker) are
+  re-queued, or failed once `max_attempts` is reached. Manuals left in
+  "processing" without an active job (e.g. by a restart before this queue
+  existed) are failed as well.
+- Failures are retried with exponential backoff unless they are permanent.
+- The job is finished as soon as the content is saved; post-processing
+  (thumbnails, keyframe alignment) then runs as a separate task of the
+  worker, outside the scheduler's slots.
+"""
+import os
+import uuid
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import GenerationJob, Manual
+from services.generation import PermanentGenerationError, generate_manual, postprocess_manual
+from services.generation_scheduler import assign_tags, default_priority, job_cost, lock_scheduler, next_job
+from services.status_events import notify_manual
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+# 完了したジョブの後処理（ワーカー停止時に取り消す）
+_postprocessing: set = set()
+
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _lease_until() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=settings.generation_job_visibility_timeout_seconds)
+
+
+def active_job(db: Session, manual_id: str) -> Optional[GenerationJob]:
+    return db.query(GenerationJob).filter(
+        GenerationJob.manual_id == manual_id,
+        GenerationJob.status.in_(ACTIVE_STATUSES)
+    ).order_by(GenerationJob.created_at.desc()).first()
+
+
+def enqueue_generation(
+    db: Session,
+    manual: Manual,
+    user_id: Optional[str] = None,
+    priority: Optional[int] = None
+) -> GenerationJob:
+    """Queue a generation job for a manual (returns the active job if one exists)"""
+    job = active_job(db, manual.id)
+    if job:
+        return job
+    manual_id = manual.id
+    job = GenerationJob(
+        manual_id=manual.id,
+        user_id=user_id,
+        priority=default_priority(db, manual, user_id) if priority is None else priority,
+        cost=job_cost(db, manual),
+        status=QUEUED,
+        max_attempts=settings.generation_job_max_attempts,
+        available_at=datetime.utcnow()
+    )
+    assign_tags(db, job)
+    db.add(job)
+    manual.status = "processing"
+    notify_manual(db, manual.id)
+    try:
+        db.commit()
+    except IntegrityError:
+        # 同時の依頼が先にジョブを作成した（uq_generation_jobs_active_manual）
+        db.rollback()
+        job = active_job(db, manual_id)
+        if job is None:
+            raise
+        return job
+    db.refresh(job)
+    return job
+
+
+def claim_next(db: Session, worker_id: str) -> Optional[GenerationJob]:
+    """Claim the next job the scheduler allows to start, skipping rows locked by other workers"""
+    now = datetime.utcnow()
+    lock_scheduler(db)
+    job = next_job(db, now)
+    if job is None:
+        db.rollback()
+        return None
+    job.status = RUNNING
+    job.attempts += 1
+    job.locked_by = worker_id
+    job.locked_until = _lease_until()
+    job.started_at = now
+    job.error = None
+    job.partial_steps = None
+    notify_manual(db, job.manual_id)
+    db.commit()
+    return job
+
+
+def _owned(db: Session, job_id: str, worker_id: str):
+    return db.query(GenerationJob).filter(
+        GenerationJob.id == job_id,
+        GenerationJob.status == RUNNING,
+        GenerationJob.locked_by == worker_id
+    )
+
+
+def extend_lease(job_id: str, worker_id: str) -> bool:
+    """Heartbeat: push the lease forward; False if the job was reaped meanwhile"""
+    db = SessionLocal()
+    try:
+        updated = _owned(db, job_id, worker_id).update(
+            {GenerationJob.locked_until: _lease_until()}, synchronize_session=False
+        )
+        db.commit()
+        return bool(updated)
+    finally:
+        db.close()
+
+
+def _mark_manual_failed(db: Session, manual_id: str) -> None:
+    db.query(Manual).filter(Manual.id == manual_id).update(
+        {Manual.status: "failed"}, synchronize_session=False
+    )
+
+
+def _retry_or_fail(db: Session, job: GenerationJob, error: str, permanent: bool = False) -> None:
+    """Re-queue a job with backoff, or fail it (and its manual) when out of attempts (caller commits)"""
+    job.error = error[:2000]
+    job.locked_by = None
+    job.locked_until = None
+    if permanent or job.attempts >= job.max_attempts:
+        job.status = FAILED
+        job.finished_at = datetime.utcnow()
+        _mark_manual_failed(db, job.manual_id)
+    else:
+        delay = settings.generation_job_retry_delay_seconds * 2 ** (job.attempts - 1)
+        job.status = QUEUED
+        job.available_at = datetime.utcnow() + timedelta(seconds=delay)
+
+
+def finish_job(job_id: str, worker_id: str, error: Optional[str] = None, permanent: bool = False) -> None:
+    """Record the outcome of a job this worker still owns"""
+    db = SessionLocal()
+    try:
+        job = _owned(db, job_id, worker_id).first()
+        if job is None:
+            logger.warning(f"Generation job {job_id} was reclaimed before it finished")
+            return
+        if error is None:
+            job.status = COMPLETED
+            job.finished_at = datetime.utcnow()
+            job.partial_steps = None
+            job.locked_by = None
+            job.locked_until = None
+        else:
+            _retry_or_fail(db, job, error, permanent)
+        notify_manual(db, job.manual_id)
+        db.commit()
+    finally:
+        db.close()
+
+
+def release_job(job_id: str, worker_id: str) -> None:
+    """Hand an interrupted job back to the queue without counting the attempt"""
+    db = SessionLocal()
+    try:
+        job = _owned(db, job_id, worker_id).first()
+        if job is None:
+            return
+        job.status = QUEUED
+        job.attempts -= 1
+        job.locked_by = None
+        job.locked_until = None
+        job.available_at = datetime.utcnow()
+        notify_manual(db, job.manual_id)
+        db.commit()
+    finally:
+        db.close()
+
+
+def reap_stuck_jobs(db: Session) -> int:
+    """Re-queue or fail running jobs whose lease expired; fail manuals stuck without a job"""
+    now = datetime.utcnow()
+    jobs = db.query(GenerationJob).filter(
+        GenerationJob.status == RUNNING,
+        GenerationJob.locked_until < now
+    ).with_for_update(skip_locked=True).all()
+    for job in jobs:
+        logger.warning(f"Reaping generation job {job.id} (worker {job.locked_by} stopped heartbeating)")
+        _retry_or_fail(db, job, f"Worker {job.locked_by} stopped responding")
+        notify_manual(db, job.manual_id)
+
+    # ジョブのない「処理中」のマニュアル（キュー導入前の再起動などで残ったもの）
+    stale_before = now - timedelta(seconds=settings.generation_job_visibility_timeout_seconds)
+    has_active_job = db.query(GenerationJob.id).filter(
+        GenerationJob.manual_id == Manual.id,
+        GenerationJob.status.in_(ACTIVE_STATUSES)
+    ).exists()
+    orphaned = db.query(Manual).filter(
+        Manual.status == "processing",
+        Manual.updated_at < stale_before,
+        ~has_active_job
+    ).update({Manual.status: "failed"}, synchronize_session=False)
+    db.commit()
+    return len(jobs) + orphaned
+
+
+async def _heartbeat(job_id: str, worker_id: str) -> None:
+    interval = settings.generation_job_visibility_timeout_seconds / 3
+    while True:
+        await asyncio.sleep(interval)
+        if not await asyncio.to_thread(extend_lease, job_id, worker_id):
+            logger.warning(f"Lost the lease on generation job {job_id}")
+            return
+
+
+async def run_job(job_id: str, manual_id: str, worker_id: str) -> None:
+    heartbeat = asyncio.create_task(_heartbeat(job_id, worker_id))
+    try:
+        saved = await generate_manual(manual_id)
+    except asyncio.CancelledError:
+        # ワーカー停止時は他のワーカーがすぐに再実行できるようキューに戻す
+        await asyncio.to_thread(release_job, job_id, worker_id)
+        raise
+    except PermanentGenerationError as e:
+        logger.error(f"Generation job {job_id} failed permanently: {e}")
+        await asyncio.to_thread(finish_job, job_id, worker_id, str(e), permanent=True)
+    except Exception as e:
+        logger.error(f"Generation job {job_id} failed (manual {manual_id}): {e}")
+        await asyncio.to_thread(finish_job, job_id, worker_id, f"{type(e).__name__}: {e}")
+    else:
+        await asyncio.to_thread(finish_job, job_id, worker_id)
+        if saved:
+            # 後処理の失敗や停止で保存済みの生成をやり直さないよう、ジョブとは切り離して実行する
+            task = asyncio.create_task(postprocess_manual(manual_id))
+            _postprocessing.add(task)
+            task.add_done_callback(_postprocessing.discard)
+    finally:
+        heartbeat.cancel()
+
+
+def _reap_and_claim(worker_id: str, slots: int, reap: bool) -> Tuple[int, List[Tuple[str, str, int]]]:
+    """Reap stuck jobs (when due) and claim up to `slots` jobs; returns (reaped, [(job id, manual id, attempt)])"""
+    db = SessionLocal()
+    try:
+        reaped = reap_stuck_jobs(db) if reap else 0
+        claimed = []
+        while len(claimed) < slots:
+            job = claim_next(db, worker_id)
+            if job is None:
+                break
+            claimed.append((job.id, job.manual_id, job.attempts))
+        return reaped, claimed
+    finally:
+        db.close()
+
+
+async def run_worker(worker_id: Optional[str] = None, concurrency: Optional[int] = None) -> None:
+    """Claim and run generation jobs until cancelled"""
+    worker_id = worker_id or new_worker_id()
+    concurrency = concurrency or settings.generation_worker_concurrency
+    running: set = set()
+    last_reap: Optional[datetime] = None
+    logger.info(f"Generation worker {worker_id} started (concurrency {concurrency})")
+
+    try:
+        while True:
+            claimed = 0
+            try:
+                # DBの処理はスレッドで行い、実行中のジョブ（ハートビートを含む）を止めない
+                reap = last_reap is None or datetime.utcnow() - last_reap >= timedelta(seconds=settings.generation_reaper_interval_seconds)
+                reaped, jobs = await asyncio.to_thread(_reap_and_claim, worker_id, concurrency - len(running), reap)
+                if reap:
+                    if reaped:
+                        logger.info(f"Reaped {reaped} stuck generation jobs")
+                    last_reap = datetime.utcnow()
+
+                for job_id, manual_id, attempt in jobs:
+                    logger.info(f"Worker {worker_id} claimed generation job {job_id} (attempt {attempt})")
+                    task = asyncio.create_task(run_job(job_id, manual_id, worker_id))
+                    running.add(task)
+                    task.add_done_callback(running.discard)
+                    claimed += 1
+            except Exception as e:
+                logger.error(f"Generation worker loop failed: {e}")
+
+            if len(running) >= concurrency:
+                await asyncio.wait(set(running), return_when=asyncio.FIRST_COMPLETED)
+            elif not claimed:
+                await asyncio.sleep(settings.generation_worker_poll_interval_seconds)
+    finally:
+        tasks = list(running) + list(_postprocessing)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
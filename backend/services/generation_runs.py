@@ -0,0 +1,274 @@
+"""
+Gemini call instrumentation
+
+GeminiService records a span for each phase of a generation: DNS check,
+prepare (proxy / trimming / frame sampling), upload, processing wait,
+generate, parse and cleanup, plus a `total` span per run. Spans carry byte
+counts, Gemini's token usage metadata, the retry attempt and the error
+class if the phase failed.
+
+- A run (`start_run`) groups the spans of one generation and tags them with
+  the manual and the generation mode; spans outside a run are still
+  recorded, without a run id.
+- The attempt number of a phase inside a tenacity-retried method comes from
+  the `before=note_attempt` hook of its `@retry`.
+- Spans are buffered in memory and inserted into `generation_runs` in
+  batches (when `generation_run_batch_size` spans are pending, and every
+  `generation_run_flush_seconds` from the flush loop), so instrumentation
+  never adds a database round trip to a Gemini call.
+- `phase_stats` aggregates p50/p95/p99 durations, error counts and token
+  usage per phase and model for `GET /api/manuals/health/generation-runs`.
+"""
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import GenerationRun
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+@dataclass
+class _Run:
+    run_id: str
+    manual_id: Optional[str]
+    mode: Optional[str]
+
+
+@dataclass
+class Span:
+    phase: str
+    attempt: int = 1
+    request_bytes: Optional[int] = None
+    response_bytes: Optional[int] = None
+    prompt_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    total_tokens: Optional[int] = None
+
+    def record_usage(self, response: Any) -> None:
+        """Copy Gemini's usage metadata (present on responses and on the last streamed chunk)"""
+        usage = getattr(response, "usage_metadata", None)
+        if not usage:
+            return
+        self.prompt_tokens = getattr(usage, "prompt_token_count", None) or self.prompt_tokens
+        self.output_tokens = getattr(usage, "candidates_token_count", None) or self.output_tokens
+        self.total_tokens = getattr(usage, "total_token_count", None) or self.total_tokens
+
+
+_current_run: ContextVar[Optional[_Run]] = ContextVar("generation_run", default=None)
+_attempt: ContextVar[int] = ContextVar("generation_attempt", default=1)
+
+
+def note_attempt(retry_state: Any) -> None:
+    """tenacity `before` hook: remember which attempt of a retried call is running"""
+    _attempt.set(retry_state.attempt_number)
+
+
+def current_attempt() -> int:
+    return _attempt.get()
+
+
+class RunRecorder:
+    def __init__(self):
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._flushing = False
+
+    def record(self, row: Dict[str, Any]) -> None:
+        with self._lock:
+            self._pending.append(row)
+            full = len(self._pending) >= settings.generation_run_batch_size and not self._flushing
+            if full:
+                self._flushing = True
+        if full:
+            try:
+                asyncio.get_running_loop().run_in_executor(None, self.flush)
+            except RuntimeError:
+                self.flush()
+
+    def flush(self) -> int:
+        """Insert pending spans; returns how many were written"""
+        with self._lock:
+            rows, self._pending = self._pending, []
+            self._flushing = True
+        try:
+            if not rows:
+                return 0
+            db = SessionLocal()
+            try:
+                db.execute(insert(GenerationRun), rows)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"Failed to write {len(rows)} generation run spans: {e}")
+                return 0
+            finally:
+                db.close()
+            return len(rows)
+        finally:
+            with self._lock:
+                self._flushing = False
+
+
+# Create global instance
+run_recorder = RunRecorder()
+
+
+@contextmanager
+def start_run(manual_id: Optional[str] = None, mode: Optional[str] = None) -> Iterator[_Run]:
+    """Group the spans recorded inside (in this task and the tasks it starts) into one run"""
+    run = _Run(run_id=str(uuid.uuid4()), manual_id=manual_id, mode=mode)
+    token = _current_run.set(run)
+    try:
+        with span("total"):
+            yield run
+    finally:
+        _current_run.reset(token)
+
+
+@contextmanager
+def span(phase: str, attempt: Optional[int] = None, request_bytes: Optional[int] = None) -> Iterator[Span]:
+    """Time a phase and record it (with the error class if it raises)"""
+    current = Span(phase=phase, attempt=attempt or 1, request_bytes=request_bytes)
+    started_at = datetime.utcnow()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration_ms = (time.perf_counter() - started) * 1000
+        if settings.generation_run_tracking_enabled:
+            run = _current_run.get()
+            run_recorder.record({
+                "id": str(uuid.uuid4()),
+                "run_id": run.run_id if run else None,
+                "manual_id": run.manual_id if run else None,
+                "model": settings.gemini_model,
+                "mode": run.mode if run else None,
+                "phase": phase,
+                "attempt": current.attempt,
+                "started_at": started_at,
+                "duration_ms": duration_ms,
+                "request_bytes": current.request_bytes,
+                "response_bytes": current.response_bytes,
+                "prompt_tokens": current.prompt_tokens,
+                "output_tokens": current.output_tokens,
+                "total_tokens": current.total_tokens,
+                "error": error,
+            })
+
+
+def _quantile(values: List[float], q: float) -> Optional[float]:
+    # percentile_cont と同じ線形補間
+    if not values:
+        return None
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def phase_stats(db: Session, hours: float = 24, model: Optional[str] = None) -> Dict[str, Any]:
+    """Duration percentiles, error counts and token usage per phase and model"""
+    since = datetime.utcnow() - timedelta(hours=hours)
+    filters = [GenerationRun.started_at >= since]
+    if model:
+        filters.append(GenerationRun.model == model)
+
+    totals = db.query(
+        GenerationRun.phase,
+        GenerationRun.model,
+        func.count(GenerationRun.id),
+        func.count(GenerationRun.error),
+        func.sum(func.coalesce(GenerationRun.attempt, 1) - 1),
+        func.avg(GenerationRun.duration_ms),
+        func.sum(GenerationRun.request_bytes),
+        func.sum(GenerationRun.prompt_tokens),
+        func.sum(GenerationRun.output_tokens),
+    ).filter(*filters).group_by(GenerationRun.phase, GenerationRun.model).all()
+
+    if db.get_bind().dialect.name == "postgresql":
+        quantile_rows = db.query(
+            GenerationRun.phase,
+            GenerationRun.model,
+            *(func.percentile_cont(q).within_group(GenerationRun.duration_ms) for q in QUANTILES)
+        ).filter(*filters).group_by(GenerationRun.phase, GenerationRun.model).all()
+        quantiles = {(row[0], row[1]): list(row[2:]) for row in quantile_rows}
+    else:
+        # SQLite には percentile_cont がないので所要時間を読み出して計算する
+        durations: Dict[tuple, List[float]] = {}
+        for phase, row_model, duration in db.query(
+            GenerationRun.phase, GenerationRun.model, GenerationRun.duration_ms
+        ).filter(*filters).yield_per(1000):
+            durations.setdefault((phase, row_model), []).append(duration)
+        quantiles = {
+            key: [_quantile(sorted(values), q) for q in QUANTILES] for key, values in durations.items()
+        }
+
+    phases = []
+    for phase, row_model, count, errors, retries, mean, request_bytes, prompt_tokens, output_tokens in totals:
+        p50, p95, p99 = quantiles.get((phase, row_model), [None] * len(QUANTILES))
+        phases.append({
+            "phase": phase,
+            "model": row_model,
+            "count": count,
+            "errors": errors,
+            "retries": int(retries or 0),
+            "mean_ms": round(mean, 1) if mean is not None else None,
+            "p50_ms": round(p50, 1) if p50 is not None else None,
+            "p95_ms": round(p95, 1) if p95 is not None else None,
+            "p99_ms": round(p99, 1) if p99 is not None else None,
+            "request_bytes": int(request_bytes or 0),
+            "prompt_tokens": int(prompt_tokens or 0),
+            "output_tokens": int(output_tokens or 0),
+        })
+    phases.sort(key=lambda item: (item["model"], -(item["p95_ms"] or 0)))
+    return {"hours": hours, "phases": phases}
+
+
+def delete_old_runs() -> int:
+    cutoff = datetime.utcnow() - timedelta(days=settings.generation_run_retention_days)
+    db = SessionLocal()
+    try:
+        deleted = db.query(GenerationRun).filter(GenerationRun.started_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+
+async def generation_run_flush_loop() -> None:
+    """Periodically write buffered spans and drop spans past the retention period"""
+    last_cleanup = 0.0
+    try:
+        while True:
+            await asyncio.sleep(settings.generation_run_flush_seconds)
+            try:
+                await asyncio.to_thread(run_recorder.flush)
+                if time.monotonic() - last_cleanup > 3600:
+                    last_cleanup = time.monotonic()
+                    deleted = await asyncio.to_thread(delete_old_runs)
+                    if deleted:
+                        logger.info(f"Deleted {deleted} generation run spans past retention")
+            except Exception as e:
+                logger.error(f"Generation run flush failed: {e}")
+    finally:
+        # 停止時に残りを書き込む
+        await asyncio.to_thread(run_recorder.flush)
@@ -0,0 +1,133 @@
+"""
+Generation scheduler
+
+Decides which queued generation job a worker may start next, so a single
+user queueing dozens of manuals cannot starve everyone else or push the
+whole deployment into Gemini's rate limits.
+
+- Global cap: at most `generation_max_concurrent_jobs` jobs run across all
+  workers. Claims are serialized with a transaction-scoped advisory lock on
+  PostgreSQL so concurrent workers cannot overshoot the cap.
+- Per-user cap: a user's jobs never occupy more than
+  `generation_max_jobs_per_user` of those slots.
+- Priority: interactive jobs (regenerations and the first few clicks) are
+  always dispatched before bulk jobs (a user's backlog beyond
+  `generation_bulk_threshold` active jobs, or explicitly requested).
+- Fairness: within a priority, jobs are ordered by start-time fair queuing.
+  Each user's jobs of one priority form a flow; a job's start tag is
+  max(system virtual time, the finish tag of the flow's previous job), and
+  its finish tag adds the job's cost (video minutes) divided by the
+  priority's weight, so a user's bulk backlog never delays their own
+  interactive regenerations. Dispatching by smallest start tag interleaves
+  users in proportion to the work they submit, so 30 queued manuals from
+  one user wait behind other users' first manual instead of in front of it.
+"""
+import math
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import and_, func, or_, text
+from sqlalchemy.orm import Session
+
+from config import settings
+from models import GenerationJob, Manual
+from services import media_store
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITIES = {"interactive": INTERACTIVE, "bulk": BULK}
+PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+
+# pg_advisory_xact_lock のキー（生成ジョブの取得を直列化する）
+_SCHEDULER_LOCK_KEY = 0x746F7269
+
+
+def _weight(priority: int) -> float:
+    return settings.generation_interactive_weight if priority == INTERACTIVE else 1.0
+
+
+def job_cost(db: Session, manual: Manual) -> float:
+    """Scheduling cost of generating a manual: its video length in minutes (at least 1)"""
+    blob = media_store.get_blob(db, manual.video_file_path) if manual.video_file_path else None
+    if not blob or not blob.duration:
+        return 1.0
+    return max(1.0, math.ceil(blob.duration / 60))
+
+
+def default_priority(db: Session, manual: Manual, user_id: Optional[str]) -> int:
+    """Regenerations are interactive; a user's backlog beyond the bulk threshold is bulk"""
+    if manual.content or user_id is None:
+        return INTERACTIVE
+    active = db.query(func.count(GenerationJob.id)).filter(
+        GenerationJob.user_id == user_id,
+        GenerationJob.status.in_(("queued", "running"))
+    ).scalar()
+    return BULK if active >= settings.generation_bulk_threshold else INTERACTIVE
+
+
+def _virtual_time(db: Session) -> float:
+    # 待機中ジョブの最小開始タグ。待機がなければ最後に割り当てた終了タグ
+    backlog = db.query(func.min(GenerationJob.virtual_start)).filter(GenerationJob.status == "queued").scalar()
+    if backlog is not None:
+        return backlog
+    return db.query(func.max(GenerationJob.virtual_finish)).scalar() or 0.0
+
+
+def assign_tags(db: Session, job: GenerationJob) -> None:
+    """Set a new job's fair-queuing start and finish tags (caller commits)"""
+    start = _virtual_time(db)
+    if job.user_id is not None:
+        previous = db.query(func.max(GenerationJob.virtual_finish)).filter(
+            GenerationJob.user_id == job.user_id,
+            GenerationJob.priority == job.priority
+        ).scalar()
+        start = max(start, previous or 0.0)
+    job.virtual_start = start
+    job.virtual_finish = start + job.cost / _weight(job.priority)
+
+
+def lock_scheduler(db: Session) -> None:
+    """Serialize claims until the transaction ends (PostgreSQL only; SQLite serializes writers anyway)"""
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _SCHEDULER_LOCK_KEY})
+
+
+def next_job(db: Session, now: datetime) -> Optional[GenerationJob]:
+    """Lock and return the next job allowed to start, or None when capped or idle (call under lock_scheduler)"""
+    running = db.query(GenerationJob.user_id, func.count(GenerationJob.id)).filter(
+        GenerationJob.status == "running"
+    ).group_by(GenerationJob.user_id).all()
+    if sum(count for _, count in running) >= settings.generation_max_concurrent_jobs:
+        return None
+
+    capped = [user_id for user_id, count in running
+              if user_id is not None and count >= settings.generation_max_jobs_per_user]
+    query = db.query(GenerationJob).filter(
+        GenerationJob.status == "queued",
+        GenerationJob.available_at <= now
+    )
+    if capped:
+        query = query.filter(or_(GenerationJob.user_id.is_(None), GenerationJob.user_id.notin_(capped)))
+    return query.order_by(
+        GenerationJob.priority, GenerationJob.virtual_start, GenerationJob.created_at
+    ).with_for_update(skip_locked=True).first()
+
+
+def queue_position(db: Session, job: GenerationJob) -> Optional[int]:
+    """1-based dispatch position of a queued job (None once it has started)"""
+    if job.status != "queued":
+        return None
+    ahead = db.query(func.count(GenerationJob.id)).filter(
+        GenerationJob.status == "queued",
+        GenerationJob.id != job.id,
+        or_(
+            GenerationJob.priority < job.priority,
+            and_(GenerationJob.priority == job.priority, GenerationJob.virtual_start < job.virtual_start),
+            and_(
+                GenerationJob.priority == job.priority,
+                GenerationJob.virtual_start == job.virtual_start,
+                GenerationJob.created_at < job.created_at
+            )
+        )
+    ).scalar()
+    return ahead + 1
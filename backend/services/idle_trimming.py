@@ -0,0 +1,248 @@
+"""
+Idle-segment trimming
+
+Recordings contain long stretches where nothing happens (pages loading,
+the user hesitating). Before a video is sent to Gemini, segments where the
+picture is frozen (ffmpeg `freezedetect`) and, if the video has audio, the
+audio is silent (`silencedetect`) for at least `idle_min_seconds` are cut
+out, keeping `idle_padding_seconds` of each so the settled screen is still
+visible. Generation time then follows the amount of activity rather than
+the length of the recording.
+
+Trimming shifts the timeline, so the kept segments are stored alongside the
+trimmed video (a JSON sidecar in storage) and step times reported for the
+trimmed video are mapped back to the original with `remap_steps`. Both are
+cached in storage under a key derived from the uploaded video, like the
+Gemini proxy, so a video is analysed and trimmed once.
+"""
+import os
+import re
+import json
+import asyncio
+import logging
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+from services.ffmpeg import run_ffmpeg, run_ffprobe
+from services.storage import storage
+from services.video_proxy import source_hash
+from utils.keyed_lock import KeyedLock
+from utils.timecode import format_timecode, parse_timecode
+
+logger = logging.getLogger(__name__)
+
+# Bump when detection or encoding changes so stale trimmed videos are not reused
+TRIM_VERSION = 1
+
+Segment = Tuple[float, float]
+
+_locks = KeyedLock()
+
+
+def identity() -> List[Any]:
+    """Settings that change a trimmed video (part of the generation cache key)"""
+    return [TRIM_VERSION, settings.idle_min_seconds, settings.idle_padding_seconds,
+            settings.idle_freeze_noise_db, settings.idle_silence_noise_db, settings.idle_trimming_min_ratio]
+
+
+def to_original(seconds: float, kept: List[Segment]) -> float:
+    """Map a time in the trimmed video to the original timeline"""
+    elapsed = 0.0
+    for start, end in kept:
+        length = end - start
+        # 区切りちょうどの時刻は次の区間の先頭（停止が明けた直後）とみなす
+        if seconds < elapsed + length:
+            return start + max(seconds - elapsed, 0.0)
+        elapsed += length
+    return kept[-1][1] if kept else seconds
+
+
+def remap_steps(steps: List[Dict[str, str]], kept: List[Segment]) -> List[Dict[str, str]]:
+    """Copy of `steps` with their `time` mapped back to the original video"""
+    remapped = []
+    for step in steps:
+        step = dict(step)
+        seconds = parse_timecode(step.get("time"))
+        if seconds is not None:
+            step["time"] = format_timecode(to_original(seconds, kept))
+        remapped.append(step)
+    return remapped
+
+
+def trimmed_duration(kept: List[Segment]) -> float:
+    return sum(end - start for start, end in kept)
+
+
+def _intervals(log: str, kind: str, duration: float) -> List[Segment]:
+    starts = [float(t) for t in re.findall(rf"{kind}_start: (-?[0-9.]+)", log)]
+    ends = [float(t) for t in re.findall(rf"{kind}_end: ([0-9.]+)", log)]
+    # 最後まで続いた区間には終了時刻が出力されない
+    ends += [duration] * (len(starts) - len(ends))
+    return [(max(start, 0.0), end) for start, end in zip(starts, ends)]
+
+
+def _intersect(a: List[Segment], b: List[Segment]) -> List[Segment]:
+    result, i, j = [], 0, 0
+    while i < len(a) and j < len(b):
+        start, end = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+        if end > start:
+            result.append((start, end))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+async def detect_idle(video_path: str, audio_path: str, duration: float) -> List[Segment]:
+    """Frozen (and, when there is audio, silent) segments of at least `idle_min_seconds`"""
+    log = await run_ffmpeg([
+        "-i", video_path,
+        "-map", "0:v:0",
+        "-vf", f"freezedetect=n={settings.idle_freeze_noise_db}dB:d={settings.idle_min_seconds}",
+        "-f", "null", "-"
+    ])
+    idle = _intervals(log, "lavfi.freezedetect.freeze", duration)
+
+    probe = await run_ffprobe(audio_path)
+    if idle and any(stream.get("codec_type") == "audio" for stream in probe.get("streams", [])):
+        log = await run_ffmpeg([
+            "-i", audio_path,
+            "-map", "0:a:0",
+            "-af", f"silencedetect=noise={settings.idle_silence_noise_db}dB:d={settings.idle_min_seconds}",
+            "-f", "null", "-"
+        ])
+        idle = _intersect(idle, _intervals(log, "silence", duration))
+
+    padding = settings.idle_padding_seconds
+    return [
+        (start + padding, end - padding) for start, end in idle
+        if end - start >= settings.idle_min_seconds and end - start > 2 * padding
+    ]
+
+
+def kept_segments(duration: float, idle: List[Segment]) -> List[Segment]:
+    kept, position = [], 0.0
+    for start, end in idle:
+        if start > position:
+            kept.append((position, start))
+        position = max(position, end)
+    if duration > position:
+        kept.append((position, duration))
+    return kept
+
+
+def _trim_args(source_path: str, output_path: str, kept: List[Segment], audio: bool) -> list:
+    filters, inputs = [], ""
+    for index, (start, end) in enumerate(kept):
+        filters.append(f"[0:v]trim=start={start:.3f}:end={end:.3f},setpts=PTS-STARTPTS[v{index}]")
+        inputs += f"[v{index}]"
+        if audio:
+            filters.append(f"[0:a]atrim=start={start:.3f}:end={end:.3f},asetpts=PTS-STARTPTS[a{index}]")
+            inputs += f"[a{index}]"
+    filters.append(f"{inputs}concat=n={len(kept)}:v=1:a={int(audio)}[v]{'[a]' if audio else ''}")
+
+    args = [
+        "-i", source_path,
+        "-filter_complex", ";".join(filters),
+        "-map", "[v]",
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-crf", str(settings.gemini_proxy_crf),
+        "-pix_fmt", "yuv420p",
+        "-map_metadata", "-1",
+    ]
+    if audio:
+        args += ["-map", "[a]", "-c:a", "aac", "-ac", "1", "-b:a", "32k"]
+    else:
+        args += ["-an"]
+    return args + ["-movflags", "+faststart", output_path]
+
+
+async def _trimmed_key(upload_key: str, local_path: str) -> str:
+    # 代理動画のキーには元動画のハッシュと変換設定が含まれている
+    if upload_key.startswith("derived/"):
+        stem = os.path.splitext(os.path.basename(upload_key))[0]
+    else:
+        stem = await source_hash(upload_key, local_path)
+    variant = (
+        f"m{settings.idle_min_seconds:g}_p{settings.idle_padding_seconds:g}"
+        f"_n{-settings.idle_freeze_noise_db:g}_s{-settings.idle_silence_noise_db:g}"
+        f"_r{settings.idle_trimming_min_ratio:g}"
+    )
+    return f"derived/trimmed/{stem}_t{TRIM_VERSION}_{variant}.mp4"
+
+
+async def _save_json(key: str, value: Any) -> None:
+    fd, temp_path = tempfile.mkstemp(suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f)
+        await storage.save_file(key, temp_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+async def _load_json(key: str) -> Optional[Any]:
+    if not await storage.exists(key):
+        return None
+    async with storage.local_path(key) as local_path:
+        with open(local_path) as f:
+            return json.load(f)
+
+
+async def ensure_trimmed(upload_key: str, source_key: str) -> Tuple[str, Optional[List[Segment]]]:
+    """
+    Return (storage key to upload, kept segments) for a video about to be sent to Gemini
+
+    The kept segments are None when nothing worth trimming was found; the
+    upload key is then returned unchanged.
+
+    Args:
+        upload_key: Storage key of the video that would be uploaded (usually the proxy)
+        source_key: Storage key of the original video (used for its audio)
+    """
+    async with storage.local_path(upload_key) as upload_path:
+        target_key = await _trimmed_key(upload_key, upload_path)
+        map_key = target_key[:-len(".mp4")] + ".json"
+
+        async with _locks.hold(target_key):
+            cached = await _load_json(map_key)
+            if cached is not None:
+                if not cached["kept"]:
+                    return upload_key, None
+                if await storage.exists(target_key):
+                    logger.info(f"Reusing trimmed video: {target_key}")
+                    return target_key, [tuple(segment) for segment in cached["kept"]]
+
+            probe = await run_ffprobe(upload_path)
+            duration = float(probe.get("format", {}).get("duration") or 0)
+            async with storage.local_path(source_key) as source_path:
+                idle = await detect_idle(upload_path, source_path, duration)
+            kept = kept_segments(duration, idle)
+            removed = duration - trimmed_duration(kept)
+
+            if not kept or removed < duration * settings.idle_trimming_min_ratio:
+                logger.info(f"No idle segments worth trimming in {upload_key} ({removed:.1f}s of {duration:.1f}s)")
+                await _save_json(map_key, {"duration": duration, "kept": []})
+                return upload_key, None
+
+            audio = settings.gemini_proxy_keep_audio and any(
+                stream.get("codec_type") == "audio" for stream in probe.get("streams", [])
+            )
+            fd, temp_path = tempfile.mkstemp(suffix=".mp4")
+            os.close(fd)
+            try:
+                await run_ffmpeg(_trim_args(upload_path, temp_path, kept, audio))
+                await storage.save_file(target_key, temp_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            await _save_json(map_key, {"duration": duration, "kept": kept})
+            logger.info(
+                f"Trimmed {len(idle)} idle segments from {upload_key}: "
+                f"{duration:.1f}s -> {duration - removed:.1f}s"
+            )
+            return target_key, kept
@@ -0,0 +1,237 @@
+"""
+Step-aligned keyframes
+
+The editor and players seek to each step's `time`. With the sparse keyframes
+of screen recordings every seek decodes from far back. This optional job
+re-encodes a manual's video with a keyframe forced at every step start and
+persists the resulting keyframe index in `keyframe_indexes`, so clients can
+seek to step boundaries without decoding preceding frames.
+
+The job is incremental: when steps change it only re-encodes if a step start
+is not already within `SNAP_TOLERANCE` of an existing keyframe.
+"""
+import os
+import json
+import asyncio
+import bisect
+import hashlib
+import logging
+import tempfile
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import KeyframeIndex, Manual
+from services import media_store
+from services.ffmpeg import run_ffmpeg, probe_keyframes
+from services.storage import storage, key_for_path
+from services.video_proxy import source_hash
+from utils.timecode import step_times
+
+logger = logging.getLogger(__name__)
+
+# Bump when the encoding parameters change so aligned videos are rebuilt
+KEYFRAME_VERSION = 1
+
+# A step is considered aligned if a keyframe lies within this many seconds
+SNAP_TOLERANCE = 0.05
+
+# Steps edited while an encode is running trigger at most this many re-checks
+MAX_PASSES = 3
+
+
+def aligned_key(content_hash: str, times: List[float]) -> str:
+    """Storage key of the aligned MP4 for a source and a set of step times"""
+    digest = hashlib.sha1(json.dumps(times).encode()).hexdigest()[:12]
+    return f"derived/seek/{content_hash}_v{KEYFRAME_VERSION}_{digest}.mp4"
+
+
+def manual_step_times(manual: Manual) -> List[float]:
+    """Step start times (seconds) of a manual's stored content"""
+    if not manual.content:
+        return []
+    try:
+        content = json.loads(manual.content) if isinstance(manual.content, str) else manual.content
+    except ValueError:
+        return []
+    return step_times(content.get("steps", []) if isinstance(content, dict) else [])
+
+
+def is_covered(times: List[float], keyframes: List[float]) -> bool:
+    """True if every time has a keyframe within SNAP_TOLERANCE (keyframes sorted)"""
+    for t in times:
+        i = bisect.bisect_left(keyframes, t - SNAP_TOLERANCE)
+        if i == len(keyframes) or keyframes[i] > t + SNAP_TOLERANCE:
+            return False
+    return True
+
+
+def _encode_args(source_path: str, output_path: str, times: List[float]) -> list:
+    args = [
+        "-i", source_path,
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+        "-pix_fmt", "yuv420p",
+    ]
+    if times:
+        args += ["-force_key_frames", ",".join(f"{t:.3f}" for t in times)]
+    args += [
+        "-c:a", "aac", "-b:a", "128k",
+        "-movflags", "+faststart",
+        output_path,
+    ]
+    return args
+
+
+def _claim(db: Session, manual_id: str, key: str, index: Optional[KeyframeIndex]) -> Optional[KeyframeIndex]:
+    """Mark the manual's index as processing, or return None if another job is building it"""
+    if index is None:
+        index = KeyframeIndex(manual_id=manual_id, source_key=key, status="processing")
+        db.add(index)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return None
+        return index
+
+    stale_before = datetime.utcnow() - timedelta(seconds=settings.media_job_timeout_seconds)
+    if index.status == "processing" and index.updated_at > stale_before:
+        return None
+
+    claimed = db.query(KeyframeIndex).filter(
+        KeyframeIndex.id == index.id,
+        KeyframeIndex.updated_at == index.updated_at
+    ).update({
+        KeyframeIndex.status: "processing",
+        KeyframeIndex.source_key: key,
+        KeyframeIndex.error: None,
+        KeyframeIndex.updated_at: datetime.utcnow()
+    }, synchronize_session=False)
+    db.commit()
+    if not claimed:
+        return None
+    db.refresh(index)
+    return index
+
+
+async def _build(video_path: str, times: List[float], content_hash: Optional[str]) -> Tuple[str, int, List[float]]:
+    """Encode (or reuse) the aligned video; returns (storage key, size, keyframes)"""
+    key = key_for_path(video_path)
+    async with storage.local_path(key) as local_source_path:
+        content_hash = content_hash or await source_hash(key, local_source_path)
+        target_key = aligned_key(content_hash, times)
+
+        if await storage.exists(target_key):
+            # 同じ動画・同じステップ時刻の出力は他のマニュアルと共有する
+            size = await storage.size(target_key)
+            async with storage.local_path(target_key) as local_target_path:
+                keyframes = await probe_keyframes(local_target_path)
+        else:
+            fd, temp_path = tempfile.mkstemp(suffix=".mp4")
+            os.close(fd)
+            try:
+                await run_ffmpeg(_encode_args(local_source_path, temp_path, times))
+                keyframes = await probe_keyframes(temp_path)
+                size = os.path.getsize(temp_path)
+                await storage.save_file(target_key, temp_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+    return target_key, size, keyframes
+
+
+def _start_pass(manual_id: str) -> Optional[Tuple[str, str, List[float], Optional[str]]]:
+    """
+    Claim the manual's index if its steps need a new encode; returns
+    (index id, video path, step times, known content hash), or None
+    """
+    db = SessionLocal()
+    try:
+        manual = db.query(Manual).filter(Manual.id == manual_id).first()
+        if not manual or not manual.video_file_path:
+            return None
+
+        times = manual_step_times(manual)
+        key = key_for_path(manual.video_file_path)
+        index = db.query(KeyframeIndex).filter(KeyframeIndex.manual_id == manual_id).first()
+
+        if index and index.status == "ready" and index.source_key == key \
+                and is_covered(times, json.loads(index.keyframes or "[]")):
+            # 既存のキーフレームで足りる場合は再エンコードしない
+            if json.loads(index.step_times or "[]") != times:
+                index.step_times = json.dumps(times)
+                db.commit()
+            return None
+
+        index = _claim(db, manual_id, key, index)
+        if index is None:
+            return None
+        return index.id, manual.video_file_path, times, media_store.content_hash_for_path(db, manual.video_file_path)
+    finally:
+        db.close()
+
+
+def _finish(index_id: str, target_key: str, size: int, times: List[float], keyframes: List[float]) -> Optional[str]:
+    """Mark the index ready; returns the previous aligned video if no index uses it any more"""
+    db = SessionLocal()
+    try:
+        index = db.get(KeyframeIndex, index_id)
+        if index is None:
+            return None
+        previous_key = index.storage_key
+        index.status = "ready"
+        index.storage_key = target_key
+        index.size = size
+        index.step_times = json.dumps(times)
+        index.keyframes = json.dumps(keyframes)
+        index.error = None
+        db.commit()
+        logger.info(f"Aligned {len(times)} step keyframes for manual {index.manual_id} ({len(keyframes)} keyframes)")
+
+        if previous_key and previous_key != target_key:
+            still_used = db.query(KeyframeIndex).filter(KeyframeIndex.storage_key == previous_key).count()
+            if not still_used:
+                return previous_key
+        return None
+    finally:
+        db.close()
+
+
+def _fail(index_id: str, error: str) -> None:
+    db = SessionLocal()
+    try:
+        db.query(KeyframeIndex).filter(KeyframeIndex.id == index_id).update({
+            KeyframeIndex.status: "failed",
+            KeyframeIndex.error: error[:2000],
+            KeyframeIndex.updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def align_keyframes(manual_id: str) -> None:
+    """Background job: (re)build the step-aligned video and keyframe index of a manual"""
+    for _ in range(MAX_PASSES):
+        claimed = await asyncio.to_thread(_start_pass, manual_id)
+        if claimed is None:
+            return
+        index_id, video_path, times, content_hash = claimed
+
+        # エンコード中はDB接続を保持しない
+        try:
+            target_key, size, keyframes = await _build(video_path, times, content_hash)
+        except Exception as e:
+            logger.error(f"Failed to align keyframes for manual {manual_id}: {e}")
+            await asyncio.to_thread(_fail, index_id, str(e))
+            return
+        unused_key = await asyncio.to_thread(_finish, index_id, target_key, size, times, keyframes)
+        if unused_key:
+            await storage.delete(unused_key)
+        # エンコード中にステップが編集されていればもう一度確認する
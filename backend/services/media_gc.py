@@ -0,0 +1,384 @@
+"""
+Media garbage collector
+
+Two passes reclaim storage that no manual references any more:
+
+- Deletion queue: `media_store.release` queues every media reference that
+  is dropped (manual / torisetsu / project deletes, audio replacement). Once
+  `media_gc_delete_delay_seconds` has passed, the GC re-checks references
+  and deletes the file, its blob row and everything derived from it.
+- Sweep: storage is listed in batches and reconciled against the media
+  referenced by manuals and blobs. Unreferenced originals (including uploads
+  that were never attached to a manual) and derived files whose source is
+  gone are deleted once they are older than `media_gc_grace_hours`.
+
+Both passes run in the generation worker (worker.py), one process at a
+time under an advisory lock on PostgreSQL. References are checked per
+batch of candidates with one query per table, and all database access
+runs on a worker thread.
+
+Run `python -m services.media_gc [--dry-run]` for a one-off sweep report.
+"""
+import re
+import json
+import asyncio
+import logging
+import argparse
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Set
+
+from sqlalchemy import or_, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal, engine
+from models import Manual, MediaBlob, MediaDeletion, MediaRendition
+from services.storage import storage, StoredObject, key_for_path, path_for_key
+from services.video_proxy import content_hash_from_key
+
+logger = logging.getLogger(__name__)
+
+DERIVED_PREFIX = "derived/"
+# services.video_proxy / idle_trimming / renditions / keyframes / thumbnails / waveform の出力先
+DERIVED_DIRS = ("proxy", "trimmed", "web", "hls", "seek", "thumbs", "sprites", "waveform")
+
+_SHA256_IN_KEY = re.compile(r"[0-9a-f]{64}")
+
+# pg_try_advisory_lock のキー（複数のワーカーで同時に回収しない）
+_GC_LOCK_KEY = 0x6D656469
+
+
+@dataclass
+class GcReport:
+    scanned_objects: int = 0
+    deleted_objects: int = 0
+    reclaimed_bytes: int = 0
+    deleted_blobs: int = 0
+    dry_run: bool = False
+
+    def deleted(self, size: Optional[int]) -> None:
+        self.deleted_objects += 1
+        self.reclaimed_bytes += size or 0
+
+
+def derived_source_hash(key: str) -> Optional[str]:
+    """Source content hash encoded in a derived storage key"""
+    if not key.startswith(DERIVED_PREFIX):
+        return None
+    match = _SHA256_IN_KEY.search(key)
+    return match.group(0) if match else None
+
+
+@dataclass
+class _Candidate:
+    """An original that looked unreferenced, with what is needed to delete it"""
+    key: str
+    size: Optional[int]
+    blob_sha256: Optional[str]
+    content_hash: Optional[str]
+
+
+def _referenced_keys(db: Session) -> Set[str]:
+    """Storage keys of all media referenced by manuals (streamed from the database)"""
+    keys = set()
+    rows = db.query(Manual.video_file_path, Manual.audio_file_path).yield_per(settings.media_gc_batch_size)
+    for video_file_path, audio_file_path in rows:
+        for path in (video_file_path, audio_file_path):
+            if path:
+                keys.add(key_for_path(path))
+    return keys
+
+
+def _unreferenced(db: Session, objects: List[StoredObject], referenced_keys: Set[str],
+                  fresh_after: datetime) -> List[_Candidate]:
+    """
+    Originals among `objects` that no manual uses and whose blob is neither
+    referenced nor fresh (one query per table for the whole batch)
+    """
+    objects = [obj for obj in objects if obj.key not in referenced_keys]
+    if not objects:
+        return []
+    paths = {path_for_key(obj.key): obj.key for obj in objects}
+    blobs = {
+        paths[blob.file_path]: blob
+        for blob in db.query(MediaBlob).filter(MediaBlob.file_path.in_(list(paths)))
+    }
+    # 旧形式のファイル名はレンディション作成時に記録されたハッシュを使う
+    unknown = [
+        obj.key for obj in objects
+        if obj.key not in blobs and not content_hash_from_key(obj.key)
+    ]
+    rendition_hashes = dict(
+        db.query(MediaRendition.source_key, MediaRendition.source_hash)
+        .filter(MediaRendition.source_key.in_(unknown)).all()
+    ) if unknown else {}
+
+    candidates = []
+    for obj in objects:
+        blob = blobs.get(obj.key)
+        if blob and (blob.ref_count > 0 or (blob.updated_at and blob.updated_at > fresh_after)):
+            continue
+        content_hash = blob.sha256 if blob else content_hash_from_key(obj.key) or rendition_hashes.get(obj.key)
+        candidates.append(_Candidate(obj.key, obj.size, blob.sha256 if blob else None, content_hash))
+    return candidates
+
+
+def _hash_in_use(db: Session, content_hash: str) -> bool:
+    """True if any stored source (blob or legacy file with renditions) still has this content"""
+    if db.query(MediaBlob.sha256).filter(MediaBlob.sha256 == content_hash).first():
+        return True
+    return db.query(MediaRendition.id).filter(MediaRendition.source_hash == content_hash).first() is not None
+
+
+def _delete_renditions(db: Session, key: str, referenced_keys: Set[str], fresh_after: datetime) -> None:
+    """Delete the rendition rows of a deleted source and of a deleted rendition output"""
+    renditions = db.query(MediaRendition).filter(
+        or_(MediaRendition.source_key == key, MediaRendition.storage_key == key)
+    ).all()
+    for rendition in renditions:
+        output_key = rendition.storage_key
+        # 圧縮音声のように出力自体がマニュアルから使われている行は残す（is_compact_audio の判定に使う）
+        if output_key and output_key != key and not output_key.startswith(DERIVED_PREFIX):
+            if output_key in referenced_keys:
+                continue
+            output_blob = db.query(MediaBlob).filter(MediaBlob.file_path == path_for_key(output_key)).first()
+            if output_blob and (output_blob.ref_count > 0 or output_blob.updated_at > fresh_after):
+                continue
+        db.delete(rendition)
+
+
+def _delete_rows(candidate: _Candidate, referenced_keys: Set[str], fresh_after: datetime) -> bool:
+    """Delete the blob and rendition rows of an original; False if it was referenced meanwhile"""
+    db = SessionLocal()
+    try:
+        if candidate.blob_sha256:
+            # 判定後に参照された場合に備え、条件付きで行を削除する
+            deleted = db.query(MediaBlob).filter(
+                MediaBlob.sha256 == candidate.blob_sha256,
+                MediaBlob.ref_count == 0,
+                MediaBlob.updated_at <= fresh_after
+            ).delete(synchronize_session=False)
+            if not deleted:
+                db.rollback()
+                return False
+        _delete_renditions(db, candidate.key, referenced_keys, fresh_after)
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def _read(query, *args):
+    """Run a read-only query function in a session of its own (call through asyncio.to_thread)"""
+    db = SessionLocal()
+    try:
+        return query(db, *args)
+    finally:
+        db.close()
+
+
+async def _delete_derived(content_hash: str, report: GcReport) -> None:
+    """Delete every derived file (proxies, renditions, thumbnails, ...) of a source"""
+    for directory in DERIVED_DIRS:
+        async for batch in storage.iter_list(f"{DERIVED_PREFIX}{directory}/{content_hash}", settings.media_gc_batch_size):
+            for obj in batch:
+                if not report.dry_run:
+                    await storage.delete(obj.key)
+                report.deleted(obj.size)
+
+
+async def _delete_source(candidate: _Candidate, referenced_keys: Set[str], fresh_after: datetime,
+                         report: GcReport, purged_hashes: Optional[Set[str]] = None) -> bool:
+    """Delete an unreferenced original together with its blob row, renditions and derived files"""
+    if not report.dry_run:
+        if not await asyncio.to_thread(_delete_rows, candidate, referenced_keys, fresh_after):
+            return False
+        await storage.delete(candidate.key)
+        if candidate.blob_sha256:
+            report.deleted_blobs += 1
+    report.deleted(candidate.size)
+    logger.info(f"Deleted unreferenced media {candidate.key} ({candidate.size or 0} bytes)")
+
+    content_hash = candidate.content_hash
+    if content_hash and (report.dry_run or not await asyncio.to_thread(_read, _hash_in_use, content_hash)):
+        await _delete_derived(content_hash, report)
+        if purged_hashes is not None:
+            purged_hashes.add(content_hash)
+    return True
+
+
+def _due_deletions(now: datetime) -> List[str]:
+    db = SessionLocal()
+    try:
+        return [
+            row.storage_key for row in db.query(MediaDeletion.storage_key)
+            .filter(MediaDeletion.not_before <= now)
+            .distinct()
+            .limit(settings.media_gc_batch_size)
+            .all()
+        ]
+    finally:
+        db.close()
+
+
+def _drop_deletions(keys: List[str], now: datetime) -> None:
+    db = SessionLocal()
+    try:
+        db.query(MediaDeletion).filter(
+            MediaDeletion.storage_key.in_(keys),
+            MediaDeletion.not_before <= now
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def process_deletion_queue(dry_run: bool = False) -> GcReport:
+    """Delete queued media whose delay has passed and that is still unreferenced"""
+    report = GcReport(dry_run=dry_run)
+    now = datetime.utcnow()
+    fresh_after = now - timedelta(seconds=settings.media_gc_delete_delay_seconds)
+    referenced_keys: Optional[Set[str]] = None
+
+    while True:
+        keys = await asyncio.to_thread(_due_deletions, now)
+        if not keys:
+            break
+        if referenced_keys is None:
+            referenced_keys = await asyncio.to_thread(_read, _referenced_keys)
+        objects = []
+        for key in keys:
+            size = await storage.size(key)
+            report.scanned_objects += 1
+            if size is not None:
+                objects.append(StoredObject(key=key, size=size, modified_at=now))
+        candidates = await asyncio.to_thread(_read, _unreferenced, objects, referenced_keys, fresh_after)
+        for candidate in candidates:
+            await _delete_source(candidate, referenced_keys, fresh_after, report)
+        if dry_run:
+            break
+        await asyncio.to_thread(_drop_deletions, keys, now)
+    return report
+
+
+def _live_hashes(db: Session, referenced_keys: Set[str], fresh_after: datetime) -> Set[str]:
+    """Content hashes whose derived files must be kept"""
+    hashes = set()
+    blobs = db.query(MediaBlob.sha256).filter(
+        or_(MediaBlob.ref_count > 0, MediaBlob.updated_at > fresh_after)
+    ).yield_per(settings.media_gc_batch_size)
+    hashes.update(sha256 for (sha256,) in blobs)
+    renditions = db.query(MediaRendition.source_key, MediaRendition.source_hash).yield_per(settings.media_gc_batch_size)
+    hashes.update(source_hash for source_key, source_hash in renditions if source_key in referenced_keys)
+    hashes.update(h for h in (content_hash_from_key(key) for key in referenced_keys) if h)
+    return hashes
+
+
+async def _sweep_batch(batch: Iterable[StoredObject], referenced_keys: Set[str], live_hashes: Set[str],
+                       purged_hashes: Set[str], fresh_after: datetime, report: GcReport) -> None:
+    originals = []
+    for obj in batch:
+        report.scanned_objects += 1
+        if obj.modified_at > fresh_after or obj.key in referenced_keys:
+            continue
+        if obj.key.startswith(DERIVED_PREFIX):
+            content_hash = derived_source_hash(obj.key)
+            # 元動画と一緒に削除済みの派生ファイルは二重に数えない
+            if content_hash and content_hash not in live_hashes and content_hash not in purged_hashes:
+                if not report.dry_run:
+                    await storage.delete(obj.key)
+                report.deleted(obj.size)
+        else:
+            originals.append(obj)
+
+    if originals:
+        candidates = await asyncio.to_thread(_read, _unreferenced, originals, referenced_keys, fresh_after)
+        for candidate in candidates:
+            await _delete_source(candidate, referenced_keys, fresh_after, report, purged_hashes)
+
+
+async def sweep(dry_run: bool = False) -> GcReport:
+    """Reconcile storage against the database and delete orphans older than the grace period"""
+    report = GcReport(dry_run=dry_run)
+    fresh_after = datetime.utcnow() - timedelta(hours=settings.media_gc_grace_hours)
+    referenced_keys = await asyncio.to_thread(_read, _referenced_keys)
+    live_hashes = await asyncio.to_thread(_read, _live_hashes, referenced_keys, fresh_after)
+    purged_hashes: Set[str] = set()
+
+    async for batch in storage.iter_list("", settings.media_gc_batch_size):
+        await _sweep_batch(batch, referenced_keys, live_hashes, purged_hashes, fresh_after, report)
+
+    logger.info(
+        f"Media GC sweep{' (dry run)' if dry_run else ''}: scanned {report.scanned_objects} objects, "
+        f"deleted {report.deleted_objects}, reclaimed {report.reclaimed_bytes} bytes"
+    )
+    return report
+
+
+def _try_lock() -> Optional[Connection]:
+    """Take the GC lock so only one process collects at a time (None if another process holds it)"""
+    connection = engine.connect()
+    if connection.dialect.name != "postgresql":
+        return connection
+    if connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": _GC_LOCK_KEY}).scalar():
+        return connection
+    connection.close()
+    return None
+
+
+def _unlock(connection: Connection) -> None:
+    try:
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _GC_LOCK_KEY})
+    finally:
+        connection.close()
+
+
+async def collect(run_sweep: bool) -> Optional[GcReport]:
+    """One GC pass (the deletion queue, then a sweep if requested); None if another process is collecting"""
+    lock = await asyncio.to_thread(_try_lock)
+    if lock is None:
+        return None
+    try:
+        report = await process_deletion_queue()
+        if report.deleted_objects:
+            logger.info(
+                f"Media GC queue: deleted {report.deleted_objects} objects, "
+                f"reclaimed {report.reclaimed_bytes} bytes"
+            )
+        if run_sweep:
+            await sweep()
+        return report
+    finally:
+        await asyncio.to_thread(_unlock, lock)
+
+
+async def media_gc_loop() -> None:
+    """Periodically process the deletion queue and sweep storage for orphans (runs in the worker)"""
+    last_sweep: Optional[datetime] = None
+    while True:
+        try:
+            run_sweep = last_sweep is None or datetime.utcnow() - last_sweep >= timedelta(hours=settings.media_gc_sweep_interval_hours)
+            report = await collect(run_sweep)
+            if report is not None and run_sweep:
+                last_sweep = datetime.utcnow()
+        except Exception as e:
+            logger.error(f"Media GC failed: {e}")
+        await asyncio.sleep(settings.media_gc_interval_seconds)
+
+
+async def _main(args: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Reclaim storage used by unreferenced media")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be deleted")
+    options = parser.parse_args(args)
+
+    queue_report = await process_deletion_queue(dry_run=options.dry_run)
+    sweep_report = await sweep(dry_run=options.dry_run)
+    print(json.dumps({"queue": asdict(queue_report), "sweep": asdict(sweep_report)}, indent=2))
+
+
+if __name__ == "__main__":
+    import sys
+    asyncio.run(_main(sys.argv[1:]))
@@ -0,0 +1,173 @@
+"""
+Media probing
+
+Uploads are probed with ffprobe before they enter the content store, so
+files that are not decodable media (or have no stream of the uploaded kind)
+are rejected up front instead of failing later in Gemini or ffmpeg. ffprobe
+only reads the container headers and stream info, not the whole file.
+
+The probe result is persisted on the blob (duration, resolution, codecs,
+fps, bit rate, plus the raw ffprobe JSON), and downstream stages (renditions,
+thumbnails, generation, the manual API) read it from the database instead of
+probing the file again.
+"""
+import json
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import MediaBlob
+from services.ffmpeg import FFmpegError, run_ffprobe
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidMediaError(ValueError):
+    """Raised when an uploaded file is not usable media of the expected kind"""
+
+
+def _stream(probe: Dict[str, Any], codec_type: str) -> Optional[Dict[str, Any]]:
+    for stream in probe.get("streams", []):
+        if stream.get("codec_type") == codec_type and stream.get("disposition", {}).get("attached_pic") != 1:
+            return stream
+    return None
+
+
+def _float(value: Any) -> Optional[float]:
+    try:
+        result = float(value)
+    except (TypeError, ValueError):
+        return None
+    return result if result == result and result not in (float("inf"), float("-inf")) else None
+
+
+def _frame_rate(stream: Dict[str, Any]) -> Optional[float]:
+    for field in ("avg_frame_rate", "r_frame_rate"):
+        numerator, _, denominator = str(stream.get(field) or "").partition("/")
+        num, den = _float(numerator), _float(denominator or 1)
+        if num and den:
+            return round(num / den, 3)
+    return None
+
+
+def media_metadata(probe: Dict[str, Any]) -> Dict[str, Any]:
+    """Summary fields of an ffprobe result (the columns stored on MediaBlob)"""
+    fmt = probe.get("format", {})
+    video = _stream(probe, "video")
+    audio = _stream(probe, "audio")
+    bit_rate = _float(fmt.get("bit_rate"))
+    return {
+        "duration": _float(fmt.get("duration")) or _float((video or audio or {}).get("duration")),
+        "width": int(video["width"]) if video and video.get("width") else None,
+        "height": int(video["height"]) if video and video.get("height") else None,
+        "fps": _frame_rate(video) if video else None,
+        "video_codec": video.get("codec_name") if video else None,
+        "audio_codec": audio.get("codec_name") if audio else None,
+        "bit_rate": int(bit_rate) if bit_rate else None,
+        "format_name": fmt.get("format_name"),
+    }
+
+
+def validate_probe(probe: Dict[str, Any], kind: str) -> None:
+    """Raise InvalidMediaError unless the probe describes playable media of `kind`"""
+    metadata = media_metadata(probe)
+    if kind == "video" and not (metadata["video_codec"] and metadata["width"] and metadata["height"]):
+        raise InvalidMediaError("File has no video stream")
+    if kind == "audio" and not metadata["audio_codec"]:
+        raise InvalidMediaError("File has no audio stream")
+    if not metadata["duration"]:
+        raise InvalidMediaError("Could not determine media duration")
+
+
+async def probe_media(path: str, kind: str) -> Dict[str, Any]:
+    """Probe a local file and validate it as `kind` media; returns the raw ffprobe result"""
+    try:
+        probe = await run_ffprobe(path)
+    except FFmpegError as e:
+        raise InvalidMediaError(f"File is not a readable {kind} file") from e
+    validate_probe(probe, kind)
+    return probe
+
+
+def apply_probe(blob: MediaBlob, probe: Dict[str, Any]) -> None:
+    """Persist a probe result on a blob (caller commits)"""
+    for field, value in media_metadata(probe).items():
+        setattr(blob, field, value)
+    blob.probe = json.dumps(probe)
+    blob.probed_at = datetime.utcnow()
+
+
+def stored_probe(blob: Optional[MediaBlob]) -> Optional[Dict[str, Any]]:
+    """Raw ffprobe result persisted on a blob, if it has been probed"""
+    if not blob or not blob.probe:
+        return None
+    try:
+        return json.loads(blob.probe)
+    except ValueError:
+        return None
+
+
+def _blob_probe(path: str) -> Optional[Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        return stored_probe(db.query(MediaBlob).filter(MediaBlob.file_path == path).first())
+    finally:
+        db.close()
+
+
+def _save_probe(path: str, probe: Dict[str, Any]) -> None:
+    db = SessionLocal()
+    try:
+        blob = db.query(MediaBlob).filter(MediaBlob.file_path == path).first()
+        if blob is not None and not blob.probed_at:
+            apply_probe(blob, probe)
+            db.commit()
+    finally:
+        db.close()
+
+
+async def load_probe(path: Optional[str], local_path: str) -> Dict[str, Any]:
+    """
+    Stored probe of the blob at `path`, probing (and persisting for blobs)
+    only when it is missing; the database is only used on a worker thread
+    """
+    probe = await asyncio.to_thread(_blob_probe, path) if path else None
+    if probe is not None:
+        return probe
+    probe = await run_ffprobe(local_path)
+    if path:
+        # アップロード時の解析を導入する前のBLOBはここで補完する
+        await asyncio.to_thread(_save_probe, path, probe)
+    return probe
+
+
+def metadata_for_blob(blob: Optional[MediaBlob]) -> Optional[Dict[str, Any]]:
+    """Metadata of a probed blob as returned by the API"""
+    if not blob or not blob.probed_at:
+        return None
+    return {
+        "duration": blob.duration,
+        "width": blob.width,
+        "height": blob.height,
+        "fps": blob.fps,
+        "video_codec": blob.video_codec,
+        "audio_codec": blob.audio_codec,
+        "bit_rate": blob.bit_rate,
+        "format_name": blob.format_name,
+    }
+
+
+def attach_media_metadata(db: Session, manuals: Iterable[Any]) -> None:
+    """Set `video_metadata` / `audio_metadata` on manuals for the response schema"""
+    manuals = list(manuals)
+    paths = {p for m in manuals for p in (m.video_file_path, m.audio_file_path) if p}
+    blobs = {}
+    if paths:
+        blobs = {b.file_path: b for b in db.query(MediaBlob).filter(MediaBlob.file_path.in_(paths)).all()}
+    for manual in manuals:
+        manual.video_metadata = metadata_for_blob(blobs.get(manual.video_file_path))
+        manual.audio_metadata = metadata_for_blob(blobs.get(manual.audio_file_path))
@@ -0,0 +1,169 @@
+"""
+Content-addressed media store
+
+Uploaded media is hashed (SHA-256) while it is written and stored once per
+distinct content under the storage key `<sha256><ext>` (see services.storage).
+Manuals reference the stored path; the number of referencing manuals is
+tracked in `ref_count`. Files are probed and validated (services.media_probe)
+before they are stored. Dropping a reference queues the file for the media
+GC (services.media_gc), which deletes it once nothing references it.
+"""
+import os
+import uuid
+import hashlib
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from fastapi import UploadFile
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from config import settings
+from models import MediaBlob, MediaDeletion, Manual
+from services.media_probe import apply_probe, probe_media, stored_probe, validate_probe
+from services.storage import storage, key_for_path, path_for_key
+from utils.upload_stream import save_upload_file
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_key(sha256: str, extension: str) -> str:
+    """Storage key for a blob with the given hash"""
+    return f"{sha256}{extension.lower()}"
+
+
+def incoming_path(extension: str) -> str:
+    """Local scratch path for an upload that is still being written and hashed"""
+    incoming_folder = os.path.join(settings.upload_folder, ".incoming")
+    os.makedirs(incoming_folder, exist_ok=True)
+    return os.path.join(incoming_folder, f"{uuid.uuid4()}{extension}")
+
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file on disk, read in fixed-size chunks"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+async def _commit_blob(db: Session, source_path: str, sha256: str, size: int, extension: str, kind: str) -> MediaBlob:
+    """Move a fully written file into storage, or drop it if the content already exists
+
+    Raises InvalidMediaError (before anything is stored) if the file is not `kind` media.
+    """
+    existing = db.query(MediaBlob).filter(MediaBlob.sha256 == sha256).first()
+
+    # 解析済みの内容は保存済みの結果で検証し、ffprobe を再実行しない
+    probe = stored_probe(existing)
+    if probe is None:
+        probe = await probe_media(source_path, kind)
+    else:
+        validate_probe(probe, kind)
+
+    if existing and await storage.exists(key_for_path(existing.file_path)):
+        os.remove(source_path)
+        # 再アップロードされた未参照のBLOBがGCの猶予期間内に削除されないよう更新日時を進める
+        existing.updated_at = datetime.utcnow()
+        if not existing.probed_at:
+            apply_probe(existing, probe)
+        db.commit()
+        logger.info(f"Deduplicated upload into existing blob {sha256}")
+        return existing
+
+    key = content_key(sha256, extension)
+    await storage.save_file(key, source_path)
+    file_path = path_for_key(key)
+
+    if existing:
+        # 行は残っているがファイルが失われていた場合は復元する
+        existing.file_path = file_path
+        if not existing.probed_at:
+            apply_probe(existing, probe)
+        db.commit()
+        return existing
+
+    blob = MediaBlob(sha256=sha256, file_path=file_path, kind=kind, size=size, ref_count=0)
+    apply_probe(blob, probe)
+    db.add(blob)
+    try:
+        db.commit()
+    except IntegrityError:
+        # 同じ内容の同時アップロードが先に登録された
+        db.rollback()
+        blob = db.query(MediaBlob).filter(MediaBlob.sha256 == sha256).one()
+    db.refresh(blob)
+    return blob
+
+
+async def store_upload(db: Session, file: UploadFile, kind: str, max_size: int) -> MediaBlob:
+    """Stream an UploadFile into the store, hashing it while it is written"""
+    extension = os.path.splitext(file.filename)[1]
+    temp_path = incoming_path(extension)
+    hasher = hashlib.sha256()
+    size = await save_upload_file(file, temp_path, max_size, hasher=hasher)
+    try:
+        return await _commit_blob(db, temp_path, hasher.hexdigest(), size, extension, kind)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+async def store_file(db: Session, path: str, kind: str, extension: Optional[str] = None) -> MediaBlob:
+    """Move an existing local file (e.g. a completed resumable upload) into the store"""
+    extension = extension if extension is not None else os.path.splitext(path)[1]
+    sha256 = await asyncio.to_thread(hash_file, path)
+    size = os.path.getsize(path)
+    return await _commit_blob(db, path, sha256, size, extension, kind)
+
+
+def get_blob(db: Session, path: Optional[str]) -> Optional[MediaBlob]:
+    """Blob stored at `path`, or None for paths outside the store"""
+    if not path:
+        return None
+    return db.query(MediaBlob).filter(MediaBlob.file_path == path).first()
+
+
+def resolve_path(db: Session, path: Optional[str]) -> Optional[str]:
+    """Canonical path for a media reference (legacy paths are returned unchanged)"""
+    blob = get_blob(db, path)
+    return blob.file_path if blob else path
+
+
+def content_hash_for_path(db: Session, path: Optional[str]) -> Optional[str]:
+    """SHA-256 of the media at `path` if it lives in the store"""
+    blob = get_blob(db, path)
+    return blob.sha256 if blob else None
+
+
+def acquire(db: Session, path: Optional[str]) -> None:
+    """Count a new reference to the blob at `path` (caller commits)"""
+    if path:
+        db.query(MediaBlob).filter(MediaBlob.file_path == path).update(
+            {MediaBlob.ref_count: MediaBlob.ref_count + 1}, synchronize_session=False
+        )
+
+
+def release(db: Session, path: Optional[str]) -> None:
+    """Drop a reference to the media at `path` and queue it for deletion if unused (caller commits)"""
+    if path:
+        db.query(MediaBlob).filter(MediaBlob.file_path == path, MediaBlob.ref_count > 0).update(
+            {MediaBlob.ref_count: MediaBlob.ref_count - 1}, synchronize_session=False
+        )
+        db.add(MediaDeletion(
+            storage_key=key_for_path(path),
+            not_before=datetime.utcnow() + timedelta(seconds=settings.media_gc_delete_delay_seconds)
+        ))
+
+
+def release_manual_media(db: Session, manuals: Iterable[Manual]) -> None:
+    """Drop the media references held by manuals that are about to be deleted"""
+    for manual in manuals:
+        release(db, manual.video_file_path)
+        release(db, manual.audio_file_path)
@@ -0,0 +1,106 @@
+"""
+Prometheus metrics for the API process (`GET /metrics`)
+
+Recorded in-process as requests run (see utils.metrics):
+- request latency histograms per route template, method and status class;
+- bytes received by uploads (a counter; `rate()` gives bytes/sec).
+
+Read at scrape time:
+- SQLAlchemy pool checked-out / checked-in / overflow connections;
+- thread pools: the asyncio default executor used by `asyncio.to_thread`
+  (replaced in the lifespan by an instrumented one so its running and
+  queued work can be counted) and anyio's limiter used by Starlette for
+  sync endpoints and dependencies;
+- in-flight generation jobs (queued / running) and manuals by status, from
+  the database (two grouped counts per scrape).
+"""
+import asyncio
+import logging
+from typing import List, Optional
+
+from anyio import to_thread
+from sqlalchemy import func
+from sqlalchemy.pool import QueuePool
+
+from database import engine, SessionLocal
+from models import GenerationJob, Manual
+from services.generation_queue import QUEUED, RUNNING
+from utils.metrics import InstrumentedThreadPoolExecutor, render_gauge, request_duration, upload_bytes
+
+logger = logging.getLogger(__name__)
+
+# Response が charset=utf-8 を付け足す
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+_thread_pool: Optional[InstrumentedThreadPoolExecutor] = None
+
+
+def install_thread_pool() -> InstrumentedThreadPoolExecutor:
+    """Replace the running loop's default executor with one whose queue depth can be read"""
+    global _thread_pool
+    _thread_pool = InstrumentedThreadPoolExecutor(thread_name_prefix="to_thread")
+    asyncio.get_running_loop().set_default_executor(_thread_pool)
+    return _thread_pool
+
+
+def _pool_metrics() -> List[str]:
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return []
+    return (
+        render_gauge("torisetsu_db_pool_size", "Configured SQLAlchemy pool size", [({}, pool.size())])
+        + render_gauge("torisetsu_db_pool_checked_out", "Connections currently checked out", [({}, pool.checkedout())])
+        + render_gauge("torisetsu_db_pool_checked_in", "Idle connections in the pool", [({}, pool.checkedin())])
+        # overflow() は pool_size を超えて開いた接続数（空きがあるときは負の値）
+        + render_gauge("torisetsu_db_pool_overflow", "Connections opened beyond the pool size", [({}, max(pool.overflow(), 0))])
+    )
+
+
+def _thread_pool_metrics() -> List[str]:
+    # (pool, 実行中, 空きスレッド待ち, スレッド数)
+    pools = []
+    if _thread_pool is not None:
+        pools.append(("asyncio", _thread_pool.active, _thread_pool.queued, _thread_pool._max_workers))
+    limiter = to_thread.current_default_thread_limiter().statistics()
+    pools.append(("anyio", limiter.borrowed_tokens, limiter.tasks_waiting, limiter.total_tokens))
+    return (
+        render_gauge("torisetsu_threadpool_active", "Calls running on a worker thread",
+                     [({"pool": pool}, active) for pool, active, _, _ in pools])
+        + render_gauge("torisetsu_threadpool_queued", "Calls waiting for a free worker thread",
+                       [({"pool": pool}, queued) for pool, _, queued, _ in pools])
+        + render_gauge("torisetsu_threadpool_max_workers", "Worker threads in the pool",
+                       [({"pool": pool}, size) for pool, _, _, size in pools])
+    )
+
+
+def _database_metrics() -> List[str]:
+    db = SessionLocal()
+    try:
+        jobs = dict(
+            db.query(GenerationJob.status, func.count(GenerationJob.id))
+            .filter(GenerationJob.status.in_([QUEUED, RUNNING]))
+            .group_by(GenerationJob.status).all()
+        )
+        manuals = db.query(Manual.status, func.count(Manual.id)).group_by(Manual.status).all()
+    finally:
+        db.close()
+    return (
+        render_gauge(
+            "torisetsu_generation_jobs", "In-flight generation jobs by state",
+            [({"state": state}, jobs.get(state, 0)) for state in (QUEUED, RUNNING)]
+        )
+        + render_gauge(
+            "torisetsu_manuals", "Manuals by status",
+            [({"status": status or "unknown"}, count) for status, count in manuals]
+        )
+    )
+
+
+async def render_metrics() -> str:
+    lines = request_duration.render() + upload_bytes.render() + _pool_metrics() + _thread_pool_metrics()
+    try:
+        lines += await asyncio.to_thread(_database_metrics)
+    except Exception as e:
+        # DBに届かなくてもプロセス内のメトリクスは返す
+        logger.warning(f"Failed to collect database metrics: {e}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,424 @@
+"""
+Web playback renditions
+
+Uploaded recordings are often WebM (MediaRecorder) or MP4s with the moov
+atom at the end, which stall before the first frame and seek slowly. For
+every stored video a background job produces:
+
+- "faststart": an H.264/AAC MP4 with the moov atom up front (a stream-copy
+  remux when the source is already browser-compatible, otherwise a transcode)
+- "hls":       an HLS VOD ladder (up to three bitrates) with a master playlist
+- "sprite":    scrubbing sprite sheets with a WebVTT index (services.thumbnails)
+
+Renditions are tracked per source storage key in the `media_renditions`
+table; deduplicated uploads share a key and therefore share renditions.
+Jobs claim and finish renditions in short sessions on a worker thread
+(`claim_rendition_id`, `complete_rendition`, `fail_rendition`), so no
+pooled connection is held while ffmpeg runs.
+"""
+import os
+import json
+import asyncio
+import logging
+import tempfile
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import KeyframeIndex, MediaRendition
+from services import media_store
+from services.ffmpeg import FFmpegError, run_ffmpeg
+from services.media_probe import load_probe
+from services.storage import storage, key_for_path
+from services.thumbnails import build_sprite
+from services.video_proxy import source_hash
+
+logger = logging.getLogger(__name__)
+
+# Bump when the encoding parameters change so renditions are rebuilt
+RENDITION_VERSION = 1
+
+FASTSTART = "faststart"
+HLS = "hls"
+SPRITE = "sprite"
+RENDITION_KINDS = (FASTSTART, HLS, SPRITE)
+
+# (height, video kbps); rungs above the source height are dropped
+HLS_LADDER: List[Tuple[int, int]] = [(360, 800), (720, 2500), (1080, 5000)]
+HLS_AUDIO_BITRATE = "128k"
+MASTER_PLAYLIST = "master.m3u8"
+
+
+def faststart_key(content_hash: str) -> str:
+    return f"derived/web/{content_hash}_v{RENDITION_VERSION}.mp4"
+
+
+def hls_prefix(content_hash: str) -> str:
+    return f"derived/hls/{content_hash}_v{RENDITION_VERSION}/"
+
+
+def media_url(key: str) -> str:
+    """URL path under which the media router serves a storage key"""
+    return f"/uploads/{key}"
+
+
+def _stream(probe: Dict[str, Any], codec_type: str) -> Optional[Dict[str, Any]]:
+    for stream in probe.get("streams", []):
+        if stream.get("codec_type") == codec_type:
+            return stream
+    return None
+
+
+def _can_remux(probe: Dict[str, Any]) -> bool:
+    """True if the source only needs its moov atom moved (H.264/AAC in MP4/MOV)"""
+    format_names = probe.get("format", {}).get("format_name", "").split(",")
+    video = _stream(probe, "video")
+    audio = _stream(probe, "audio")
+    return (
+        bool({"mp4", "mov"} & set(format_names))
+        and video is not None
+        and video.get("codec_name") == "h264"
+        and video.get("pix_fmt") in ("yuv420p", "yuvj420p")
+        and (audio is None or audio.get("codec_name") == "aac")
+    )
+
+
+def _remux_args(source_path: str, output_path: str) -> list:
+    return [
+        "-i", source_path,
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-c", "copy",
+        "-movflags", "+faststart",
+        output_path,
+    ]
+
+
+def _transcode_args(source_path: str, output_path: str) -> list:
+    return [
+        "-i", source_path,
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+        "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", HLS_AUDIO_BITRATE,
+        "-movflags", "+faststart",
+        output_path,
+    ]
+
+
+def hls_ladder(source_height: Optional[int]) -> List[Tuple[int, int]]:
+    """Ladder rungs that do not upscale the source"""
+    if not source_height:
+        return HLS_LADDER[:2]
+    rungs = [rung for rung in HLS_LADDER if rung[0] <= source_height]
+    return rungs or [(source_height - source_height % 2, HLS_LADDER[0][1])]
+
+
+def _hls_args(source_path: str, output_dir: str, probe: Dict[str, Any]) -> list:
+    video = _stream(probe, "video") or {}
+    has_audio = _stream(probe, "audio") is not None
+    rungs = hls_ladder(video.get("height"))
+    segment_seconds = settings.hls_segment_seconds
+
+    # 1回のデコードで全ビットレートをエンコードする
+    split = f"[0:v]split={len(rungs)}" + "".join(f"[v{i}]" for i in range(len(rungs)))
+    scales = ";".join(f"[v{i}]scale=-2:{height}[v{i}out]" for i, (height, _) in enumerate(rungs))
+    args = ["-i", source_path, "-filter_complex", f"{split};{scales}"]
+
+    for i, (_, kbps) in enumerate(rungs):
+        args += [
+            "-map", f"[v{i}out]",
+            f"-b:v:{i}", f"{kbps}k",
+            f"-maxrate:v:{i}", f"{int(kbps * 1.1)}k",
+            f"-bufsize:v:{i}", f"{kbps * 2}k",
+        ]
+        if has_audio:
+            args += ["-map", "0:a:0"]
+
+    # 全レンディションでキーフレーム位置を揃え、セグメント境界で切り替えられるようにする
+    args += [
+        "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+        "-sc_threshold", "0",
+        "-force_key_frames", f"expr:gte(t,n_forced*{segment_seconds})",
+    ]
+    if has_audio:
+        args += ["-c:a", "aac", "-b:a", HLS_AUDIO_BITRATE, "-ac", "2"]
+
+    stream_map = " ".join(
+        f"v:{i},a:{i}" if has_audio else f"v:{i}" for i in range(len(rungs))
+    )
+    args += [
+        "-f", "hls",
+        "-hls_time", str(segment_seconds),
+        "-hls_playlist_type", "vod",
+        "-hls_flags", "independent_segments",
+        "-hls_segment_filename", os.path.join(output_dir, "stream_%v_%05d.ts"),
+        "-master_pl_name", MASTER_PLAYLIST,
+        "-var_stream_map", stream_map,
+        os.path.join(output_dir, "stream_%v.m3u8"),
+    ]
+    return args
+
+
+async def _build_faststart(content_hash: str, source_path: str, probe: Dict[str, Any]) -> Tuple[str, int, None]:
+    target_key = faststart_key(content_hash)
+    fd, temp_path = tempfile.mkstemp(suffix=".mp4")
+    os.close(fd)
+    try:
+        remuxed = False
+        if _can_remux(probe):
+            try:
+                await run_ffmpeg(_remux_args(source_path, temp_path))
+                remuxed = True
+            except FFmpegError as e:
+                logger.warning(f"Remux failed for {content_hash}, transcoding instead: {e}")
+        if not remuxed:
+            await run_ffmpeg(_transcode_args(source_path, temp_path))
+
+        size = os.path.getsize(temp_path)
+        logger.info(f"Created faststart MP4 for {content_hash} ({'remux' if remuxed else 'transcode'}, {size} bytes)")
+        await storage.save_file(target_key, temp_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return target_key, size, None
+
+
+async def _build_hls(content_hash: str, source_path: str, probe: Dict[str, Any]) -> Tuple[str, int, None]:
+    prefix = hls_prefix(content_hash)
+    size = 0
+    with tempfile.TemporaryDirectory() as output_dir:
+        await run_ffmpeg(_hls_args(source_path, output_dir, probe))
+
+        # master playlist は最後に保存し、途中の状態を参照させない
+        names = sorted(os.listdir(output_dir), key=lambda name: name == MASTER_PLAYLIST)
+        for name in names:
+            path = os.path.join(output_dir, name)
+            size += os.path.getsize(path)
+            await storage.save_file(prefix + name, path)
+
+    logger.info(f"Created HLS ladder for {content_hash} ({len(names)} files, {size} bytes)")
+    return prefix + MASTER_PLAYLIST, size, None
+
+
+_BUILDERS = {FASTSTART: _build_faststart, HLS: _build_hls, SPRITE: build_sprite}
+
+
+def _is_stale(rendition: MediaRendition) -> bool:
+    stale_before = datetime.utcnow() - timedelta(seconds=settings.media_job_timeout_seconds)
+    return rendition.status == "processing" and rendition.updated_at <= stale_before
+
+
+def pending_kinds(db: Session, key: str) -> List[str]:
+    """Rendition kinds of a source that are missing, failed or abandoned"""
+    renditions = db.query(MediaRendition).filter(
+        MediaRendition.source_key == key,
+        MediaRendition.version == RENDITION_VERSION
+    ).all()
+    done = {r.kind for r in renditions if r.status == "ready" or (r.status == "processing" and not _is_stale(r))}
+    return [kind for kind in RENDITION_KINDS if kind not in done]
+
+
+def claim_rendition(db: Session, key: str, content_hash: str, kind: str,
+                    version: int = RENDITION_VERSION) -> Optional[MediaRendition]:
+    """Mark a rendition as processing, or return None if it is ready or being built elsewhere"""
+    rendition = db.query(MediaRendition).filter(
+        MediaRendition.source_key == key,
+        MediaRendition.kind == kind,
+        MediaRendition.version == version
+    ).first()
+
+    if rendition is None:
+        rendition = MediaRendition(
+            source_hash=content_hash, source_key=key, kind=kind,
+            version=version, status="processing"
+        )
+        db.add(rendition)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return None
+        return rendition
+
+    # 処理中のまま放置された行（プロセス停止など）はタイムアウト後に引き継ぐ
+    if rendition.status == "ready" or (rendition.status == "processing" and not _is_stale(rendition)):
+        return None
+
+    claimed = db.query(MediaRendition).filter(
+        MediaRendition.id == rendition.id,
+        MediaRendition.updated_at == rendition.updated_at
+    ).update({
+        MediaRendition.status: "processing",
+        MediaRendition.source_hash: content_hash,
+        MediaRendition.error: None,
+        MediaRendition.updated_at: datetime.utcnow()
+    }, synchronize_session=False)
+    db.commit()
+    if not claimed:
+        return None
+    db.refresh(rendition)
+    return rendition
+
+
+def claim_rendition_id(key: str, content_hash: str, kind: str,
+                       version: int = RENDITION_VERSION) -> Optional[str]:
+    """claim_rendition in a session of its own; returns the claimed rendition's id"""
+    db = SessionLocal()
+    try:
+        rendition = claim_rendition(db, key, content_hash, kind, version)
+        return rendition.id if rendition else None
+    finally:
+        db.close()
+
+
+def complete_rendition(rendition_id: str, storage_key: str, size: int,
+                       details: Optional[Dict[str, Any]] = None) -> None:
+    db = SessionLocal()
+    try:
+        db.query(MediaRendition).filter(MediaRendition.id == rendition_id).update({
+            MediaRendition.status: "ready",
+            MediaRendition.storage_key: storage_key,
+            MediaRendition.size: size,
+            MediaRendition.details: json.dumps(details) if details else None,
+            MediaRendition.error: None,
+            MediaRendition.updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def fail_rendition(rendition_id: str, error: str) -> None:
+    db = SessionLocal()
+    try:
+        db.query(MediaRendition).filter(MediaRendition.id == rendition_id).update({
+            MediaRendition.status: "failed",
+            MediaRendition.error: error[:2000],
+            MediaRendition.updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _pending_source(video_path: str) -> Tuple[List[str], Optional[str]]:
+    """Pending rendition kinds and the known content hash of a stored video"""
+    db = SessionLocal()
+    try:
+        return pending_kinds(db, key_for_path(video_path)), media_store.content_hash_for_path(db, video_path)
+    finally:
+        db.close()
+
+
+async def generate_renditions(video_path: Optional[str]) -> None:
+    """Background job: build the playback renditions of a stored video"""
+    if not settings.media_renditions_enabled or not video_path:
+        return
+
+    key = key_for_path(video_path)
+    try:
+        # 作成済みなら元動画の取得（S3ではダウンロード）やハッシュ計算をしない
+        kinds, content_hash = await asyncio.to_thread(_pending_source, video_path)
+        if not kinds:
+            return
+        async with storage.local_path(key) as local_source_path:
+            content_hash = content_hash or await source_hash(key, local_source_path)
+            probe = None
+            for kind in kinds:
+                rendition_id = await asyncio.to_thread(claim_rendition_id, key, content_hash, kind)
+                if rendition_id is None:
+                    continue
+                try:
+                    if probe is None:
+                        probe = await load_probe(video_path, local_source_path)
+                    storage_key, size, details = await _BUILDERS[kind](content_hash, local_source_path, probe)
+                except Exception as e:
+                    logger.error(f"Failed to build {kind} rendition for {key}: {e}")
+                    await asyncio.to_thread(fail_rendition, rendition_id, str(e))
+                    continue
+                await asyncio.to_thread(complete_rendition, rendition_id, storage_key, size, details)
+    except FileNotFoundError:
+        logger.warning(f"Video not found in storage, skipping renditions: {video_path}")
+    except Exception as e:
+        logger.error(f"Rendition job failed for {video_path}: {e}")
+
+
+def _summarize(renditions: List[MediaRendition], keyframe_index: Optional[KeyframeIndex] = None) -> Optional[Dict[str, Any]]:
+    """API representation of a video's renditions (and the manual's step-aligned video, if any)"""
+    aligned = keyframe_index if keyframe_index is not None and keyframe_index.status == "ready" else None
+    if not renditions and aligned is None:
+        return None
+    by_kind = {rendition.kind: rendition for rendition in renditions}
+    statuses = {rendition.status for rendition in by_kind.values()}
+
+    if not by_kind:
+        status = "pending"
+    elif len(by_kind) == len(RENDITION_KINDS) and statuses == {"ready"}:
+        status = "ready"
+    elif "failed" in statuses and not statuses & {"pending", "processing"}:
+        status = "failed"
+    else:
+        status = "processing"
+
+    def url(kind: str) -> Optional[str]:
+        rendition = by_kind.get(kind)
+        if rendition and rendition.status == "ready" and rendition.storage_key:
+            return media_url(rendition.storage_key)
+        return None
+
+    return {
+        "status": status,
+        "faststart_url": url(FASTSTART),
+        "hls_url": url(HLS),
+        "step_aligned_url": media_url(aligned.storage_key) if aligned else None,
+        "keyframes": json.loads(aligned.keyframes or "[]") if aligned else None,
+    }
+
+
+def sprite_for_key(db: Session, key: str) -> Optional[Dict[str, Any]]:
+    """Sprite sheet VTT URL and tile layout of a source, if built"""
+    rendition = db.query(MediaRendition).filter(
+        MediaRendition.source_key == key,
+        MediaRendition.kind == SPRITE,
+        MediaRendition.version == RENDITION_VERSION,
+        MediaRendition.status == "ready"
+    ).first()
+    if not rendition or not rendition.storage_key:
+        return None
+    return {"vtt_url": media_url(rendition.storage_key), **json.loads(rendition.details or "{}")}
+
+
+def attach_renditions(db: Session, manuals: Iterable[Any]) -> None:
+    """Set `renditions` on each manual (one query per table for the whole batch)"""
+    manuals = list(manuals)
+    keys = {manual.video_file_path: key_for_path(manual.video_file_path) for manual in manuals if manual.video_file_path}
+
+    renditions_by_key: Dict[str, List[MediaRendition]] = {}
+    indexes_by_manual: Dict[str, KeyframeIndex] = {}
+    if keys:
+        renditions = db.query(MediaRendition).filter(
+            MediaRendition.version == RENDITION_VERSION,
+            MediaRendition.source_key.in_(set(keys.values()))
+        ).all()
+        for rendition in renditions:
+            renditions_by_key.setdefault(rendition.source_key, []).append(rendition)
+
+        manual_ids = [manual.id for manual in manuals if manual.video_file_path]
+        for index in db.query(KeyframeIndex).filter(KeyframeIndex.manual_id.in_(manual_ids)).all():
+            indexes_by_manual[index.manual_id] = index
+
+    for manual in manuals:
+        key = keys.get(manual.video_file_path)
+        if not key:
+            manual.renditions = None
+            continue
+        index = indexes_by_manual.get(manual.id)
+        # 動画が差し替えられた後の古いインデックスは返さない
+        if index is not None and index.source_key != key:
+            index = None
+        manual.renditions = _summarize(renditions_by_key.get(key, []), index)
@@ -0,0 +1,206 @@
+"""
+Manual status events
+
+Open editors subscribe to `GET /api/manuals/{id}/events` (server-sent events)
+instead of polling `/status`. Status changes are published with PostgreSQL
+NOTIFY on the `manual_status` channel inside the transaction that makes the
+change, so subscribers on every API replica hear about changes made by the
+generation workers as soon as they commit.
+
+Each API process keeps one LISTEN connection (read with `add_reader`, no
+thread) and one in-process broker. On a notification the broker loads the
+status snapshot once and fans it out to every subscriber of that manual, so
+an idle editor costs no database queries and a change costs one query per
+replica, not one per subscriber.
+
+Other databases (SQLite in development) have no LISTEN/NOTIFY; there the
+broker re-checks subscribed manuals every `status_events_fallback_poll_seconds`.
+"""
+import json
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal, engine
+from models import GenerationJob, Manual
+from services.generation_scheduler import PRIORITY_NAMES, queue_position
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "manual_status"
+
+
+def notify_manual(db: Session, manual_id: str) -> None:
+    """Publish a status change for a manual when the caller's transaction commits"""
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    db.execute(text("SELECT pg_notify(:channel, :payload)"),
+               {"channel": CHANNEL, "payload": json.dumps({"manual_id": manual_id})})
+
+
+def load_status(db: Session, manual_id: str) -> Optional[Dict[str, Any]]:
+    """Status snapshot of a manual as returned by /status and the event stream"""
+    manual = db.query(Manual).filter(Manual.id == manual_id).first()
+    if not manual:
+        return None
+    job = db.query(GenerationJob).filter(
+        GenerationJob.manual_id == manual_id
+    ).order_by(GenerationJob.created_at.desc()).first()
+
+    return {
+        "manual_id": manual_id,
+        "status": manual.status,
+        "title": manual.title,
+        "has_content": bool(manual.content),
+        "video_file_path": manual.video_file_path,
+        "job": {
+            "id": job.id,
+            "status": job.status,
+            "attempts": job.attempts,
+            "max_attempts": job.max_attempts,
+            "error": job.error,
+            "priority": PRIORITY_NAMES.get(job.priority),
+            "queue_position": queue_position(db, job),
+            # ストリーミング生成中に完成したステップ（エディタが途中経過を表示する）
+            "partial_steps": json.loads(job.partial_steps) if job.partial_steps and job.status == "running" else []
+        } if job else None
+    }
+
+
+def _load_status(manual_id: str) -> Optional[Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        return load_status(db, manual_id)
+    finally:
+        db.close()
+
+
+class StatusBroker:
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._task: Optional[asyncio.Task] = None
+        self._dirty: Set[str] = set()
+        self._changed: Optional[asyncio.Event] = None
+
+    def subscribe(self, manual_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subscribers[manual_id].add(queue)
+        self._ensure_running()
+        return queue
+
+    def unsubscribe(self, manual_id: str, queue: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(manual_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[manual_id]
+
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._changed = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _mark(self, manual_id: str) -> None:
+        if manual_id in self._subscribers:
+            self._dirty.add(manual_id)
+            self._changed.set()
+
+    async def _run(self) -> None:
+        if engine.dialect.name == "postgresql":
+            listener = asyncio.create_task(self._listen())
+        else:
+            listener = asyncio.create_task(self._poll())
+        try:
+            while True:
+                await self._changed.wait()
+                self._changed.clear()
+                dirty, self._dirty = self._dirty, set()
+                for manual_id in dirty:
+                    await self._publish(manual_id)
+        finally:
+            listener.cancel()
+            await asyncio.gather(listener, return_exceptions=True)
+
+    async def _publish(self, manual_id: str) -> None:
+        if manual_id not in self._subscribers:
+            return
+        try:
+            snapshot = await asyncio.to_thread(_load_status, manual_id)
+        except Exception as e:
+            logger.error(f"Failed to load status of manual {manual_id}: {e}")
+            return
+        for queue in list(self._subscribers.get(manual_id, ())):
+            # 受信側が遅れている場合は古いスナップショットを捨てて最新だけを渡す
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+
+    async def _listen(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            connection = None
+            try:
+                # プールから切り離した専用の接続で LISTEN する
+                pooled = await asyncio.to_thread(engine.raw_connection)
+                pooled.detach()
+                connection = pooled.driver_connection
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL}")
+                logger.info(f"Listening for {CHANNEL} notifications")
+
+                # 再接続までに起きた変更は通知されないので、購読中のマニュアルを再読み込みする
+                for manual_id in list(self._subscribers):
+                    self._mark(manual_id)
+
+                lost = loop.create_future()
+
+                def on_readable() -> None:
+                    try:
+                        connection.poll()
+                    except Exception as e:
+                        if not lost.done():
+                            lost.set_exception(e)
+                        return
+                    while connection.notifies:
+                        notification = connection.notifies.pop(0)
+                        try:
+                            self._mark(json.loads(notification.payload)["manual_id"])
+                        except (ValueError, KeyError):
+                            logger.warning(f"Ignoring malformed {CHANNEL} payload: {notification.payload!r}")
+
+                loop.add_reader(connection.fileno(), on_readable)
+                try:
+                    await lost
+                finally:
+                    loop.remove_reader(connection.fileno())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"{CHANNEL} listener disconnected, reconnecting: {e}")
+                await asyncio.sleep(settings.status_events_reconnect_seconds)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(settings.status_events_fallback_poll_seconds)
+            for manual_id in list(self._subscribers):
+                self._mark(manual_id)
+
+
+# Create global instance
+status_broker = StatusBroker()
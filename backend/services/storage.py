@@ -0,0 +1,319 @@
+"""
+Pluggable storage backends for uploaded media
+
+Media is addressed by a storage key (e.g. `<sha256>.mp4`). Manuals keep the
+historical `<upload_folder>/<key>` path format, so `key_for_path` maps those
+paths to keys. `settings.storage_backend` selects the driver:
+
+- "local": files under `settings.upload_folder`
+- "s3":    an S3-compatible bucket (AWS S3, MinIO, ...)
+"""
+import os
+import shutil
+import asyncio
+import logging
+import tempfile
+import itertools
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Iterator, List, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_SIZE = 256 * 1024
+
+
+@dataclass
+class StoredObject:
+    key: str
+    size: int
+    modified_at: datetime
+
+
+def key_for_path(path: str) -> str:
+    """Storage key for a media path stored on a manual"""
+    upload_root = os.path.normpath(settings.upload_folder)
+    normalized = os.path.normpath(path)
+    if normalized.startswith(upload_root + os.sep):
+        return os.path.relpath(normalized, upload_root).replace(os.sep, "/")
+    return os.path.basename(normalized)
+
+
+def path_for_key(key: str) -> str:
+    """Media path (as stored on manuals) for a storage key"""
+    return os.path.join(settings.upload_folder, key)
+
+
+def is_public_key(key: str) -> bool:
+    """Keys that may be served over HTTP (hides temp files and traversal attempts)"""
+    parts = key.split("/")
+    return bool(key) and all(part and not part.startswith(".") for part in parts)
+
+
+class StorageBackend(ABC):
+    """Interface shared by all storage drivers"""
+
+    @abstractmethod
+    async def save_file(self, key: str, local_path: str) -> None:
+        """Store a local file under `key`, consuming (moving or deleting) the source"""
+
+    @abstractmethod
+    async def save_stream(self, key: str, chunks: AsyncIterator[bytes]) -> int:
+        """Store a byte stream under `key` and return the number of bytes written"""
+
+    @abstractmethod
+    async def read_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        """Yield bytes `start`..`end` (inclusive) of the object"""
+
+    @abstractmethod
+    async def size(self, key: str) -> Optional[int]:
+        """Object size in bytes, or None if it does not exist"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """Delete the object if it exists"""
+
+    @abstractmethod
+    def iter_list(self, prefix: str = "", batch_size: int = 1000) -> AsyncIterator[List[StoredObject]]:
+        """Yield stored objects under `prefix` in batches, without loading the full listing"""
+
+    async def list(self, prefix: str = "") -> List[StoredObject]:
+        """List stored objects under `prefix`"""
+        objects = []
+        async for batch in self.iter_list(prefix):
+            objects.extend(batch)
+        return objects
+
+    @abstractmethod
+    def local_path(self, key: str):
+        """Async context manager yielding a local filesystem path for the object"""
+
+    async def exists(self, key: str) -> bool:
+        return await self.size(key) is not None
+
+
+class LocalStorage(StorageBackend):
+    """Stores media on the local filesystem under the upload folder"""
+
+    @property
+    def root(self) -> str:
+        return settings.upload_folder
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    async def save_file(self, key: str, local_path: str) -> None:
+        dest = self._path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        await asyncio.to_thread(shutil.move, local_path, dest)
+
+    async def save_stream(self, key: str, chunks: AsyncIterator[bytes]) -> int:
+        import aiofiles
+
+        dest = self._path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        temp_path = f"{dest}.part"
+        written = 0
+        async with aiofiles.open(temp_path, "wb") as f:
+            async for chunk in chunks:
+                written += len(chunk)
+                await f.write(chunk)
+        os.replace(temp_path, dest)
+        return written
+
+    async def read_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        import aiofiles
+
+        remaining = end - start + 1
+        async with aiofiles.open(self._path(key), "rb") as f:
+            await f.seek(start)
+            while remaining > 0:
+                chunk = await f.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    async def size(self, key: str) -> Optional[int]:
+        path = self._path(key)
+        return os.path.getsize(path) if os.path.isfile(path) else None
+
+    async def delete(self, key: str) -> None:
+        path = self._path(key)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def _walk(self, prefix: str) -> Iterator[StoredObject]:
+        # プレフィックスのディレクトリ部分から走査を始める
+        start = os.path.join(self.root, os.path.dirname(prefix))
+        if not os.path.isdir(start):
+            return
+        for dirpath, dirnames, filenames in os.walk(start):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                key = os.path.relpath(full_path, self.root).replace(os.sep, "/")
+                if not key.startswith(prefix) or not is_public_key(key):
+                    continue
+                try:
+                    stat = os.stat(full_path)
+                except FileNotFoundError:
+                    continue
+                yield StoredObject(key, stat.st_size, datetime.utcfromtimestamp(stat.st_mtime))
+
+    async def iter_list(self, prefix: str = "", batch_size: int = 1000) -> AsyncIterator[List[StoredObject]]:
+        walker = self._walk(prefix)
+        while True:
+            batch = await asyncio.to_thread(lambda: list(itertools.islice(walker, batch_size)))
+            if not batch:
+                break
+            yield batch
+
+    @asynccontextmanager
+    async def local_path(self, key: str):
+        path = self._path(key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Media not found in storage: {key}")
+        yield path
+
+
+class S3Storage(StorageBackend):
+    """Stores media in an S3-compatible bucket using multipart uploads and ranged reads"""
+
+    def __init__(self):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = settings.s3_bucket
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=settings.s3_endpoint_url,
+            region_name=settings.s3_region,
+            aws_access_key_id=settings.s3_access_key_id,
+            aws_secret_access_key=settings.s3_secret_access_key,
+        )
+        self.part_size = settings.s3_multipart_chunk_size
+        self.transfer_config = TransferConfig(
+            multipart_threshold=self.part_size,
+            multipart_chunksize=self.part_size,
+        )
+
+    async def save_file(self, key: str, local_path: str) -> None:
+        await asyncio.to_thread(
+            self.client.upload_file, local_path, self.bucket, key, Config=self.transfer_config
+        )
+        os.remove(local_path)
+
+    async def save_stream(self, key: str, chunks: AsyncIterator[bytes]) -> int:
+        upload = await asyncio.to_thread(self.client.create_multipart_upload, Bucket=self.bucket, Key=key)
+        upload_id = upload["UploadId"]
+        parts = []
+        buffer = bytearray()
+        written = 0
+
+        async def flush() -> None:
+            part_number = len(parts) + 1
+            response = await asyncio.to_thread(
+                self.client.upload_part,
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                PartNumber=part_number, Body=bytes(buffer)
+            )
+            parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+            buffer.clear()
+
+        try:
+            async for chunk in chunks:
+                written += len(chunk)
+                buffer.extend(chunk)
+                if len(buffer) >= self.part_size:
+                    await flush()
+            if buffer or not parts:
+                await flush()
+            await asyncio.to_thread(
+                self.client.complete_multipart_upload,
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                MultipartUpload={"Parts": parts}
+            )
+        except Exception:
+            await asyncio.to_thread(
+                self.client.abort_multipart_upload, Bucket=self.bucket, Key=key, UploadId=upload_id
+            )
+            raise
+        return written
+
+    async def read_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        response = await asyncio.to_thread(
+            self.client.get_object, Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end}"
+        )
+        body = response["Body"]
+        try:
+            while True:
+                chunk = await asyncio.to_thread(body.read, STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    async def size(self, key: str) -> Optional[int]:
+        from botocore.exceptions import ClientError
+
+        try:
+            response = await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return response["ContentLength"]
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=key)
+
+    async def iter_list(self, prefix: str = "", batch_size: int = 1000) -> AsyncIterator[List[StoredObject]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        pages = iter(paginator.paginate(
+            Bucket=self.bucket, Prefix=prefix, PaginationConfig={"PageSize": batch_size}
+        ))
+        while True:
+            page = await asyncio.to_thread(next, pages, None)
+            if page is None:
+                break
+            batch = [
+                StoredObject(item["Key"], item["Size"], item["LastModified"].replace(tzinfo=None))
+                for item in page.get("Contents", [])
+            ]
+            if batch:
+                yield batch
+
+    @asynccontextmanager
+    async def local_path(self, key: str):
+        # ffmpeg や Gemini のアップロードはローカルファイルを必要とするため一時的にダウンロードする
+        suffix = os.path.splitext(key)[1]
+        fd, temp_path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        try:
+            await asyncio.to_thread(
+                self.client.download_file, self.bucket, key, temp_path, Config=self.transfer_config
+            )
+            yield temp_path
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def create_storage() -> StorageBackend:
+    """Create the storage driver selected by settings.storage_backend"""
+    if settings.storage_backend == "s3":
+        logger.info(f"Using S3 storage backend (bucket: {settings.s3_bucket})")
+        return S3Storage()
+    if settings.storage_backend != "local":
+        raise ValueError(f"Unknown storage backend: {settings.storage_backend}")
+    return LocalStorage()
+
+
+# Create global instance
+storage = create_storage()
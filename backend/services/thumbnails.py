@@ -0,0 +1,223 @@
+"""
+Step thumbnails and scrubbing sprite sheets
+
+- Step thumbnails: one JPEG per step start time, cached in storage under a
+  key derived from (video content hash, timestamp). Editing steps only
+  extracts frames for timestamps that have no cached thumbnail yet.
+- Sprite sheets: fixed-interval frames tiled into JPEG sheets plus a WebVTT
+  index (`#xywh=` cues) for scrubbing previews. Built once per video by the
+  rendition job (see services.renditions).
+
+ffmpeg runs through the bounded runner in services.ffmpeg.
+"""
+import os
+import math
+import asyncio
+import logging
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import Manual, MediaRendition
+from services import media_store
+from services.ffmpeg import FFmpegError, run_ffmpeg
+from services.keyframes import manual_step_times
+from services.media_probe import load_probe
+from services.storage import storage, key_for_path
+from services.video_proxy import content_hash_from_key, source_hash
+
+logger = logging.getLogger(__name__)
+
+# Bump when the output format changes so thumbnails are regenerated
+THUMBNAIL_VERSION = 1
+
+SPRITE_VTT = "sprites.vtt"
+
+
+def thumbnail_key(content_hash: str, seconds: float) -> str:
+    """Storage key of the thumbnail at `seconds` of a video"""
+    return f"derived/thumbs/{content_hash}/{int(round(seconds * 1000)):09d}_v{THUMBNAIL_VERSION}.jpg"
+
+
+def sprite_prefix(content_hash: str) -> str:
+    return f"derived/sprites/{content_hash}_v{THUMBNAIL_VERSION}/"
+
+
+def video_content_hash(db: Session, video_path: str) -> Optional[str]:
+    """Content hash of a stored video if it is known without reading the file"""
+    key = key_for_path(video_path)
+    known = media_store.content_hash_for_path(db, video_path) or content_hash_from_key(key)
+    if known:
+        return known
+    # 旧形式のファイル名でもレンディション作成時にハッシュが記録されている
+    rendition = db.query(MediaRendition.source_hash).filter(MediaRendition.source_key == key).first()
+    return rendition.source_hash if rendition else None
+
+
+def _duration(probe: Dict[str, Any]) -> Optional[float]:
+    try:
+        return float(probe.get("format", {}).get("duration"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _video_size(probe: Dict[str, Any]) -> Tuple[int, int]:
+    for stream in probe.get("streams", []):
+        if stream.get("codec_type") == "video" and stream.get("width") and stream.get("height"):
+            return int(stream["width"]), int(stream["height"])
+    return 16, 9
+
+
+async def _extract_frame(source_path: str, seconds: float, target_key: str) -> bool:
+    fd, temp_path = tempfile.mkstemp(suffix=".jpg")
+    os.close(fd)
+    try:
+        # -ss を入力側に置くと直前のキーフレームからのデコードだけで済む
+        await run_ffmpeg([
+            "-ss", f"{seconds:.3f}",
+            "-i", source_path,
+            "-frames:v", "1",
+            "-vf", f"scale={settings.thumbnail_width}:-2",
+            "-q:v", "4",
+            "-an",
+            temp_path,
+        ])
+        if os.path.getsize(temp_path) == 0:
+            logger.warning(f"No frame at {seconds}s for thumbnail {target_key}")
+            return False
+        await storage.save_file(target_key, temp_path)
+        return True
+    except FFmpegError as e:
+        logger.warning(f"Failed to extract thumbnail at {seconds}s: {e}")
+        return False
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+async def _missing_times(content_hash: str, times: List[float]) -> List[float]:
+    exists = await asyncio.gather(*[storage.exists(thumbnail_key(content_hash, t)) for t in times])
+    return [t for t, found in zip(times, exists) if not found]
+
+
+def _thumbnail_source(manual_id: str) -> Optional[Tuple[str, List[float], Optional[str]]]:
+    """(video path, step times, known content hash) of a manual, or None if it has no steps"""
+    db = SessionLocal()
+    try:
+        manual = db.query(Manual).filter(Manual.id == manual_id).first()
+        if not manual or not manual.video_file_path:
+            return None
+        times = manual_step_times(manual)
+        if not times:
+            return None
+        return manual.video_file_path, times, video_content_hash(db, manual.video_file_path)
+    finally:
+        db.close()
+
+
+async def generate_step_thumbnails(manual_id: str) -> None:
+    """Background job: extract thumbnails for step times that are not cached yet"""
+    try:
+        source = await asyncio.to_thread(_thumbnail_source, manual_id)
+        if source is None:
+            return
+        video_path, times, content_hash = source
+        if content_hash and not await _missing_times(content_hash, times):
+            return
+
+        key = key_for_path(video_path)
+        async with storage.local_path(key) as local_source_path:
+            content_hash = content_hash or await source_hash(key, local_source_path)
+            missing = await _missing_times(content_hash, times)
+            if not missing:
+                return
+
+            duration = _duration(await load_probe(video_path, local_source_path))
+
+            def seek_time(t: float) -> float:
+                # 動画末尾以降を指すタイムスタンプは最終フレーム付近を使う
+                return max(duration - 0.1, 0) if duration and t >= duration else t
+
+            results = await asyncio.gather(*[
+                _extract_frame(local_source_path, seek_time(t), thumbnail_key(content_hash, t)) for t in missing
+            ])
+        logger.info(f"Extracted {sum(results)}/{len(missing)} step thumbnails for manual {manual_id}")
+    except FileNotFoundError:
+        logger.warning(f"Video not found in storage, skipping thumbnails for manual {manual_id}")
+    except Exception as e:
+        logger.error(f"Thumbnail job failed for manual {manual_id}: {e}")
+
+
+async def step_thumbnail_keys(content_hash: str, times: List[float]) -> Dict[float, Optional[str]]:
+    """Cached thumbnail key per step time (None while not generated)"""
+    missing = set(await _missing_times(content_hash, times))
+    return {t: None if t in missing else thumbnail_key(content_hash, t) for t in times}
+
+
+def _sprite_vtt(duration: float, interval: int, tile_width: int, tile_height: int,
+                columns: int, rows: int) -> str:
+    lines = ["WEBVTT", ""]
+    per_sheet = columns * rows
+    count = max(math.ceil(duration / interval), 1)
+    for i in range(count):
+        sheet, position = divmod(i, per_sheet)
+        row, column = divmod(position, columns)
+        start = i * interval
+        end = min((i + 1) * interval, duration)
+        lines.append(f"{format_vtt_time(start)} --> {format_vtt_time(end)}")
+        lines.append(
+            f"sprite_{sheet + 1:03d}.jpg#xywh={column * tile_width},{row * tile_height},{tile_width},{tile_height}"
+        )
+        lines.append("")
+    return "\n".join(lines)
+
+
+def format_vtt_time(seconds: float) -> str:
+    hours, remainder = divmod(seconds, 3600)
+    minutes, secs = divmod(remainder, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{secs:06.3f}"
+
+
+async def build_sprite(content_hash: str, source_path: str, probe: Dict[str, Any]) -> Tuple[str, int, Dict[str, Any]]:
+    """Build the sprite sheets and WebVTT index of a video (a rendition builder)"""
+    prefix = sprite_prefix(content_hash)
+    interval = settings.sprite_interval_seconds
+    columns, rows = settings.sprite_columns, settings.sprite_rows
+    width, height = _video_size(probe)
+    tile_width = settings.sprite_tile_width
+    tile_height = max(int(round(tile_width * height / width / 2)) * 2, 2)
+    duration = _duration(probe) or 0.0
+
+    size = 0
+    with tempfile.TemporaryDirectory() as output_dir:
+        await run_ffmpeg([
+            "-i", source_path,
+            "-an",
+            "-vf", f"fps=1/{interval},scale={tile_width}:{tile_height},tile={columns}x{rows}",
+            "-q:v", "5",
+            os.path.join(output_dir, "sprite_%03d.jpg"),
+        ])
+        with open(os.path.join(output_dir, SPRITE_VTT), "w") as f:
+            f.write(_sprite_vtt(duration, interval, tile_width, tile_height, columns, rows))
+
+        # VTT は最後に保存し、途中の状態を参照させない
+        names = sorted(os.listdir(output_dir), key=lambda name: name == SPRITE_VTT)
+        for name in names:
+            path = os.path.join(output_dir, name)
+            size += os.path.getsize(path)
+            await storage.save_file(prefix + name, path)
+
+    details = {
+        "interval": interval,
+        "tile_width": tile_width,
+        "tile_height": tile_height,
+        "columns": columns,
+        "rows": rows,
+        "sheets": len(names) - 1,
+        "duration": duration,
+    }
+    logger.info(f"Created sprite sheets for {content_hash} ({details['sheets']} sheets)")
+    return prefix + SPRITE_VTT, size, details
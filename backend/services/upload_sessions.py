@@ -0,0 +1,96 @@
+"""
+Resumable upload session helpers (tus-style)
+
+Partial uploads are appended to a part file under
+`settings.upload_session_folder` on the replica that receives the chunk,
+so every request of a session must reach a replica that sees that folder.
+With the local storage backend that is already the case (the upload folder
+is shared or there is one replica). With S3 the API is expected to run as
+several replicas, so sessions are only accepted once the deployment
+declares sticky routing by session ID (or a shared session folder) with
+`UPLOAD_SESSION_STICKY_ROUTING`.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import UploadSession
+
+logger = logging.getLogger(__name__)
+
+
+def session_part_path(session_id: str) -> str:
+    """Path of the partially uploaded file for a session"""
+    return os.path.join(settings.upload_session_folder, f"{session_id}.part")
+
+
+def sessions_available() -> bool:
+    """True if every chunk of a session is guaranteed to reach the same part file"""
+    return settings.storage_backend == "local" or settings.upload_session_sticky_routing
+
+
+def session_expiry() -> datetime:
+    """Expiry for a session that was just created or written to"""
+    return datetime.utcnow() + timedelta(hours=settings.upload_session_ttl_hours)
+
+
+def current_part_size(session_id: str) -> int:
+    """Bytes actually stored on disk for a session (the authoritative offset)"""
+    path = session_part_path(session_id)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def cleanup_expired_upload_sessions(db: Session) -> int:
+    """
+    Delete abandoned upload sessions and their partial files
+
+    Removes sessions whose expiry has passed, plus any stray part files
+    without a session row that are older than the session TTL.
+
+    Returns:
+        Number of sessions removed
+    """
+    now = datetime.utcnow()
+    expired = db.query(UploadSession).filter(UploadSession.expires_at < now).all()
+    for upload_session in expired:
+        part_path = session_part_path(upload_session.id)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        db.delete(upload_session)
+    db.commit()
+
+    if os.path.isdir(settings.upload_session_folder):
+        cutoff = (now - timedelta(hours=settings.upload_session_ttl_hours)).timestamp()
+        for entry in os.scandir(settings.upload_session_folder):
+            if not entry.name.endswith(".part") or entry.stat().st_mtime >= cutoff:
+                continue
+            session_id = entry.name[: -len(".part")]
+            if db.query(UploadSession.id).filter(UploadSession.id == session_id).first() is None:
+                os.remove(entry.path)
+
+    if expired:
+        logger.info(f"Removed {len(expired)} expired upload sessions")
+    return len(expired)
+
+
+def _cleanup_once() -> None:
+    db = SessionLocal()
+    try:
+        cleanup_expired_upload_sessions(db)
+    finally:
+        db.close()
+
+
+async def upload_session_gc_loop() -> None:
+    """Periodically garbage-collect abandoned upload sessions"""
+    while True:
+        try:
+            await asyncio.to_thread(_cleanup_once)
+        except Exception as e:
+            logger.error(f"Upload session cleanup failed: {e}")
+        await asyncio.sleep(settings.upload_session_gc_interval_seconds)
@@ -0,0 +1,109 @@
+"""
+Gemini-optimized video proxies
+
+Screen recordings are transcoded into a small proxy (reduced resolution,
+low frame rate, no audio by default) before they are sent to Gemini. The
+proxy keeps the source timeline, so timestamps Gemini reports for the proxy
+are valid for the original video. Proxies are cached in storage by the
+source content hash.
+"""
+import os
+import re
+import asyncio
+import logging
+import tempfile
+from typing import Optional
+
+from config import settings
+from services.ffmpeg import run_ffmpeg
+from services.media_store import hash_file
+from services.storage import storage
+from utils.keyed_lock import KeyedLock
+
+logger = logging.getLogger(__name__)
+
+# Bump when the encoding parameters change so stale proxies are not reused
+PROXY_VERSION = 1
+
+_SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+_locks = KeyedLock()
+
+
+def content_hash_from_key(key: str) -> Optional[str]:
+    """SHA-256 encoded in a content-addressed storage key, if any"""
+    stem = os.path.splitext(os.path.basename(key))[0]
+    return stem if _SHA256_PATTERN.match(stem) else None
+
+
+async def source_hash(key: str, local_path: str) -> str:
+    """Content hash of a stored video (hashes legacy files that predate the store)"""
+    return content_hash_from_key(key) or await asyncio.to_thread(hash_file, local_path)
+
+
+def proxy_key(content_hash: str) -> str:
+    """Storage key of the Gemini proxy for a source hash and the current settings"""
+    variant = (
+        f"h{settings.gemini_proxy_max_height}"
+        f"_f{settings.gemini_proxy_fps}"
+        f"_q{settings.gemini_proxy_crf}"
+        f"{'_a' if settings.gemini_proxy_keep_audio else ''}"
+    )
+    return f"derived/proxy/{content_hash}_v{PROXY_VERSION}_{variant}.mp4"
+
+
+def _proxy_args(source_path: str, output_path: str) -> list:
+    # fps フィルタはフレームを間引くだけで元のタイムスタンプを保つ
+    video_filter = (
+        f"scale=-2:'min({settings.gemini_proxy_max_height},ih)':flags=bicubic,"
+        f"fps={settings.gemini_proxy_fps}"
+    )
+    args = [
+        "-i", source_path,
+        "-map", "0:v:0",
+        "-vf", video_filter,
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-crf", str(settings.gemini_proxy_crf),
+        "-pix_fmt", "yuv420p",
+        "-map_metadata", "-1",
+    ]
+    if settings.gemini_proxy_keep_audio:
+        args += ["-map", "0:a:0?", "-c:a", "aac", "-ac", "1", "-b:a", "32k"]
+    else:
+        args += ["-an"]
+    args += ["-movflags", "+faststart", output_path]
+    return args
+
+
+async def ensure_gemini_proxy(key: str, local_source_path: str) -> str:
+    """
+    Return the storage key of the Gemini proxy for a stored video, creating it if needed
+
+    Args:
+        key: Storage key of the source video
+        local_source_path: Local path of the source (from storage.local_path)
+    """
+    content_hash = await source_hash(key, local_source_path)
+    target_key = proxy_key(content_hash)
+
+    async with _locks.hold(target_key):
+        if await storage.exists(target_key):
+            logger.info(f"Reusing cached Gemini proxy: {target_key}")
+            return target_key
+
+        fd, temp_path = tempfile.mkstemp(suffix=".mp4")
+        os.close(fd)
+        try:
+            await run_ffmpeg(_proxy_args(local_source_path, temp_path))
+            source_size = os.path.getsize(local_source_path)
+            proxy_size = os.path.getsize(temp_path)
+            logger.info(
+                f"Created Gemini proxy for {key}: {source_size} -> {proxy_size} bytes "
+                f"({proxy_size / max(source_size, 1):.1%})"
+            )
+            await storage.save_file(target_key, temp_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    return target_key
@@ -0,0 +1,189 @@
+"""
+Precomputed waveform peaks
+
+Drawing a waveform in the editor would otherwise mean downloading and
+decoding the whole narration. A background job decodes each audio file once
+(mono PCM at `waveform_sample_rate`), computes min/max peaks at
+`waveform_samples_per_pixel` and derives coarser zoom levels by merging
+neighbouring pairs. Every level is stored as a separate file in the
+audiowaveform `.dat` (version 1) format, which waveform-data.js / peaks.js
+read directly:
+
+    int32 version (1), uint32 flags (0: int16, 1: int8), int32 sample_rate,
+    int32 samples_per_pixel, uint32 length, then `length` (min, max) pairs
+
+Peaks are tracked as a "waveform" media rendition of the audio's storage key.
+"""
+import os
+import sys
+import asyncio
+import struct
+import logging
+import tempfile
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import MediaRendition
+from services import media_store
+from services.ffmpeg import run_ffmpeg
+from services.renditions import claim_rendition_id, complete_rendition, fail_rendition
+from services.storage import storage, key_for_path
+from services.video_proxy import source_hash
+
+logger = logging.getLogger(__name__)
+
+# Bump when the peak computation or file format changes so peaks are rebuilt
+WAVEFORM_VERSION = 1
+
+WAVEFORM = "waveform"
+
+DAT_HEADER = struct.Struct("<iIiiI")
+
+# Buckets read from the decoded PCM per iteration
+READ_BUCKETS = 4096
+
+
+def waveform_prefix(content_hash: str) -> str:
+    return f"derived/waveform/{content_hash}_v{WAVEFORM_VERSION}/"
+
+
+def level_key(prefix: str, samples_per_pixel: int) -> str:
+    return f"{prefix}{samples_per_pixel}.dat"
+
+
+def _base_peaks(pcm_path: str, samples_per_pixel: int) -> Tuple[array, int]:
+    """Interleaved (min, max) int16 peaks of raw s16le PCM and the number of samples"""
+    peaks = array("h")
+    total = 0
+    chunk_bytes = samples_per_pixel * READ_BUCKETS * 2
+    with open(pcm_path, "rb") as f:
+        for data in iter(lambda: f.read(chunk_bytes), b""):
+            samples = array("h")
+            samples.frombytes(data[:len(data) - len(data) % 2])
+            if sys.byteorder == "big":
+                samples.byteswap()
+            total += len(samples)
+            for start in range(0, len(samples), samples_per_pixel):
+                bucket = samples[start:start + samples_per_pixel]
+                peaks.append(min(bucket))
+                peaks.append(max(bucket))
+    return peaks, total
+
+
+def merge_peaks(peaks: array) -> array:
+    """Halve the resolution of interleaved (min, max) peaks"""
+    merged = array(peaks.typecode)
+    for i in range(0, len(peaks), 4):
+        pair = peaks[i:i + 4]
+        merged.append(min(pair[0::2]))
+        merged.append(max(pair[1::2]))
+    return merged
+
+
+def encode_dat(peaks: array, sample_rate: int, samples_per_pixel: int, bits: int) -> bytes:
+    """Serialize int16 peaks into the audiowaveform .dat format at 8 or 16 bits"""
+    if bits == 8:
+        data = array("b", [value >> 8 for value in peaks])
+    else:
+        data = array("h", peaks)
+    if sys.byteorder == "big":
+        data.byteswap()
+    header = DAT_HEADER.pack(1, 1 if bits == 8 else 0, sample_rate, samples_per_pixel, len(peaks) // 2)
+    return header + data.tobytes()
+
+
+async def _build(content_hash: str, source_path: str) -> Tuple[str, int, Dict[str, Any]]:
+    prefix = waveform_prefix(content_hash)
+    sample_rate = settings.waveform_sample_rate
+    bits = settings.waveform_bits
+    samples_per_pixel = settings.waveform_samples_per_pixel
+
+    size = 0
+    levels: List[int] = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        pcm_path = os.path.join(work_dir, "audio.pcm")
+        await run_ffmpeg([
+            "-i", source_path,
+            "-vn",
+            "-ac", "1",
+            "-ar", str(sample_rate),
+            "-f", "s16le", "-c:a", "pcm_s16le",
+            pcm_path,
+        ])
+        peaks, total_samples = await asyncio.to_thread(_base_peaks, pcm_path, samples_per_pixel)
+        os.remove(pcm_path)
+
+        for level in range(settings.waveform_zoom_levels):
+            if level and len(peaks) <= 2:
+                break
+            path = os.path.join(work_dir, f"{samples_per_pixel}.dat")
+            data = await asyncio.to_thread(encode_dat, peaks, sample_rate, samples_per_pixel, bits)
+            with open(path, "wb") as f:
+                f.write(data)
+            size += os.path.getsize(path)
+            await storage.save_file(level_key(prefix, samples_per_pixel), path)
+            levels.append(samples_per_pixel)
+            peaks = await asyncio.to_thread(merge_peaks, peaks)
+            samples_per_pixel *= 2
+
+    details = {
+        "sample_rate": sample_rate,
+        "bits": bits,
+        # 最も詳細なレベルから順に並ぶ
+        "samples_per_pixel": levels,
+        "duration": total_samples / sample_rate,
+    }
+    return prefix, size, details
+
+
+def get_waveform(db: Session, audio_path: str) -> Optional[MediaRendition]:
+    return db.query(MediaRendition).filter(
+        MediaRendition.source_key == key_for_path(audio_path),
+        MediaRendition.kind == WAVEFORM,
+        MediaRendition.version == WAVEFORM_VERSION
+    ).first()
+
+
+def _waveform_source(audio_path: str) -> Tuple[bool, Optional[str]]:
+    """(peaks already ready, known content hash) of an audio file"""
+    db = SessionLocal()
+    try:
+        waveform = get_waveform(db, audio_path)
+        if waveform and waveform.status == "ready":
+            return True, None
+        return False, media_store.content_hash_for_path(db, audio_path)
+    finally:
+        db.close()
+
+
+async def generate_waveform(audio_path: Optional[str]) -> None:
+    """Background job: compute and store the waveform peaks of an audio file"""
+    if not audio_path:
+        return
+
+    key = key_for_path(audio_path)
+    try:
+        ready, content_hash = await asyncio.to_thread(_waveform_source, audio_path)
+        if ready:
+            return
+        async with storage.local_path(key) as local_source_path:
+            content_hash = content_hash or await source_hash(key, local_source_path)
+            rendition_id = await asyncio.to_thread(claim_rendition_id, key, content_hash, WAVEFORM, WAVEFORM_VERSION)
+            if rendition_id is None:
+                return
+            try:
+                storage_key, size, details = await _build(content_hash, local_source_path)
+            except Exception as e:
+                logger.error(f"Failed to compute waveform for {key}: {e}")
+                await asyncio.to_thread(fail_rendition, rendition_id, str(e))
+                return
+            await asyncio.to_thread(complete_rendition, rendition_id, storage_key, size, details)
+        logger.info(f"Computed waveform peaks for {key} ({len(details['samples_per_pixel'])} levels, {size} bytes)")
+    except FileNotFoundError:
+        logger.warning(f"Audio not found in storage, skipping waveform: {audio_path}")
+    except Exception as e:
+        logger.error(f"Waveform job failed for {audio_path}: {e}")
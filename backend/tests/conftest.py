@@ -0,0 +1,9 @@
+import os
+import sys
+
+# backend/ のモジュール（config, services など）をテストから import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# DBやGeminiに接続しない純粋な処理だけをテストする（設定の読み込みに必要な値のみ与える）
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("GEMINI_API_KEY", "test")
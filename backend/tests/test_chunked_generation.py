@@ -0,0 +1,68 @@
+import pytest
+
+from config import settings
+from services.chunked_generation import merge_segment_steps, plan_segments
+
+
+@pytest.fixture(autouse=True)
+def segment_settings(monkeypatch):
+    monkeypatch.setattr(settings, "generation_segment_seconds", 300)
+    monkeypatch.setattr(settings, "generation_segment_boundary_window_seconds", 30.0)
+    monkeypatch.setattr(settings, "generation_segment_dedup_seconds", 5.0)
+
+
+def step(title, time, action=""):
+    return {"title": title, "action": action, "screen": "", "notes": "", "verification": "", "time": time}
+
+
+def test_plan_segments_short_video_is_one_segment():
+    assert plan_segments(200.0, []) == [(0.0, 200.0)]
+
+
+def test_plan_segments_splits_evenly_without_candidates():
+    assert plan_segments(900.0, []) == [(0.0, 300.0), (300.0, 600.0), (600.0, 900.0)]
+
+
+def test_plan_segments_snaps_to_nearest_candidate_in_window():
+    # 320 は 300 に最も近い候補、650 は 600 から窓の外
+    assert plan_segments(900.0, [250.0, 320.0, 650.0]) == [(0.0, 320.0), (320.0, 600.0), (600.0, 900.0)]
+
+
+def test_plan_segments_keeps_cuts_apart(monkeypatch):
+    monkeypatch.setattr(settings, "generation_segment_seconds", 30)
+    # 2つ目の区切りは1つ目から窓の幅以上離れた候補しか使わない（55 は 40 に近すぎる）
+    assert plan_segments(90.0, [40.0, 55.0]) == [(0.0, 40.0), (40.0, 60.0), (60.0, 90.0)]
+
+
+def test_merge_offsets_times_and_renumbers():
+    merged = merge_segment_steps([
+        ((0.0, 300.0), [step("ステップ1: ログイン", "0:10"), step("ステップ2: 検索", "4:00")]),
+        ((300.0, 600.0), [step("ステップ1: 保存", "1:00")]),
+    ])
+    assert [s["time"] for s in merged] == ["0:10", "4:00", "6:00"]
+    assert [s["title"] for s in merged] == ["ステップ1: ログイン", "ステップ2: 検索", "ステップ3: 保存"]
+
+
+def test_merge_clamps_times_to_segment_end():
+    merged = merge_segment_steps([((0.0, 300.0), [step("Step 1: Open", "5:30")])])
+    assert merged[0]["time"] == "5:00"
+
+
+def test_merge_drops_step_repeated_across_boundary():
+    merged = merge_segment_steps([
+        ((0.0, 300.0), [step("ステップ1: 設定を開く", "4:58", "設定ボタンをクリック")]),
+        ((300.0, 600.0), [
+            step("ステップ1: 設定を開く", "0:01", "設定ボタンをクリック"),
+            step("ステップ2: 保存", "0:30", "保存を押す"),
+        ]),
+    ])
+    assert [s["title"] for s in merged] == ["ステップ1: 設定を開く", "ステップ2: 保存"]
+    assert merged[1]["time"] == "5:30"
+
+
+def test_merge_keeps_different_step_at_boundary():
+    merged = merge_segment_steps([
+        ((0.0, 300.0), [step("ステップ1: 設定を開く", "4:58", "設定ボタンをクリック")]),
+        ((300.0, 600.0), [step("ステップ1: ファイルをアップロード", "0:01", "CSVを選択する")]),
+    ])
+    assert len(merged) == 2
@@ -0,0 +1,45 @@
+from services.idle_trimming import kept_segments, remap_steps, to_original, trimmed_duration
+
+
+def test_kept_segments_between_idle():
+    assert kept_segments(100.0, [(10.0, 20.0), (50.0, 70.0)]) == [(0.0, 10.0), (20.0, 50.0), (70.0, 100.0)]
+
+
+def test_kept_segments_idle_at_edges():
+    assert kept_segments(100.0, [(0.0, 10.0), (90.0, 100.0)]) == [(10.0, 90.0)]
+
+
+def test_kept_segments_overlapping_idle():
+    assert kept_segments(100.0, [(10.0, 30.0), (20.0, 40.0)]) == [(0.0, 10.0), (40.0, 100.0)]
+
+
+def test_kept_segments_without_idle():
+    assert kept_segments(100.0, []) == [(0.0, 100.0)]
+
+
+def test_to_original_maps_into_kept_segments():
+    kept = [(0.0, 10.0), (20.0, 50.0), (70.0, 100.0)]
+    assert trimmed_duration(kept) == 70.0
+    assert to_original(5.0, kept) == 5.0
+    assert to_original(15.0, kept) == 25.0
+    assert to_original(45.0, kept) == 75.0
+
+
+def test_to_original_boundary_belongs_to_next_segment():
+    # カットした停止区間の直後（次の区間の先頭）に対応させる
+    assert to_original(10.0, [(0.0, 10.0), (20.0, 50.0)]) == 20.0
+
+
+def test_to_original_past_end_clamps_to_last_segment():
+    assert to_original(200.0, [(0.0, 10.0), (20.0, 50.0)]) == 50.0
+
+
+def test_to_original_without_kept_segments():
+    assert to_original(12.0, []) == 12.0
+
+
+def test_remap_steps_rewrites_time_only():
+    steps = [{"title": "ステップ1", "time": "0:15"}, {"title": "ステップ2", "time": ""}]
+    remapped = remap_steps(steps, [(0.0, 10.0), (20.0, 50.0)])
+    assert remapped == [{"title": "ステップ1", "time": "0:25"}, {"title": "ステップ2", "time": ""}]
+    assert steps[0]["time"] == "0:15"
@@ -0,0 +1,63 @@
+from services.gemini_service import StepStreamParser
+
+MANUAL = """# 経費精算の手順
+
+### ステップ1: ログイン
+- **操作手順**: メールアドレスとパスワードを入力する
+- **時間**: 0:05
+- **画面**: ログイン画面
+
+### ステップ2: 申請を作成
+- **操作手順**: 「新規申請」をクリックする
+- **時間**: 0:42
+- **注意点**: 下書きは自動保存される
+- **確認事項**: 申請番号が表示される
+"""
+
+
+def test_parses_steps_in_one_chunk():
+    parser = StepStreamParser()
+    completed = parser.feed(MANUAL)
+    assert [s["title"] for s in completed] == ["ステップ1: ログイン"]
+
+    completed = parser.finish()
+    assert [s["title"] for s in completed] == ["ステップ2: 申請を作成"]
+    assert parser.steps[0] == {
+        "title": "ステップ1: ログイン",
+        "action": "メールアドレスとパスワードを入力する",
+        "screen": "ログイン画面",
+        "notes": "",
+        "verification": "",
+        "time": "0:05",
+    }
+    assert parser.steps[1]["notes"] == "下書きは自動保存される"
+    assert parser.steps[1]["verification"] == "申請番号が表示される"
+
+
+def test_chunk_boundaries_do_not_change_result():
+    whole = StepStreamParser()
+    whole.feed(MANUAL)
+    whole.finish()
+
+    # ストリームは行の途中で区切られて届く
+    streamed = StepStreamParser()
+    for index in range(0, len(MANUAL), 7):
+        streamed.feed(MANUAL[index:index + 7])
+    streamed.finish()
+    assert streamed.steps == whole.steps
+
+
+def test_step_completes_when_next_header_arrives():
+    parser = StepStreamParser()
+    assert parser.feed("### Step 1: Open\n- **Action**: Click the menu\n") == []
+    completed = parser.feed("### Step 2: Save\n")
+    assert completed == [parser.steps[0]]
+    assert parser.steps[0]["action"] == "Click the menu"
+
+
+def test_finish_flushes_last_line_without_newline():
+    parser = StepStreamParser()
+    parser.feed("### Step 1: Open\n- **Time**: 1:23")
+    completed = parser.finish()
+    assert completed[0]["time"] == "1:23"
+    assert parser.finish() == []
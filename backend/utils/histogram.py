@@ -0,0 +1,34 @@
+"""
+固定バケットのヒストグラム（プロセス内の処理時間の記録用）
+
+バケットごとの件数と観測値の合計・件数を持つ（snapshot は Prometheus と同じ累積件数）。
+分位点は Prometheus 側で histogram_quantile を使って求める。
+"""
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Sequence
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets: List[float] = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # 最後は +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._counts[bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            counts = list(self._counts)
+            total, total_sum = self._count, self._sum
+        cumulative, running = {}, 0
+        for bound, count in zip(self.buckets + [float("inf")], counts):
+            running += count
+            cumulative["+Inf" if bound == float("inf") else f"{bound:g}"] = running
+        return {"count": total, "sum": round(total_sum, 3), "buckets": cumulative}
@@ -0,0 +1,30 @@
+"""
+キーごとの asyncio.Lock
+
+同じ出力キーの変換（プロキシ作成・アイドル区間のカット）を1つのタスクに絞るために使う。
+ロックは使っているタスク（保持中と待機中）の数を数え、誰も使わなくなった時点で破棄する。
+解放直後は待機中のタスクがまだ取得していないため、lock.locked() では判定できない。
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict
+
+
+class KeyedLock:
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._users: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: str) -> AsyncIterator[None]:
+        """キーのロックを取得して処理する（同じキーの処理は順番に実行される）"""
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
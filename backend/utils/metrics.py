@@ -0,0 +1,158 @@
+"""
+Prometheus 形式のメトリクス（プロセス内の記録とテキスト形式への書き出し）
+
+- リクエストの処理時間はルートのテンプレート（/api/manuals/{manual_id}）・メソッド・
+  ステータスの種類（2xx など）ごとのヒストグラムに記録する。ラベルの種類を抑えるため
+  実際のパスやステータスコードはラベルにせず、どのルートにも一致しないリクエストは
+  "unmatched" にまとめる。
+- asyncio.to_thread の処理は InstrumentedThreadPoolExecutor で実行中・待ち行列の件数を数える。
+- 値が記録時ではなく取得時に決まるもの（DBプールの使用数など）は render の gauges で渡す。
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from utils.histogram import Histogram
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    return f"{value:.6g}" if isinstance(value, float) else str(value)
+
+
+class LabelledHistogram:
+    """ラベルの組み合わせごとの Histogram"""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series: Dict[Labels, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        histogram = self._series.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._series.setdefault(key, Histogram(self.buckets))
+        histogram.observe(value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, histogram in sorted(self._series.items()):
+            snapshot = histogram.snapshot()
+            for bound, count in snapshot["buckets"].items():
+                lines.append(f"{self.name}_bucket{_labels(key, ('le', bound))} {count}")
+            lines.append(f"{self.name}_sum{_labels(key)} {_number(float(snapshot['sum']))}")
+            lines.append(f"{self.name}_count{_labels(key)} {snapshot['count']}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+
+def render_gauge(name: str, help_text: str, samples: Iterable[Tuple[Dict[str, str], float]]) -> List[str]:
+    """取得時に求めた値をゲージとして書き出す（samples は (ラベル, 値) の列）"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {_number(value)}")
+    return lines
+
+
+class InstrumentedThreadPoolExecutor(ThreadPoolExecutor):
+    """実行中の件数と空きスレッド待ちの件数を数える ThreadPoolExecutor（asyncio の既定 executor 用）"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.active = 0
+        self._count_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        def run():
+            with self._count_lock:
+                self.active += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._count_lock:
+                    self.active -= 1
+
+        return super().submit(run)
+
+    @property
+    def queued(self) -> int:
+        return self._work_queue.qsize()
+
+
+class MetricsMiddleware:
+    """
+    リクエストの処理時間（レスポンスの送信完了まで）を記録する ASGI ミドルウェア
+
+    ルートのテンプレートはルーティング後に FastAPI が scope["route"] に設定する値を使う。
+    """
+
+    def __init__(self, app, histogram: "LabelledHistogram"):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            self.histogram.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=getattr(route, "path", None) or "unmatched",
+                status=f"{status // 100}xx",
+            )
+
+
+# Create global instance
+request_duration = LabelledHistogram(
+    "torisetsu_http_request_duration_seconds",
+    "HTTP request latency by route template, method and status class",
+    REQUEST_BUCKETS,
+)
+upload_bytes = Counter("torisetsu_upload_bytes_total", "Bytes received by video/audio uploads")
@@ -0,0 +1,45 @@
+"""
+タイムコード（"m:ss" / "h:mm:ss"）と秒数の相互変換
+
+マニュアルの各ステップの `time` はGeminiが "1:23" の形式で返すため、
+動画処理で使う秒数との変換をここにまとめる。
+"""
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+_TIMECODE_PATTERN = re.compile(r"^\s*(?:(\d+):)?(\d+):(\d+(?:\.\d+)?)\s*$")
+_SECONDS_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(?:s|秒)?\s*$")
+
+
+def parse_timecode(value: Optional[str]) -> Optional[float]:
+    """タイムコードを秒数に変換（解釈できない場合はNone）"""
+    if not value:
+        return None
+    match = _TIMECODE_PATTERN.match(value)
+    if match:
+        hours, minutes, seconds = match.groups()
+        return int(hours or 0) * 3600 + int(minutes) * 60 + float(seconds)
+    match = _SECONDS_PATTERN.match(value)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def format_timecode(seconds: float) -> str:
+    """秒数を "m:ss"（1時間以上は "h:mm:ss"）に変換"""
+    total = max(int(seconds), 0)
+    hours, remainder = divmod(total, 3600)
+    minutes, secs = divmod(remainder, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
+
+
+def step_times(steps: Iterable[Dict[str, Any]]) -> List[float]:
+    """ステップ一覧から開始時刻（秒、重複なし・昇順）を取り出す"""
+    times = set()
+    for step in steps or []:
+        seconds = parse_timecode(step.get("time")) if isinstance(step, dict) else None
+        if seconds is not None:
+            times.add(round(seconds, 3))
+    return sorted(times)
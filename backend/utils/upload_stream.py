@@ -0,0 +1,163 @@
+"""
+ストリーミングアップロード用のユーティリティ
+
+アップロードされたファイルを固定サイズのチャンク単位でディスクへ書き込み、
+上限サイズを超えた時点で 413 を返して処理を打ち切る。
+"""
+import os
+import logging
+from typing import Any, AsyncIterator, Dict, Optional
+
+import aiofiles
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from config import settings
+from utils.metrics import upload_bytes
+
+logger = logging.getLogger(__name__)
+
+# multipart の境界やヘッダー分として許容する余白
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+def _too_large_detail(max_size: int) -> str:
+    return f"File size exceeds maximum allowed size of {max_size / 1024 / 1024}MB"
+
+
+async def iter_upload_file(file: UploadFile, chunk_size: Optional[int] = None) -> AsyncIterator[bytes]:
+    """UploadFile をチャンク単位で読み出す"""
+    chunk_size = chunk_size or settings.upload_chunk_size
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def write_stream_to_file(
+    chunks: AsyncIterator[bytes],
+    dest_path: str,
+    max_size: int,
+    append: bool = False,
+    start_size: int = 0,
+    hasher: Optional[Any] = None
+) -> int:
+    """
+    チャンクのストリームをファイルに書き込む
+
+    上限を超えた時点で書き込み途中のファイルを削除して 413 を送出する。
+    append=True の場合は既存ファイルに追記し、start_size を既存のバイト数として扱う。
+    hasher（hashlib オブジェクト）を渡すと書き込みと同時にハッシュを計算する。
+
+    Returns:
+        書き込み後のファイルサイズ（バイト）
+    """
+    written = start_size
+    mode = "ab" if append else "wb"
+    try:
+        async with aiofiles.open(dest_path, mode) as buffer:
+            async for chunk in chunks:
+                written += len(chunk)
+                upload_bytes.inc(len(chunk))
+                if written > max_size:
+                    raise HTTPException(status_code=413, detail=_too_large_detail(max_size))
+                if hasher is not None:
+                    hasher.update(chunk)
+                await buffer.write(chunk)
+    except HTTPException:
+        if not append and os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    except Exception as e:
+        if not append and os.path.exists(dest_path):
+            os.remove(dest_path)
+        logger.error(f"Failed to write upload stream to {dest_path}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
+    return written
+
+
+async def save_upload_file(
+    file: UploadFile,
+    dest_path: str,
+    max_size: int,
+    hasher: Optional[Any] = None
+) -> int:
+    """UploadFile をストリーミングで保存し、保存したバイト数を返す"""
+    try:
+        return await write_stream_to_file(iter_upload_file(file), dest_path, max_size, hasher=hasher)
+    finally:
+        await file.close()
+
+
+class RequestSizeLimitMiddleware:
+    """
+    パスごとにリクエストボディのサイズ上限を課す ASGI ミドルウェア
+
+    Content-Length が上限を超えていればボディを読む前に 413 を返す。
+    Content-Length が無い（chunked）場合も受信したバイト数を数え、
+    上限を超えた時点で 413 を送出して受信を打ち切る。
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limits.get(scope["path"].rstrip("/"))
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    break
+                if content_length > limit:
+                    response = JSONResponse(
+                        status_code=413,
+                        content={"detail": _too_large_detail(limit - MULTIPART_OVERHEAD)}
+                    )
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+        exceeded = False
+        detail = _too_large_detail(limit - MULTIPART_OVERHEAD)
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        async def limited_send(message):
+            # ボディ解析中の例外はFastAPI側で400に変換されるため、413に差し替える
+            if exceeded and message["type"] == "http.response.start":
+                body = JSONResponse(status_code=413, content={"detail": detail}).body
+                await send({
+                    "type": "http.response.start",
+                    "status": 413,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                    ],
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+            if exceeded and message["type"] == "http.response.body":
+                return
+            await send(message)
+
+        await self.app(scope, limited_receive, limited_send)
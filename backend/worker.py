@@ -0,0 +1,62 @@
+"""
+Generation worker process
+
+Runs manual generation jobs queued by the API (see services.generation_queue).
+Start as many as needed next to the API server:
+
+    python worker.py [--concurrency N]
+"""
+import signal
+import asyncio
+import argparse
+import logging
+from dotenv import load_dotenv
+from config import settings
+from services.generation_queue import run_worker
+from services.gemini_files import gemini_file_cleanup_loop
+from services.generation_runs import generation_run_flush_loop
+from services.media_gc import media_gc_loop
+
+# .envファイルから環境変数を読み込む
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+async def run(concurrency: int):
+    # SIGTERM（docker stop）でも SIGINT と同じくキャンセルし、実行中のジョブをキューに戻してから終了する
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, main_task.cancel)
+    
+    # アップロード済み Gemini ファイルの掃除もワーカーで行う
+    cleanup = asyncio.create_task(gemini_file_cleanup_loop())
+    # Gemini 呼び出しの段階ごとの記録をまとめて書き込む（停止時は残りを書き込んでから終了する）
+    flush = asyncio.create_task(generation_run_flush_loop())
+    # 参照されなくなったメディアを削除（削除キューの処理と定期的なストレージ照合）
+    # API のイベントループを止めないようワーカーで行い、複数ワーカーでは advisory lock で1つに絞る
+    media_gc = asyncio.create_task(media_gc_loop()) if settings.media_gc_enabled else None
+    try:
+        await run_worker(concurrency=concurrency)
+    except asyncio.CancelledError:
+        logging.getLogger(__name__).info("Generation worker stopped")
+    finally:
+        cleanup.cancel()
+        if media_gc:
+            media_gc.cancel()
+        flush.cancel()
+        await asyncio.gather(flush, return_exceptions=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run manual generation jobs")
+    parser.add_argument("--concurrency", type=int, default=settings.generation_worker_concurrency,
+                        help="jobs run at the same time by this process")
+    options = parser.parse_args()
+    
+    try:
+        asyncio.run(run(options.concurrency))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -39,5 +39,58 @@ client.interceptors.response.use(
   }
 );
 
+// マニュアルのステータス変更を受け取る（Server-Sent Events。認証ヘッダーを付けるため fetch で読む）
+export const subscribeManualStatus = (
+  manualId: string,
+  onStatus: (status: any) => void
+): (() => void) => {
+  const controller = new AbortController();
+  let retryDelay = 1000;
+
+  const connect = async () => {
+    while (!controller.signal.aborted) {
+      try {
+        const token = localStorage.getItem('token');
+        const response = await fetch(`${API_URL}/api/manuals/${manualId}/events`, {
+          headers: token ? { Authorization: `Bearer ${token}` } : {},
+          signal: controller.signal,
+        });
+        if (!response.ok || !response.body) {
+          if (response.status === 401 || response.status === 403 || response.status === 404) return;
+          throw new Error(`status stream failed: ${response.status}`);
+        }
+        retryDelay = 1000;
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const events = buffer.split('\n\n');
+          buffer = events.pop() || '';
+          events.forEach((event) => {
+            const data = event
+              .split('\n')
+              .filter((line) => line.startsWith('data: '))
+              .map((line) => line.slice(6))
+              .join('\n');
+            if (data) onStatus(JSON.parse(data));
+          });
+        }
+      } catch (err) {
+        if (controller.signal.aborted) return;
+        console.error('Manual status stream disconnected:', err);
+      }
+      // 切断された場合は間隔を空けて再接続する
+      await new Promise((resolve) => setTimeout(resolve, retryDelay));
+      retryDelay = Math.min(retryDelay * 2, 30000);
+    }
+  };
+
+  connect();
+  return () => controller.abort();
+};
 
 export default client;
\ No newline at end of file
@@ -0,0 +1,35 @@
+import { ManualRenditions } from '../types'
+
+const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000'
+
+export interface VideoSource {
+  src: string
+  type?: string
+}
+
+// APIが返すメディアのパス（/uploads/...）をURLに変換
+export const getMediaUrl = (path: string) => `${API_URL}${path}`
+
+// アップロード済みの元動画のURL
+export const getUploadUrl = (filePath: string) => `${API_URL}/uploads/${filePath.split('/').pop()}`
+
+// <source> の候補を優先順に返す（ブラウザは再生できない type をスキップする）
+// ステップ位置揃えMP4（ステップへのシークが即時）→ HLS（Safari/モバイルでネイティブ再生）→ faststart MP4 → 元動画
+export const getVideoSources = (filePath: string, renditions?: ManualRenditions | null): VideoSource[] => {
+  const sources: VideoSource[] = []
+  if (renditions?.step_aligned_url) {
+    sources.push({ src: `${API_URL}${renditions.step_aligned_url}`, type: 'video/mp4' })
+  }
+  if (renditions?.hls_url) {
+    sources.push({ src: `${API_URL}${renditions.hls_url}`, type: 'application/vnd.apple.mpegurl' })
+  }
+  if (renditions?.faststart_url) {
+    sources.push({ src: `${API_URL}${renditions.faststart_url}`, type: 'video/mp4' })
+  }
+  sources.push({ src: getUploadUrl(filePath) })
+  return sources
+}
+
+// サムネイル用（先頭付近だけ読めばよいので faststart MP4 を優先）
+export const getPreviewUrl = (filePath: string, renditions?: ManualRenditions | null) =>
+  `${renditions?.faststart_url ? `${API_URL}${renditions.faststart_url}` : getUploadUrl(filePath)}#t=1`
@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useCallback } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
-import client from '../api/client';
+import client, { subscribeManualStatus } from '../api/client';
 import toast from 'react-hot-toast';
 import Button from '../components/ui/Button';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '../components/ui/Card';
@@ -20,7 +20,8 @@ import {
 } from '../components/ui/Icons';
 import Header from '../components/ui/Header';
 import { getStatusColor } from '../lib/status-colors';
-import { ManualStatus } from '../types';
+import { ManualStatus, ManualRenditions } from '../types';
+import { getMediaUrl, getVideoSources } from '../lib/media';
 import './ManualEditor.css';
 
 interface Manual {
@@ -30,6 +31,7 @@ interface Manual {
   status: ManualStatus;
   video_file_path?: string;
   audio_file_path?: string;
+  renditions?: ManualRenditions | null;
   project_id: number;
   version?: string;
   created_at?: string;
@@ -68,6 +70,8 @@ const ManualEditor: React.FC = () => {
   const [currentStepIndex, setCurrentStepIndex] = useState<number | null>(null);
   const [shareUrl, setShareUrl] = useState<string | null>(null);
   const [shareLoading, setShareLoading] = useState(false);
+  const [stepThumbnails, setStepThumbnails] = useState<Record<string, string>>({});
+  const [partialSteps, setPartialSteps] = useState<ManualContent['steps']>([]);
 
 
   // シェア機能
@@ -164,30 +168,55 @@ const ManualEditor: React.FC = () => {
       }
     };
 
-    const checkManualStatus = async () => {
-      try {
-        const response = await client.get(`/api/manuals/${id}/status`);
-        if (response.data.status !== manual?.status) {
-          fetchManual(); // Refresh full manual data
-        }
-      } catch (err) {
-        console.error('Failed to check manual status:', err);
+    const handleStatus = (status: any) => {
+      // 生成中に完成したステップを順次表示する
+      setPartialSteps(status.job?.partial_steps || []);
+      if (status.status !== manual?.status) {
+        fetchManual(); // Refresh full manual data
       }
     };
 
     if (id) {
       fetchManual();
-      // Poll for status updates if manual is processing
-      const interval = setInterval(() => {
-        if (manual?.status === ManualStatus.PROCESSING) {
-          checkManualStatus();
-        }
-      }, 3000);
-      
-      return () => clearInterval(interval);
+      // 生成中はサーバーから送られるステータス変更を受け取る
+      if (manual?.status === ManualStatus.PROCESSING) {
+        return subscribeManualStatus(id, handleStatus);
+      }
     }
   }, [id, manual?.status]);
 
+  // ステップのサムネイルを取得（未作成の分はサーバー側で作成されるため、少し待って再取得する）
+  useEffect(() => {
+    if (!id || !manual?.video_file_path || !manual.content) return;
+
+    let attempts = 0;
+    let timer: ReturnType<typeof setTimeout> | undefined;
+    const fetchThumbnails = async () => {
+      try {
+        const response = await client.get(`/api/manuals/${id}/thumbnails`);
+        const thumbnails: Record<string, string> = {};
+        let pending = false;
+        response.data.steps.forEach((step: { time?: string; thumbnail_url?: string | null }) => {
+          if (!step.time) return;
+          if (step.thumbnail_url) {
+            thumbnails[step.time] = getMediaUrl(step.thumbnail_url);
+          } else {
+            pending = true;
+          }
+        });
+        setStepThumbnails(thumbnails);
+        if (pending && ++attempts < 5) {
+          timer = setTimeout(fetchThumbnails, 3000);
+        }
+      } catch (err) {
+        console.error('Failed to fetch step thumbnails:', err);
+      }
+    };
+    fetchThumbnails();
+
+    return () => clearTimeout(timer);
+  }, [id, manual?.video_file_path, manual?.content]);
+
   const handleGenerateManual = useCallback(async () => {
     if (!manual?.video_file_path) {
       setError('動画ファイルが関連付けられていません');
@@ -411,6 +440,15 @@ const ManualEditor: React.FC = () => {
                 <span className="flex items-center justify-center w-6 h-6 rounded-full bg-primary text-primary-foreground text-xs font-bold mt-0.5">
                   {index + 1}
                 </span>
+                {!isEditing && step.time && stepThumbnails[step.time] && (
+                  <img
+                    src={stepThumbnails[step.time]}
+                    alt=""
+                    loading="lazy"
+                    className="w-24 rounded border border-border flex-shrink-0 cursor-pointer"
+                    onClick={() => handleTimeClick(step.time!)}
+                  />
+                )}
                 <div className="flex-1 min-w-0">
                   <div className="flex items-center justify-between mb-1">
                     {isEditing ? (
@@ -682,10 +720,9 @@ const ManualEditor: React.FC = () => {
                   className="w-full rounded-lg shadow-xl border border-border"
                   style={{ maxHeight: '500px' }}
                 >
-                  <source 
-                    src={`${process.env.REACT_APP_API_URL || 'http://localhost:8000'}/uploads/${manual.video_file_path.split('/').pop()}`} 
-                    type="video/mp4" 
-                  />
+                  {getVideoSources(manual.video_file_path, manual.renditions).map((source) => (
+                    <source key={source.src} src={source.src} type={source.type} />
+                  ))}
                   お使いのブラウザは動画再生に対応していません。
                 </video>
               </div>
@@ -761,6 +798,33 @@ const ManualEditor: React.FC = () => {
 
           {/* 右側: マニュアル内容 */}
           <div className="space-y-6">
+            {manual.status === ManualStatus.PROCESSING && partialSteps.length > 0 && (
+              <Card className="border-0 bg-white/70 dark:bg-slate-800/70 backdrop-blur-xl shadow-2xl shadow-amber-500/10">
+                <CardContent className="pt-6">
+                  <h3 className="text-lg font-semibold text-foreground mb-4">操作手順（生成中）</h3>
+                  <div className="space-y-3">
+                    {partialSteps.map((step, index) => (
+                      <div key={index} className="p-3 rounded-lg border border-border">
+                        <div className="flex items-center justify-between mb-1">
+                          <h4 className="text-sm font-medium text-foreground">
+                            {step.title.replace(/^ステップ\d+:\s*/, '')}
+                          </h4>
+                          {step.time && (
+                            <button
+                              onClick={() => handleTimeClick(step.time!)}
+                              className="px-2 py-1 text-xs font-mono text-amber-600 hover:text-amber-800 bg-amber-50 hover:bg-amber-100 border border-amber-200 rounded cursor-pointer transition-colors flex-shrink-0"
+                            >
+                              {step.time}
+                            </button>
+                          )}
+                        </div>
+                        <p className="text-sm text-muted-foreground leading-relaxed">{step.action}</p>
+                      </div>
+                    ))}
+                  </div>
+                </CardContent>
+              </Card>
+            )}
             {manual.status === 'completed' && manual.content && (
               <Card className="border-0 bg-white/70 dark:bg-slate-800/70 backdrop-blur-xl shadow-2xl shadow-amber-500/10">
                 <CardContent className="pt-6">
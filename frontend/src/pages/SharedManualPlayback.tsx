@@ -7,6 +7,8 @@ import {
   CheckCircleIcon,
   ClockIcon
 } from '../components/ui/Icons';
+import { ManualRenditions } from '../types';
+import { getVideoSources } from '../lib/media';
 import './ManualPlayback.css';
 
 interface Manual {
@@ -16,6 +18,7 @@ interface Manual {
   status: string;
   video_file_path?: string;
   audio_file_path?: string;
+  renditions?: ManualRenditions | null;
   project_id: number;
 }
 
@@ -238,10 +241,9 @@ const SharedManualPlayback: React.FC = () => {
             }
           }}
         >
-          <source 
-            src={`${process.env.REACT_APP_API_URL || 'http://localhost:8000'}/uploads/${manual.video_file_path.split('/').pop()}`} 
-            type="video/mp4" 
-          />
+          {getVideoSources(manual.video_file_path, manual.renditions).map((source) => (
+            <source key={source.src} src={source.src} type={source.type} />
+          ))}
           お使いのブラウザは動画再生に対応していません。
         </video>
 
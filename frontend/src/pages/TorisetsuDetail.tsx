@@ -5,6 +5,7 @@ import { useAuth } from '../contexts/AuthContext';
 import { useLanguage } from '../contexts/LanguageContext';
 import client from '../api/client';
 import { Torisetsu, Manual, ManualStatus } from '../types';
+import { getPreviewUrl } from '../lib/media';
 import Button from '../components/ui/Button';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '../components/ui/Card';
 import { Badge } from '../components/ui/badge';
@@ -402,10 +403,7 @@ const TorisetsuDetail: React.FC = () => {
           preload="metadata"
           muted
         >
-          <source 
-            src={`${process.env.REACT_APP_API_URL || 'http://localhost:8000'}/uploads/${manual.video_file_path.split('/').pop()}#t=1`} 
-            type="video/mp4" 
-          />
+          <source src={getPreviewUrl(manual.video_file_path, manual.renditions)} />
         </video>
       )}
 
@@ -33,6 +33,25 @@ export interface Torisetsu {
   manual_count?: number;
 }
 
+export interface ManualRenditions {
+  status: 'pending' | 'processing' | 'ready' | 'failed';
+  faststart_url?: string | null;
+  hls_url?: string | null;
+  step_aligned_url?: string | null;
+  keyframes?: number[] | null;
+}
+
+export interface MediaMetadata {
+  duration?: number | null;
+  width?: number | null;
+  height?: number | null;
+  fps?: number | null;
+  video_codec?: string | null;
+  audio_codec?: string | null;
+  bit_rate?: number | null;
+  format_name?: string | null;
+}
+
 export interface Manual {
   id: string;
   torisetsu_id: string;
@@ -41,6 +60,9 @@ export interface Manual {
   status: ManualStatus;
   version: string;
   video_file_path?: string;
+  renditions?: ManualRenditions | null;
+  video_metadata?: MediaMetadata | null;
+  audio_metadata?: MediaMetadata | null;
   created_at: string;
   updated_at: string;
 }